@@ -1,7 +1,9 @@
 """
 ASGI config for budget project.
 
-It exposes the ASGI callable as a module-level variable named ``application``.
+It exposes the ASGI callable as a module-level variable named ``application``,
+using the ASGI profile (budget/settings_asgi.py) unless DJANGO_SETTINGS_MODULE
+says otherwise.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -11,6 +13,6 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'budget.settings')
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'budget.settings_asgi')
 
 application = get_asgi_application()
@@ -41,11 +41,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'budget_app.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'budget_app.sharding.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -92,6 +94,69 @@ DATABASES = {
 #     }
 # }
 
+# Read replica
+# Add a streaming replica of the primary as DATABASES['replica'] to serve the reports,
+# charts and period views from it, e.g.
+#     'replica': {**DATABASES['default'], 'HOST': 'replica.internal', 'TEST': {'MIRROR': 'default'}},
+# A user's reads stay on the primary for REPLICA_PIN_SECONDS after they change their
+# data, and all reads do while the replica is more than REPLICA_MAX_LAG_SECONDS behind
+# (checked every REPLICA_LAG_CHECK_SECONDS). See budget/settings_replica.py for a local
+# setup with two SQLite files.
+
+DATABASE_ROUTERS = ['budget_app.sharding.ShardRouter', 'budget_app.routers.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+REPLICA_PIN_SECONDS = 10
+REPLICA_MAX_LAG_SECONDS = 10
+REPLICA_LAG_CHECK_SECONDS = 5
+
+# Shards
+# List database aliases in SHARDS to spread users' expenses, incomes, budgets,
+# recurring rules, ledger and rollups across them by user; users, categories and
+# sessions stay in the default database, which may be one of the shards. Run
+# migrate_shards instead of migrate, and rebalance_shards to move users. See
+# budget/settings_shards.py for a local setup with SQLite files. A move turns away
+# the user's writes and then waits SHARD_MOVE_SETTLE_SECONDS, which should exceed
+# the longest write request, before copying.
+
+SHARDS = []
+SHARD_MOVE_SETTLE_SECONDS = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Summary and chart data are cached under a per-user data version that is bumped on
+# every change, so any backend works; use a shared one (e.g. Redis or Memcached)
+# when running several processes, or FileBasedCache at a shared path.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'budget',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+
+# Metrics
+# Per-route latency, SQL and cache metrics are served in the Prometheus format at
+# /metrics to staff users, to a scraper sending METRICS_TOKEN as a bearer token
+# (set it to a long random secret) and to the addresses in METRICS_ALLOWED_IPS.
+# Only list addresses that reach Django directly: behind a reverse proxy every
+# request comes from the proxy. A request repeating one query shape this many
+# times is logged as a likely N+1 pattern.
+
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = []
+METRICS_N_PLUS_ONE_THRESHOLD = 10
+
+
+# Reports
+# Under the ASGI profile (budget/settings_asgi.py) PDF reports are rendered on a pool
+# of this many threads per process; further PDF requests wait for a free thread.
+
+REPORT_WORKERS = 2
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -133,6 +198,30 @@ STATICFILES_DIRS = [
 ]
 
 
+# PDF reports
+# Sections are split into parts of about PDF_REPORT_ROWS_PER_PART rows and rendered
+# in a pool of PDF_REPORT_WORKERS processes, started once per web process (1 renders
+# in the request process). Parts are merged one at a time, so the part size also
+# bounds the memory a report needs.
+
+PDF_REPORT_WORKERS = 4
+PDF_REPORT_ROWS_PER_PART = 5000
+
+
+# Recurring rules
+# Adding a rule creates at most RECURRING_REQUEST_LIMIT of its due occurrences in the
+# request; the materialize_recurring command, run e.g. from cron, creates the rest.
+
+RECURRING_REQUEST_LIMIT = 100
+
+
+# Archive
+# Closed years moved out of the expense and income tables by the archive_years
+# command are stored as one file per user and year below ARCHIVE_ROOT.
+
+ARCHIVE_ROOT = os.path.join(BASE_DIR, 'archive')
+
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,18 @@
+"""
+ASGI deployment profile of the budget project.
+
+Serves the chart data, list fragments, budget summary and report exports with the
+async views of budget_app/async_views.py (see budget/urls_asgi.py), so a slow export
+or chart query waits on the database without holding a worker. Every other page is
+the same sync view as under WSGI. Run it with an ASGI server, e.g.:
+
+    gunicorn budget.asgi:application -k uvicorn.workers.UvicornWorker --workers 4
+
+Blocking database work of each request runs on a thread of its own, so one process
+may hold as many database connections as it has requests in flight; keep
+CONN_MAX_AGE at 0 and put a connection pooler (e.g. PgBouncer) in front of
+PostgreSQL instead of raising max_connections.
+"""
+from .settings import *  # noqa: F401,F403
+
+ROOT_URLCONF = 'budget.urls_asgi'
@@ -0,0 +1,25 @@
+"""
+Local read-replica profile of the budget project.
+
+Two SQLite files stand in for a primary and its replica. SQLite does not replicate,
+so copy the primary into the replica with
+
+    python manage.py sync_replica --settings=budget.settings_replica --interval 5
+
+and run the server with --settings=budget.settings_replica. The replica is as far
+behind as its last copy; once that exceeds REPLICA_MAX_LAG_SECONDS, reads go back to
+the primary until the next copy.
+"""
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',  # noqa: F405
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-replica.sqlite3',  # noqa: F405
+        'TEST': {'MIRROR': 'default'},
+    },
+}
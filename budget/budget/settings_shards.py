@@ -0,0 +1,41 @@
+"""
+Local sharding profile of the budget project.
+
+The default database keeps the users, categories and sessions, and two more SQLite
+files stand in for the shards holding the users' data. Set it up with
+
+    python manage.py migrate_shards --settings=budget.settings_shards
+
+and run the server with --settings=budget.settings_shards. Move a user to the other
+shard with
+
+    python manage.py rebalance_shards --settings=budget.settings_shards --user 1 --to shard_1
+"""
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',  # noqa: F405
+    },
+    'shard_0': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-shard-0.sqlite3',  # noqa: F405
+    },
+    'shard_1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db-shard-1.sqlite3',  # noqa: F405
+    },
+}
+
+SHARDS = ['shard_0', 'shard_1']
+
+# Reads find a user's shard through the cache, so every process must share it to
+# follow a move at once.
+CACHES = {
+    'default': {
+        **CACHES['default'],  # noqa: F405
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',  # noqa: F405
+    },
+}
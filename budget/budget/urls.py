@@ -15,12 +15,16 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.urls import path
-from budget_app import views
+from budget_app import api, views
 
 
 urlpatterns = [
     path('', views.home, name='home'),
     path('budget_summary/', views.budget_summary, name='budget_summary'),
+    path('budgets/', views.budgets_view, name='budgets'),
+    path('delete_budget/<int:budget_id>/', views.delete_budget, name='delete_budget'),
+    path('recurring/', views.recurring_view, name='recurring'),
+    path('delete_recurring/<int:rule_id>/', views.delete_recurring, name='delete_recurring'),
     path('expenses_list/', views.expenses_list, name='expenses_list'),
     path('add_expenses/', views.add_expenses, name='add_expenses'),
     path('fetch_expenses/', views.fetch_expenses, name='fetch_expenses'),
@@ -29,11 +33,19 @@ urlpatterns = [
     path('add_income/', views.add_income, name='add_income'),
     path('fetch_incomes/', views.fetch_incomes, name='fetch_incomes'),
     path('incomes_period/', views.incomes_period, name='incomes_period'),
+    path('import/', views.import_transactions, name='import_transactions'),
     path('login/', views.user_login, name='login'),
     path('register/', views.register, name='register'),
     path('logout/', views.user_logout, name='logout'),
     path('charts/', views.charts_view, name='charts'),
     path('data', views.get_data, name='get_data'),
+    path('analytics/', views.analytics_view, name='analytics'),
+    path('analytics_data/', views.analytics_data, name='analytics_data'),
+    path('search/', views.search_view, name='search'),
+    path('search_data/', views.search_data, name='search_data'),
+    path('category_breakdown/', views.category_breakdown, name='category_breakdown'),
+    path('cache_stats/', views.cache_stats_view, name='cache_stats'),
+    path('metrics', views.metrics_view, name='metrics'),
     path('categories/', views.categories_view, name='categories'),
     path('add_category/', views.add_category_view, name='add_category'),
     path('categories/expense/', views.categories_expense, name='categories_expense'),
@@ -42,5 +54,8 @@ urlpatterns = [
     path('report/', views.report_view, name='report'),
     path('generate_csv_report/', views.generate_csv_report, name='generate_csv_report'),
     path('generate_pdf_report/', views.generate_pdf_report, name='generate_pdf_report'),
+    path('export/', views.export_data, name='export_data'),
     path('atms/', views.atms_view, name='atms'),
+    path('api/<str:resource>/', api.api_list, name='api_list'),
+    path('api/<str:resource>/batch/', api.api_batch, name='api_batch'),
 ]
@@ -0,0 +1,26 @@
+"""
+URL configuration of the ASGI profile (budget/settings_asgi.py).
+
+The routes of budget/urls.py, with the data endpoints and exports served by their
+async versions.
+"""
+from django.urls import path
+from budget_app import async_views
+
+from . import urls
+
+ASYNC_VIEWS = {
+    'budget_summary': async_views.budget_summary,
+    'fetch_expenses': async_views.fetch_expenses,
+    'fetch_incomes': async_views.fetch_incomes,
+    'get_data': async_views.get_data,
+    'generate_csv_report': async_views.generate_csv_report,
+    'generate_pdf_report': async_views.generate_pdf_report,
+    'export_data': async_views.export_data,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name) if pattern.name in ASYNC_VIEWS
+    else pattern
+    for pattern in urls.urlpatterns
+]
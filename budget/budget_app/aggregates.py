@@ -0,0 +1,247 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from functools import reduce
+from operator import or_
+
+from django.db.models import F, Q, Sum
+
+from .archive import archived_totals, archived_years
+from .models import Expense, Income, MonthlyRollup
+from .registry import registry
+
+LEDGER_MODELS = {'expense': Expense, 'income': Income}
+MAX_SERIES_YEARS = 20
+
+
+def kind_total_rows(user):
+    '''
+    Return the query of a user's all-time total per kind.
+    '''
+    return MonthlyRollup.objects.filter(user=user).values('kind').annotate(total=Sum('total')).order_by()
+
+
+def kind_totals(user):
+    '''
+    Return the all-time {kind: total} of a user's expenses and incomes.
+    '''
+    return {row['kind']: row['total'] for row in kind_total_rows(user)}
+
+
+async def akind_totals(user):
+    '''
+    Async version of kind_totals().
+    '''
+    return {row['kind']: row['total'] async for row in kind_total_rows(user)}
+
+
+def available_years(user, kind='expense'):
+    '''
+    Return the sorted list of years in which the user has transactions of the given kind.
+    '''
+    return list(MonthlyRollup.objects.filter(user=user, kind=kind, count__gt=0)
+                .values_list('year', flat=True).distinct().order_by('year'))
+
+
+def monthly_rows(user, start_year, end_year):
+    '''
+    Return the query of a user's monthly totals per kind within a range of years.
+    '''
+    return MonthlyRollup.objects.filter(
+        user=user, year__range=[start_year, end_year]
+    ).values('year', 'month', 'kind').annotate(total=Sum('total')).order_by()
+
+
+def series_from_rows(rows, start_year, end_year):
+    '''
+    Return the monthly income/expense/balance series from monthly_rows() rows.
+    '''
+    totals = {(row['year'], row['month'], row['kind']): row['total'] for row in rows}
+
+    monthly_data = []
+    for year in range(start_year, end_year + 1):
+        for month in range(1, 13):
+            monthly_income = totals.get((year, month, 'income')) or 0
+            monthly_expense = totals.get((year, month, 'expense')) or 0
+            monthly_data.append({'year': year, 'month': month, 'income': monthly_income,
+                                 'expense': monthly_expense, 'balance': monthly_income - monthly_expense})
+    return monthly_data
+
+
+def parse_year_range(params):
+    '''
+    Read the year and optional end_year of a chart series request.
+
+    Raises ValueError with a message for the client when a year is missing or
+    malformed, outside 1-9999, or the range is reversed or longer than MAX_SERIES_YEARS.
+    '''
+    try:
+        year = int(params.get('year'))
+        end_year = int(params.get('end_year', year))
+    except (TypeError, ValueError):
+        raise ValueError('Please provide a valid year.')
+    if not (date.min.year <= year <= date.max.year and date.min.year <= end_year <= date.max.year):
+        raise ValueError(f'Years must be between {date.min.year} and {date.max.year}.')
+    if end_year < year:
+        raise ValueError('end_year must not be earlier than year.')
+    if end_year - year >= MAX_SERIES_YEARS:
+        raise ValueError(f'The range must not span more than {MAX_SERIES_YEARS} years.')
+    return year, end_year
+
+
+def monthly_series(user, start_year, end_year=None):
+    '''
+    Return the monthly income/expense/balance series for a year or a range of years.
+    '''
+    end_year = end_year or start_year
+    return series_from_rows(monthly_rows(user, start_year, end_year), start_year, end_year)
+
+
+async def amonthly_series(user, start_year, end_year=None):
+    '''
+    Async version of monthly_series().
+    '''
+    end_year = end_year or start_year
+    rows = [row async for row in monthly_rows(user, start_year, end_year)]
+    return series_from_rows(rows, start_year, end_year)
+
+
+def first_day_of_next_month(day):
+    '''
+    Return the first day of the month following the given date.
+    '''
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def month_index(day):
+    '''
+    Return a month number that orders (year, month) pairs, matching MONTH_INDEX.
+    '''
+    return day.year * 12 + day.month
+
+
+MONTH_INDEX = F('year') * 12 + F('month')
+
+
+def whole_months(start_date, end_date):
+    '''
+    Return the first day of the first whole month in an inclusive date range and the day after the last one.
+
+    The first value is not before the second when the range contains no whole month.
+    '''
+    first_full = start_date if start_date.day == 1 else first_day_of_next_month(start_date)
+    after_last_full = end_date.replace(day=1)
+    if first_day_of_next_month(end_date) - timedelta(days=1) == end_date:
+        after_last_full = first_day_of_next_month(end_date)
+    return first_full, after_last_full
+
+
+def edge_ranges(start_date, end_date):
+    '''
+    Return the inclusive (start, end) ranges of an inclusive date range not covered by whole months.
+    '''
+    first_full, after_last_full = whole_months(start_date, end_date)
+    if first_full >= after_last_full:
+        return [(start_date, end_date)]
+    edges = []
+    if start_date < first_full:
+        edges.append((start_date, first_full - timedelta(days=1)))
+    if after_last_full <= end_date:
+        edges.append((after_last_full, end_date))
+    return edges
+
+
+def split_period(start_date, end_date):
+    '''
+    Split an inclusive date range into its whole months and its partial edge days.
+
+    Returns (rollup filter or None, ledger filter or None).
+    '''
+    first_full, after_last_full = whole_months(start_date, end_date)
+    months = None
+    if first_full < after_last_full:
+        months = Q(month_index__gte=month_index(first_full), month_index__lt=month_index(after_last_full))
+    edges = [Q(date__range=edge) for edge in edge_ranges(start_date, end_date)]
+    return months, reduce(or_, edges) if edges else None
+
+
+def shift_months(day, months):
+    '''
+    Return the first day of the month that is the given number of months from day's month.
+    '''
+    index = month_index(day) - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def last_year(day):
+    '''
+    Return the same day one year earlier, using 28 February for 29 February.
+    '''
+    return day.replace(year=day.year - 1, day=28) if (day.month, day.day) == (2, 29) else day.replace(
+        year=day.year - 1)
+
+
+def comparison_period(start_date, end_date, compare):
+    '''
+    Return the period to compare an inclusive range with: 'previous' or same period last 'year'.
+
+    Ranges made of whole months are compared with whole months, other ranges with a range
+    of the same number of days.
+    '''
+    whole_months = start_date.day == 1 and first_day_of_next_month(end_date) - timedelta(days=1) == end_date
+    if compare == 'year':
+        if whole_months:
+            return last_year(start_date), first_day_of_next_month(last_year(end_date)) - timedelta(days=1)
+        return last_year(start_date), last_year(end_date)
+    if compare == 'previous':
+        if whole_months:
+            months = month_index(end_date) - month_index(start_date) + 1
+            return shift_months(start_date, -months), start_date - timedelta(days=1)
+        return start_date - (end_date - start_date) - timedelta(days=1), start_date - timedelta(days=1)
+    raise ValueError(f'Unknown comparison: {compare}')
+
+
+def category_matrix(user, kind, periods):
+    '''
+    Return {category name: [total for each period]} for a list of inclusive (start, end) ranges.
+
+    Whole months are summed from the rollup table and the partial months at the edges
+    of each range from the raw ledger table, each with a single conditional-aggregation
+    query covering all periods. Edge days in archived years are summed from the
+    user's archive files.
+    '''
+    splits = [split_period(start_date, end_date) for start_date, end_date in periods]
+    matrix = defaultdict(lambda: [0] * len(periods))
+    sources = (
+        (MonthlyRollup.objects.filter(user=user, kind=kind).alias(month_index=MONTH_INDEX), 'total', 0),
+        (LEDGER_MODELS[kind].objects.filter(user=user), 'amount', 1),
+    )
+    for queryset, field, position in sources:
+        filters = {f'p{i}': split[position] for i, split in enumerate(splits) if split[position] is not None}
+        if not filters:
+            continue
+        rows = queryset.filter(reduce(or_, filters.values())).values('category__name').annotate(
+            **{name: Sum(field, filter=condition) for name, condition in filters.items()}).order_by()
+        for row in rows:
+            for name in filters:
+                matrix[row['category__name']][int(name[1:])] += row[name] or 0
+    if archived_years(user.id):
+        categories = registry.snapshot()
+        for position, (start_date, end_date) in enumerate(periods):
+            for edge_start, edge_end in edge_ranges(start_date, end_date):
+                for category_id, (total, count) in archived_totals(user.id, kind, edge_start, edge_end).items():
+                    if category_id in categories.by_id:
+                        matrix[categories.name(category_id)][position] += total
+    return {name: totals for name, totals in matrix.items() if any(totals)}
+
+
+def category_totals(user, kind, start_date=None, end_date=None):
+    '''
+    Return {category name: total} for the given kind, all-time or within an inclusive date range.
+    '''
+    if start_date is None:
+        rows = MonthlyRollup.objects.filter(user=user, kind=kind).values('category__name').annotate(
+            total=Sum('total')).order_by()
+        return {row['category__name']: row['total'] for row in rows if row['total']}
+
+    matrix = category_matrix(user, kind, [(start_date, end_date)])
+    return {name: totals[0] for name, totals in matrix.items()}
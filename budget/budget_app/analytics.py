@@ -0,0 +1,200 @@
+from datetime import timedelta
+
+import numpy as np
+
+from django.db import connections
+from django.db.models import F, Func, IntegerField
+from django.db.models.functions import Cast, Round
+
+from .models import Transaction
+from .registry import registry
+
+WINDOWS = (30, 90)
+HISTORY_DAYS = 365
+HISTORY_MONTHS = 12
+PERCENTILES = (50, 75, 90, 99)
+TOP_MOVERS = 5
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+class EpochDays(Func):
+    '''
+    The number of days between 1970-01-01 and a date column, computed by the database.
+    '''
+    template = "(%(expressions)s - DATE '1970-01-01')"
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="CAST(julianday(%(expressions)s) - 2440587.5 AS INTEGER)",
+                           **extra_context)
+
+
+class Columns:
+    '''
+    A user's transactions as column arrays.
+
+    days holds int32 days since 1970-01-01, cents int64 signed amounts (expenses
+    negative) and codes int32 positions into category_ids.
+    '''
+    def __init__(self, days, cents, codes, category_ids):
+        self.days = days
+        self.cents = cents
+        self.codes = codes
+        self.category_ids = category_ids
+
+    def __len__(self):
+        return len(self.days)
+
+
+def day_number(day):
+    '''
+    Return the number of days between 1970-01-01 and a date.
+    '''
+    return int((np.datetime64(day, 'D') - EPOCH).astype(np.int64))
+
+
+def month_number(day):
+    '''
+    Return the number of months between January 1970 and the month of a date.
+    '''
+    return (day.year - 1970) * 12 + day.month - 1
+
+
+def load_columns(user_id, start_date=None, end_date=None):
+    '''
+    Load a user's ledger transactions, optionally within an inclusive date range, with one query.
+
+    The database returns days and cents as integers and the rows are fetched straight
+    from the cursor, so no model, date or Decimal objects are built per row.
+    '''
+    rows = Transaction.objects.filter(user_id=user_id)
+    if start_date:
+        rows = rows.filter(date__gte=start_date)
+    if end_date:
+        rows = rows.filter(date__lte=end_date)
+    # Only annotations are selected, so the columns come back in annotation order.
+    rows = rows.annotate(days=EpochDays('date'), cents=Cast(Round(F('amount') * 100), IntegerField()),
+                         category_code=F('category_id'))
+    sql, params = rows.values_list('days', 'cents', 'category_code').order_by().query.sql_with_params()
+    with connections[rows.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        table = np.array(cursor.fetchall(), dtype=np.int64)
+    if not len(table):
+        return Columns(np.zeros(0, np.int32), np.zeros(0, np.int64), np.zeros(0, np.int32), np.zeros(0, np.int64))
+    category_ids, codes = np.unique(table[:, 2], return_inverse=True)
+    return Columns(table[:, 0].astype(np.int32), table[:, 1].copy(), codes.astype(np.int32), category_ids)
+
+
+def rolling_spend(columns, as_of, windows=WINDOWS, history_days=HISTORY_DAYS):
+    '''
+    Return the spend of the trailing windows ending on each of the last history_days days.
+
+    Returns (day numbers, {window: cents}); one bincount builds the daily series and
+    each window is a difference of its cumulative sum.
+    '''
+    end = day_number(as_of)
+    start = end - history_days - max(windows) + 1
+    mask = (columns.cents < 0) & (columns.days >= start) & (columns.days <= end)
+    daily = np.bincount(columns.days[mask] - start, weights=-columns.cents[mask], minlength=end - start + 1)
+    cumulative = np.concatenate(([0], np.cumsum(daily)))
+    totals = {window: (cumulative[window:] - cumulative[:-window])[-history_days:] for window in windows}
+    return np.arange(end - history_days + 1, end + 1), totals
+
+
+def monthly_category_spend(columns, as_of, months=HISTORY_MONTHS):
+    '''
+    Return a (categories x months + 1) matrix of spend in cents, ending with the month of as_of.
+    '''
+    current = month_number(as_of)
+    first = current - months
+    month_numbers = columns.days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    mask = (columns.cents < 0) & (month_numbers >= first) & (columns.days <= day_number(as_of))
+    width = months + 1
+    cells = columns.codes[mask].astype(np.int64) * width + (month_numbers[mask] - first)
+    return np.bincount(cells, weights=-columns.cents[mask],
+                       minlength=len(columns.category_ids) * width).reshape(len(columns.category_ids), width)
+
+
+def spend_percentiles(columns, as_of, history_days=HISTORY_DAYS, percentiles=PERCENTILES):
+    '''
+    Return the percentiles of expense sizes over the last history_days days and each category's median.
+
+    Returns ({percentile: cents}, per-category median cents, per-category counts).
+    '''
+    end = day_number(as_of)
+    mask = (columns.cents < 0) & (columns.days > end - history_days) & (columns.days <= end)
+    spend = -columns.cents[mask]
+    codes = columns.codes[mask]
+    if not len(spend):
+        return {}, np.zeros(len(columns.category_ids)), np.zeros(len(columns.category_ids), np.int64)
+    overall = dict(zip(percentiles, np.percentile(spend, percentiles)))
+
+    order = np.lexsort((spend, codes))
+    spend, codes = spend[order], codes[order]
+    counts = np.bincount(codes, minlength=len(columns.category_ids))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    present = counts > 0
+    medians = np.zeros(len(counts))
+    lower = starts[present] + (counts[present] - 1) // 2
+    upper = starts[present] + counts[present] // 2
+    medians[present] = (spend[lower] + spend[upper]) / 2
+    return overall, medians, counts
+
+
+def top_movers(deltas, count=TOP_MOVERS):
+    '''
+    Return the positions of the largest increases and decreases in a delta vector.
+    '''
+    order = np.argsort(deltas, kind='stable')
+    increases = [int(position) for position in order[::-1][:count] if deltas[position] > 0]
+    decreases = [int(position) for position in order[:count] if deltas[position] < 0]
+    return increases, decreases
+
+
+def insights(user, as_of):
+    '''
+    Return the JSON-ready spending insights of a user as of a date.
+
+    Only the transactions the windows need are loaded, with a single query, and every
+    statistic is computed with vectorized NumPy operations on the resulting columns.
+    '''
+    first_month = as_of.replace(day=1)
+    for _ in range(HISTORY_MONTHS):
+        first_month = (first_month - timedelta(days=1)).replace(day=1)
+    start_date = min(first_month, as_of - timedelta(days=HISTORY_DAYS + max(WINDOWS)))
+    columns = load_columns(user.id, start_date, as_of)
+
+    days, rolling = rolling_spend(columns, as_of)
+    matrix = monthly_category_spend(columns, as_of)
+    deltas = np.diff(matrix, axis=1)
+    overall, medians, counts = spend_percentiles(columns, as_of)
+    increases, decreases = top_movers(deltas[:, -1])
+
+    categories = registry.snapshot()
+    names = [categories.name(int(category_id)) for category_id in columns.category_ids]
+    months = np.arange(month_number(as_of) - HISTORY_MONTHS, month_number(as_of) + 1).astype('datetime64[M]')
+
+    def amounts(cents):
+        return np.round(np.asarray(cents, dtype=np.float64) / 100, 2).tolist()
+
+    def mover(position):
+        return {'name': names[position], 'previous': amounts(matrix[position, -2]),
+                'current': amounts(matrix[position, -1]), 'delta': amounts(deltas[position, -1])}
+
+    return {
+        'as_of': as_of.isoformat(),
+        'rows': len(columns),
+        'rolling': {
+            'dates': (days.astype('datetime64[D]')).astype(str).tolist(),
+            **{f'spend_{window}': amounts(totals) for window, totals in rolling.items()},
+        },
+        'months': months.astype(str).tolist(),
+        'categories': [
+            {'name': names[position], 'totals': amounts(matrix[position]), 'deltas': amounts(deltas[position]),
+             'median': amounts(medians[position]), 'count': int(counts[position])}
+            for position in np.flatnonzero(matrix.sum(axis=1) > 0)
+        ],
+        'percentiles': {str(percentile): amounts(value) for percentile, value in overall.items()},
+        'top_increases': [mover(position) for position in increases],
+        'top_decreases': [mover(position) for position in decreases],
+    }
@@ -0,0 +1,268 @@
+import json
+
+from collections import defaultdict
+from functools import wraps
+
+from django.db import router, transaction
+from django.forms.models import model_to_dict
+from django.http import JsonResponse
+from django.views.decorators.http import require_GET, require_POST
+
+from .caching import bump_categories_version, bump_data_version
+from .forms import CategoryForm, ExpenseForm, IncomeForm
+from .importers import transaction_hash
+from .ledger import mirror_rows
+from .models import Category, Expense, Income
+from .pagination import keyset_page, page_size_from
+from .registry import registry
+from .reports import parse_report_filters
+from .rollups import apply_deltas, kind_of
+from .sharding import copy_categories_to_shards
+
+LEDGER_RESOURCES = {'expenses': (Expense, ExpenseForm), 'incomes': (Income, IncomeForm)}
+LEDGER_FIELDS = {'id': 'id', 'date': 'date', 'category': 'category_id', 'category_name': 'category_id',
+                 'amount': 'amount', 'comment': 'comment'}
+LEDGER_UPDATE_FIELDS = ['category', 'amount', 'date', 'comment', 'content_hash']
+CATEGORY_FIELDS = ('id', 'name', 'type')
+OPERATIONS = ('create', 'update', 'delete')
+MAX_BATCH_SIZE = 1000
+JSON_PARAMS = {'separators': (',', ':')}
+
+
+class BatchError(Exception):
+    '''
+    Raised to roll back a batch containing invalid operations.
+    '''
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def api_login_required(view):
+    '''
+    Like login_required, but answer anonymous requests with a 401 JSON error.
+    '''
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required.'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def error_response(message, status=400, **extra):
+    '''
+    Return a JSON error response.
+    '''
+    return JsonResponse({'error': message, **extra}, status=status, json_dumps_params=JSON_PARAMS)
+
+
+def form_errors(form):
+    '''
+    Return the errors of a form as {field: [messages]}.
+    '''
+    return {field: list(messages) for field, messages in form.errors.items()}
+
+
+def add_delta(deltas, row, sign):
+    '''
+    Add (sign) a ledger row to a {(category_id, year, month): [total, count]} rollup delta.
+    '''
+    delta = deltas[(row.category_id, row.date.year, row.date.month)]
+    delta[0] += sign * row.amount
+    delta[1] += sign
+
+
+def ledger_batch(user, model_class, form_class, operations):
+    '''
+    Apply create/update/delete operations to a user's expenses or incomes in bulk.
+
+    Every item is validated with the model's form first; if any item is invalid,
+    BatchError is raised and nothing is written.
+    '''
+    errors = []
+    deltas = defaultdict(lambda: [0, 0])
+
+    created = []
+    for index, item in enumerate(operations['create']):
+        form = form_class(data=item)
+        if not form.is_valid():
+            errors.append({'operation': 'create', 'index': index, 'errors': form_errors(form)})
+            continue
+        row = form.save(commit=False)
+        row.user = user
+        row.content_hash = transaction_hash(row.date, row.amount, row.comment)
+        created.append(row)
+        add_delta(deltas, row, 1)
+
+    update_ids = [item.get('id') for item in operations['update'] if isinstance(item.get('id'), int)]
+    existing = model_class.objects.select_for_update().filter(user=user).in_bulk(update_ids)
+    updated = []
+    seen = set()
+    for index, item in enumerate(operations['update']):
+        row = existing.get(item.get('id'))
+        if row is None:
+            errors.append({'operation': 'update', 'index': index, 'errors': {'id': ['Not found.']}})
+            continue
+        if row.id in seen:
+            # Its deltas were taken from the first update of the row already.
+            errors.append({'operation': 'update', 'index': index, 'errors': {'id': ['Duplicate id.']}})
+            continue
+        seen.add(row.id)
+        add_delta(deltas, row, -1)
+        data = model_to_dict(row, fields=form_class._meta.fields)
+        data.update(item)
+        form = form_class(data=data, instance=row)
+        if not form.is_valid():
+            errors.append({'operation': 'update', 'index': index, 'errors': form_errors(form)})
+            continue
+        row = form.save(commit=False)
+        row.content_hash = transaction_hash(row.date, row.amount, row.comment)
+        updated.append(row)
+        add_delta(deltas, row, 1)
+
+    delete_ids = operations['delete']
+    if not all(isinstance(row_id, int) for row_id in delete_ids):
+        errors.append({'operation': 'delete', 'errors': {'id': ['Ids must be integers.']}})
+    if errors:
+        raise BatchError(errors)
+
+    model_class.objects.bulk_create(created)
+    model_class.objects.bulk_update(updated, LEDGER_UPDATE_FIELDS)
+    mirror_rows(kind_of(model_class), created + updated)
+    apply_deltas(user.id, kind_of(model_class), deltas)
+    bump_data_version(user.id)
+    # Deleting through the queryset sends post_delete, which keeps the rollups current.
+    _, deleted = model_class.objects.filter(user=user, id__in=delete_ids).delete()
+    return {'created': [row.id for row in created], 'updated': len(updated),
+            'deleted': deleted.get(model_class._meta.label, 0)}
+
+
+def category_batch(operations):
+    '''
+    Apply create/update/delete operations to categories in bulk, validated with CategoryForm.
+    '''
+    errors = []
+
+    def clean(index, operation, item):
+        form = CategoryForm(data={'new_category': item.get('name'), 'category_type': item.get('type')})
+        if form.is_valid():
+            return form.cleaned_data['new_category'], form.cleaned_data['category_type']
+        errors.append({'operation': operation, 'index': index, 'errors': form_errors(form)})
+        return None
+
+    created = []
+    for index, item in enumerate(operations['create']):
+        cleaned = clean(index, 'create', item)
+        if cleaned:
+            created.append(Category(name=cleaned[0], type=cleaned[1]))
+
+    update_ids = [item.get('id') for item in operations['update'] if isinstance(item.get('id'), int)]
+    existing = Category.objects.select_for_update().in_bulk(update_ids)
+    updated = []
+    seen = set()
+    for index, item in enumerate(operations['update']):
+        category = existing.get(item.get('id'))
+        if category is None:
+            errors.append({'operation': 'update', 'index': index, 'errors': {'id': ['Not found.']}})
+            continue
+        if category.id in seen:
+            errors.append({'operation': 'update', 'index': index, 'errors': {'id': ['Duplicate id.']}})
+            continue
+        seen.add(category.id)
+        cleaned = clean(index, 'update', {'name': category.name, 'type': category.type, **item})
+        if cleaned:
+            category.name, category.type = cleaned
+            updated.append(category)
+
+    delete_ids = operations['delete']
+    if not all(isinstance(category_id, int) for category_id in delete_ids):
+        errors.append({'operation': 'delete', 'errors': {'id': ['Ids must be integers.']}})
+    if errors:
+        raise BatchError(errors)
+
+    Category.objects.bulk_create(created)
+    Category.objects.bulk_update(updated, ['name', 'type'])
+    # Bulk writes send no post_save, so the shard copies are not updated by copy_category_to_shards.
+    copy_categories_to_shards(created + updated)
+    bump_categories_version()
+    _, deleted = Category.objects.filter(id__in=delete_ids).delete()
+    return {'created': [category.id for category in created], 'updated': len(updated),
+            'deleted': deleted.get(Category._meta.label, 0)}
+
+
+@api_login_required
+@require_GET
+def api_list(request, resource):
+    '''
+    List categories, or one page of expenses or incomes.
+
+    Ledger listings accept the report filters (start-date, end-date, category), a cursor
+    and page_size, fields=<comma separated names> and amounts=cents.
+    '''
+    if resource == 'categories':
+        categories = registry.snapshot()
+        selected = categories.of_type(request.GET['type']) if request.GET.get('type') else categories.by_id.values()
+        results = [{field: getattr(category, field) for field in CATEGORY_FIELDS} for category in selected]
+        return JsonResponse({'results': results}, json_dumps_params=JSON_PARAMS)
+    if resource not in LEDGER_RESOURCES:
+        return error_response('Unknown resource.', status=404)
+
+    model_class, _ = LEDGER_RESOURCES[resource]
+    fields = request.GET['fields'].split(',') if request.GET.get('fields') else list(LEDGER_FIELDS)
+    unknown = [field for field in fields if field not in LEDGER_FIELDS]
+    if unknown:
+        return error_response(f"Unknown fields: {', '.join(unknown)}")
+    columns = list(dict.fromkeys(['id', 'date'] + [LEDGER_FIELDS[field] for field in fields]))
+    try:
+        filters = parse_report_filters(request.GET)
+        rows, next_cursor = keyset_page(model_class.objects.filter(user=request.user, **filters).values(*columns),
+                                        request.GET.get('cursor'), page_size_from(request.GET))
+    except ValueError:
+        return error_response('Invalid filters or cursor.')
+
+    cents = request.GET.get('amounts') == 'cents'
+    categories = registry.snapshot()
+    results = []
+    for row in rows:
+        result = {field: row[LEDGER_FIELDS[field]] for field in fields}
+        if 'category_name' in result:
+            result['category_name'] = categories.name(result['category_name'])
+        if 'amount' in result:
+            result['amount'] = int(result['amount'] * 100) if cents else f"{result['amount']:f}"
+        results.append(result)
+    return JsonResponse({'results': results, 'next_cursor': next_cursor}, json_dumps_params=JSON_PARAMS)
+
+
+@api_login_required
+@require_POST
+def api_batch(request, resource):
+    '''
+    Apply a batch of {"create": [...], "update": [...], "delete": [ids]} operations in one transaction.
+    '''
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return error_response('Request body must be JSON.')
+    if not isinstance(payload, dict):
+        return error_response('Request body must be a JSON object.')
+    operations = {operation: payload.get(operation) or [] for operation in OPERATIONS}
+    if not all(isinstance(items, list) for items in operations.values()):
+        return error_response('Operations must be lists.')
+    if not all(isinstance(item, dict) for operation in ('create', 'update') for item in operations[operation]):
+        return error_response('Created and updated items must be objects.')
+    if sum(len(items) for items in operations.values()) > MAX_BATCH_SIZE:
+        return error_response(f'A batch may contain at most {MAX_BATCH_SIZE} operations.')
+
+    model_class = LEDGER_RESOURCES[resource][0] if resource in LEDGER_RESOURCES else Category
+    try:
+        with transaction.atomic(using=router.db_for_write(model_class)):
+            if resource == 'categories':
+                result = category_batch(operations)
+            elif resource in LEDGER_RESOURCES:
+                result = ledger_batch(request.user, *LEDGER_RESOURCES[resource], operations)
+            else:
+                return error_response('Unknown resource.', status=404)
+    except BatchError as error:
+        return error_response('Invalid operations.', errors=error.errors)
+    return JsonResponse(result, json_dumps_params=JSON_PARAMS)
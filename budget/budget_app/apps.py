@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BudgetAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'budget_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
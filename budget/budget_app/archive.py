@@ -0,0 +1,310 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import zlib
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import router, transaction
+
+from .caching import bump_data_version
+from .models import Expense, Income, Transaction
+
+ARCHIVE_KINDS = (('income', Income), ('expense', Expense))
+MAGIC = b'BGAR'
+VERSION = 1
+# magic, version, income rows, expense rows, compressed comments size; padded to 24 bytes
+# so the int64 amount column that follows is 8-byte aligned.
+HEADER = struct.Struct('<4sHxxIII4x')
+EPOCH = date(1970, 1, 1).toordinal()
+NO_COMMENT = -1
+
+
+class ArchiveError(Exception):
+    '''
+    Raised when an archive file cannot be read.
+    '''
+
+
+def archive_root():
+    '''
+    Return the directory holding the archive files.
+    '''
+    return getattr(settings, 'ARCHIVE_ROOT', os.path.join(settings.BASE_DIR, 'archive'))
+
+
+def archive_path(user_id, year):
+    '''
+    Return the path of the archive file of one user and year.
+    '''
+    return os.path.join(archive_root(), str(user_id), f'{year}.bgar')
+
+
+def archived_years(user_id):
+    '''
+    Return the sorted years archived for a user.
+    '''
+    try:
+        names = os.listdir(os.path.join(archive_root(), str(user_id)))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-5]) for name in names if name.endswith('.bgar') and name[:-5].isdigit())
+
+
+def delete_archives(user_id):
+    '''
+    Delete all archive files of a user.
+    '''
+    shutil.rmtree(os.path.join(archive_root(), str(user_id)), ignore_errors=True)
+
+
+def archived_users():
+    '''
+    Return the sorted ids of the users with an archive directory.
+    '''
+    try:
+        names = os.listdir(archive_root())
+    except FileNotFoundError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def years_between(user_id, start_date=None, end_date=None):
+    '''
+    Return the archived years of a user overlapping an optional inclusive date range.
+    '''
+    return [year for year in archived_years(user_id)
+            if (start_date is None or year >= start_date.year) and (end_date is None or year <= end_date.year)]
+
+
+def write_archive(path, rows):
+    '''
+    Write (kind, date, category id, amount, comment) rows, sorted by kind and date, to a file.
+
+    Dates are stored as int32 days since 1970-01-01, amounts as int64 cents and
+    category ids as uint32, one column after another; comments go to a
+    zlib-compressed dictionary and the rows store int32 references to it. The file
+    is written next to its destination and renamed over it, so readers never see
+    a partial file.
+    '''
+    if sys.byteorder != 'little':
+        raise ArchiveError('Archive files can only be written on little-endian hosts.')
+    rows = sorted(rows, key=lambda row: (row[0] != 'income', row[1]))
+    comments = {}
+    refs = []
+    for row in rows:
+        comment = row[4]
+        refs.append(NO_COMMENT if comment is None else comments.setdefault(comment, len(comments)))
+    packed_comments = zlib.compress(json.dumps(list(comments)).encode('utf-8'))
+    income_rows = sum(1 for row in rows if row[0] == 'income')
+    count = len(rows)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'wb') as output:
+        output.write(HEADER.pack(MAGIC, VERSION, income_rows, count - income_rows, len(packed_comments)))
+        output.write(struct.pack(f'<{count}q', *(int(row[3] * 100) for row in rows)))
+        output.write(struct.pack(f'<{count}i', *(row[1].toordinal() - EPOCH for row in rows)))
+        output.write(struct.pack(f'<{count}I', *(row[2] for row in rows)))
+        output.write(struct.pack(f'<{count}i', *refs))
+        output.write(packed_comments)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporary_path, path)
+
+
+class ArchiveFile:
+    '''
+    Read-only view of an archive file through a memory map.
+
+    Columns are memoryviews over the map, so scans only touch the pages they read
+    and the comment dictionary is decompressed on first use.
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as source:
+            self.map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, income_rows, expense_rows, comments_size = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ArchiveError(f'{path} is not a version {VERSION} archive file.')
+        if sys.byteorder != 'little':
+            self.close()
+            raise ArchiveError('Archive files can only be read on little-endian hosts.')
+        self.blocks = {'income': (0, income_rows), 'expense': (income_rows, income_rows + expense_rows)}
+        count = income_rows + expense_rows
+        view = memoryview(self.map)
+        offset = HEADER.size
+        self.amounts = view[offset:offset + 8 * count].cast('q')
+        offset += 8 * count
+        self.days = view[offset:offset + 4 * count].cast('i')
+        offset += 4 * count
+        self.categories = view[offset:offset + 4 * count].cast('I')
+        offset += 4 * count
+        self.refs = view[offset:offset + 4 * count].cast('i')
+        offset += 4 * count
+        self.comments_range = (offset, offset + comments_size)
+        self._comments = None
+
+    def comments(self):
+        '''
+        Return the comment dictionary.
+        '''
+        if self._comments is None:
+            start, end = self.comments_range
+            self._comments = json.loads(zlib.decompress(self.map[start:end]))
+        return self._comments
+
+    def span(self, kind, start_date=None, end_date=None):
+        '''
+        Return the (first, last + 1) row positions of a kind within an inclusive date range.
+        '''
+        first, last = self.blocks[kind]
+        if start_date is not None:
+            first = bisect_left(self.days, start_date.toordinal() - EPOCH, first, last)
+        if end_date is not None:
+            last = bisect_right(self.days, end_date.toordinal() - EPOCH, first, last)
+        return first, last
+
+    def rows(self, kind, start_date=None, end_date=None, category_id=None):
+        '''
+        Iterate over the (kind, date, category id, amount, comment) rows of a kind in date order.
+        '''
+        first, last = self.span(kind, start_date, end_date)
+        for position in range(first, last):
+            if category_id is None or self.categories[position] == category_id:
+                yield self.row(kind, position)
+
+    def row(self, kind, position):
+        '''
+        Return the (kind, date, category id, amount, comment) row at a position of the file.
+        '''
+        ref = self.refs[position]
+        return (kind, date.fromordinal(self.days[position] + EPOCH), self.categories[position],
+                Decimal(self.amounts[position]).scaleb(-2), self.comments()[ref] if ref != NO_COMMENT else None)
+
+    def totals(self, kind, start_date=None, end_date=None, category_id=None):
+        '''
+        Return {category id: [total, count]} for the rows of a kind within a date range.
+        '''
+        first, last = self.span(kind, start_date, end_date)
+        cents = defaultdict(lambda: [0, 0])
+        for amount, row_category_id in zip(self.amounts[first:last], self.categories[first:last]):
+            if category_id is None or row_category_id == category_id:
+                total = cents[row_category_id]
+                total[0] += amount
+                total[1] += 1
+        return {key: [Decimal(total).scaleb(-2), count] for key, (total, count) in cents.items()}
+
+    def close(self):
+        '''
+        Release the column views and unmap the file.
+        '''
+        for name in ('amounts', 'days', 'categories', 'refs'):
+            column = getattr(self, name, None)
+            if column is not None:
+                column.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def archived_rows(user_id, kind, filters):
+    '''
+    Iterate over a user's archived rows of a kind matching the report filters, in date order.
+    '''
+    start_date, end_date = filters.get('date__gte'), filters.get('date__lte')
+    for year in years_between(user_id, start_date, end_date):
+        with ArchiveFile(archive_path(user_id, year)) as archive:
+            yield from archive.rows(kind, start_date, end_date, filters.get('category_id'))
+
+
+def archived_positions(user_id, year, after=0):
+    '''
+    Iterate over the (position, row) pairs of a user's archive file of a year after a position.
+
+    Positions number the rows of the file from 1, incomes first, and stay valid
+    until the year is archived again.
+    '''
+    with ArchiveFile(archive_path(user_id, year)) as archive:
+        for kind, _ in ARCHIVE_KINDS:
+            first, last = archive.blocks[kind]
+            for position in range(max(first, after), last):
+                yield position + 1, archive.row(kind, position)
+
+
+def archived_totals(user_id, kind, start_date=None, end_date=None, category_id=None):
+    '''
+    Return {category id: [total, count]} over a user's archived rows of a kind.
+    '''
+    totals = defaultdict(lambda: [0, 0])
+    for year in years_between(user_id, start_date, end_date):
+        with ArchiveFile(archive_path(user_id, year)) as archive:
+            for key, (total, count) in archive.totals(kind, start_date, end_date, category_id).items():
+                totals[key][0] += total
+                totals[key][1] += count
+    return dict(totals)
+
+
+def archived_rollups(user_id):
+    '''
+    Return {(kind, category id, year, month): [total, count]} over all archived rows of a user.
+    '''
+    cents = defaultdict(lambda: [0, 0])
+    for year in archived_years(user_id):
+        with ArchiveFile(archive_path(user_id, year)) as archive:
+            for kind, _ in ARCHIVE_KINDS:
+                first, last = archive.blocks[kind]
+                for day, category_id, amount in zip(archive.days[first:last], archive.categories[first:last],
+                                                    archive.amounts[first:last]):
+                    rollup = cents[(kind, category_id, year, date.fromordinal(day + EPOCH).month)]
+                    rollup[0] += amount
+                    rollup[1] += 1
+    return {key: [Decimal(total).scaleb(-2), count] for key, (total, count) in cents.items()}
+
+
+def archive_year(user_id, year):
+    '''
+    Move a user's expenses and incomes of one closed year into the year's archive file.
+
+    Rows already archived for the year are kept, so a year can be archived again after
+    back-dated entries were added. The rows are deleted without signals, so the monthly
+    rollups keep covering them. Returns the number of rows moved. Run it inside
+    using_shard_of(user_id) when users are sharded.
+    '''
+    path = archive_path(user_id, year)
+    start_date, end_date = date(year, 1, 1), date(year, 12, 31)
+    with transaction.atomic(using=router.db_for_write(Transaction)):
+        rows = []
+        ids = {}
+        for kind, model_class in ARCHIVE_KINDS:
+            hot = list(model_class.objects.select_for_update().filter(
+                user_id=user_id, date__range=[start_date, end_date]).values_list(
+                'id', 'date', 'category_id', 'amount', 'comment'))
+            ids[kind] = [row[0] for row in hot]
+            rows.extend((kind, *row[1:]) for row in hot)
+        if not rows:
+            return 0
+        if os.path.exists(path):
+            with ArchiveFile(path) as archive:
+                for kind, _ in ARCHIVE_KINDS:
+                    rows.extend(archive.rows(kind))
+
+        for kind, model_class in ARCHIVE_KINDS:
+            archived = model_class.objects.filter(id__in=ids[kind])
+            archived._raw_delete(archived.db)
+            Transaction.objects.filter(type=kind, source_id__in=ids[kind]).delete()
+        # Written last, so a failed write rolls the deletes back.
+        write_archive(path, rows)
+    bump_data_version(user_id)
+    return sum(len(kind_ids) for kind_ids in ids.values())
@@ -0,0 +1,173 @@
+import asyncio
+import contextvars
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.db import close_old_connections
+from django.http import HttpResponseBadRequest, JsonResponse
+from django.shortcuts import render
+
+from .aggregates import akind_totals, amonthly_series, parse_year_range
+from .caching import acached_for_user
+from .conditional import conditional_on_data
+from .models import Expense, Income
+from .pagination import akeyset_page
+from .pdf_reports import render_pdf_report
+from .registry import registry
+from .reports import parse_report_filters
+from .routers import read_from_replica
+from .views import csv_report_response, export_response, page_params, page_response, pdf_report_response, \
+    summary_context
+
+REPORT_WORKERS = 2
+CHUNK_SIZE = 2 ** 16
+END = object()
+
+# reportlab is CPU-bound and not async, so PDFs are rendered on a few dedicated
+# threads; requests beyond REPORT_WORKERS wait for a free one instead of piling up
+# threads that would all compete for the same cores.
+report_pool = ThreadPoolExecutor(max_workers=getattr(settings, 'REPORT_WORKERS', REPORT_WORKERS),
+                                 thread_name_prefix='pdf-report')
+
+
+def async_login_required(view):
+    '''
+    login_required for async views, which Django 4.2's decorator does not support.
+    '''
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # Loading the user reads the session and possibly the user table.
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def aiterate(iterator):
+    '''
+    Iterate a blocking iterator (e.g. one reading the database) from async code.
+
+    Each item is produced in the request's sync thread, so a database cursor the
+    iterator holds stays on the connection it was opened on.
+    '''
+    iterator = iter(iterator)
+    while (item := await sync_to_async(next)(iterator, END)) is not END:
+        yield item
+
+
+@async_login_required
+async def budget_summary(request):
+    '''
+    Display budget summary.
+    '''
+    totals = await acached_for_user(request.user, 'kind-totals', akind_totals)
+    return render(request, 'budget_summary.html', summary_context(totals))
+
+
+async def fetch_data(request, model_class, template_name):
+    '''
+    Async version of views.fetch_data().
+    '''
+    try:
+        data, next_cursor = await akeyset_page(*page_params(request, model_class))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor.')
+    (await sync_to_async(registry.snapshot)()).attach(data)
+    return page_response(request, model_class, template_name, data, next_cursor)
+
+
+@async_login_required
+@conditional_on_data
+async def fetch_expenses(request):
+    '''
+    Fetch expenses data.
+    '''
+    return await fetch_data(request, Expense, 'expenses_partial.html')
+
+
+@async_login_required
+@conditional_on_data
+async def fetch_incomes(request):
+    '''
+    Fetch incomes data.
+    '''
+    return await fetch_data(request, Income, 'incomes_partial.html')
+
+
+@async_login_required
+@conditional_on_data
+@read_from_replica
+async def get_data(request):
+    '''
+    Get data for charts.
+    '''
+    try:
+        year, end_year = parse_year_range(request.GET)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    monthly_data = await acached_for_user(request.user, 'monthly-series', amonthly_series, year, end_year)
+    return JsonResponse(monthly_data, safe=False)
+
+
+@async_login_required
+@conditional_on_data
+@read_from_replica
+async def generate_csv_report(request):
+    '''
+    Generate CSV report, optionally filtered by date range and category and gzip-compressed.
+    '''
+    return csv_report_response(request, aiterate)
+
+
+def render_pdf_file(user_id, filters, output):
+    '''
+    Render a PDF report into output on a report_pool thread; returns the timings.
+    '''
+    try:
+        return render_pdf_report(user_id, filters, output)
+    finally:
+        # Pool threads outlive requests, so nothing else closes their connections.
+        close_old_connections()
+
+
+@async_login_required
+@conditional_on_data
+@read_from_replica
+async def generate_pdf_report(request):
+    '''
+    Generate PDF report, optionally filtered by date range and category.
+    '''
+    try:
+        filters = parse_report_filters(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid report filters.')
+    output = tempfile.TemporaryFile()
+    try:
+        # The context carries the database the request reads from into the pool.
+        timings = await asyncio.get_running_loop().run_in_executor(
+            report_pool, contextvars.copy_context().run, render_pdf_file, request.user.id, filters, output)
+    except BaseException:
+        output.close()
+        raise
+    response = pdf_report_response(output, timings)
+    # FileResponse reads the file synchronously, which an ASGI server does by first
+    # loading all of it into memory; stream it from the request's thread instead.
+    response.streaming_content = aiterate(iter(partial(output.read, CHUNK_SIZE), b''))
+    return response
+
+
+@async_login_required
+@conditional_on_data
+@read_from_replica
+async def export_data(request):
+    '''
+    Stream all of the user's transactions as gzip-compressed NDJSON or in the columnar format,
+    optionally after a cursor.
+    '''
+    return export_response(request, aiterate)
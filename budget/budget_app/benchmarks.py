@@ -0,0 +1,477 @@
+import asyncio
+import json
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections, router, transaction
+from django.test import AsyncClient, Client, override_settings
+from django.urls import get_resolver, reverse
+
+from .caching import bump_data_version
+from .importers import transaction_hash
+from .ledger import SOURCE_MODELS, mirror_rows
+from .metrics import QueryRecorder
+from .models import Category
+from .rollups import rebuild_user_rollups
+from .sharding import SHARDED, databases, place_users, shard_aliases, shard_for, using_database, using_shard_of
+
+PREFIX = 'bench'
+BATCH_SIZE = 5000
+# name, share of the random expenses, lognormal mu and sigma of the amount, comments
+EXPENSE_PROFILE = [
+    ('Jedzenie', 0.40, 3.5, 0.8, ['Biedronka', 'Lidl', 'Żabka', 'Obiad', 'Kawa']),
+    ('Transport', 0.15, 3.8, 0.7, ['Orlen', 'Bilet miesięczny', 'Taxi', 'Parking']),
+    ('Rozrywka', 0.12, 3.9, 0.9, ['Kino', 'Netflix', 'Koncert', 'Książka']),
+    ('Rachunki', 0.10, 5.0, 0.5, ['Prąd', 'Internet', 'Telefon', 'Gaz']),
+    ('Zdrowie', 0.08, 4.2, 0.9, ['Apteka', 'Lekarz', 'Dentysta']),
+    ('Ubrania', 0.08, 4.8, 0.8, ['Buty', 'Kurtka', 'Zalando']),
+    ('Inne', 0.07, 4.0, 1.2, [None, 'Prezent', 'Remont']),
+]
+RENT = ('Czynsz', Decimal('2400.00'))
+SALARY = ('Pensja', Decimal('7800.00'))
+BONUS = ('Premia', 5.0, 1.8)
+MAX_AMOUNT = Decimal('99999999.99')
+
+# Routes that change data; they are not timed, as repeating them would not measure the same work.
+SKIPPED_ROUTES = {'logout', 'delete_budget', 'delete_recurring', 'delete_category', 'api_batch'}
+# The views that have async versions in the ASGI profile (budget/urls_asgi.py).
+CONCURRENCY_CASES = ('budget_summary', 'get_data', 'fetch_expenses', 'fetch_incomes', 'generate_csv_report',
+                     'generate_pdf_report', 'export_data')
+ASGI_URLCONF = 'budget.urls_asgi'
+# Staff-only pages, requested as the staff user of staff_user() instead of a seeded user.
+STAFF_CASES = {'cache_stats', 'metrics'}
+
+
+def benchmark_users(prefix=PREFIX):
+    '''
+    Return the synthetic users created by seed_data, in id order.
+    '''
+    return User.objects.filter(username__startswith=f'{prefix}-').order_by('id')
+
+
+def staff_user(prefix=PREFIX):
+    '''
+    Return the staff user the staff-only pages are timed as, creating it if needed.
+
+    It cannot log in with a password and clear_seeded() deletes it.
+    '''
+    user, created = User.objects.get_or_create(username=f'{prefix}.staff',
+                                               defaults={'password': '!', 'is_staff': True})
+    return user
+
+
+def clear_seeded(prefix=PREFIX):
+    '''
+    Delete the synthetic users, and the staff user of the benchmarks, with everything they own.
+
+    Their rows are deleted in bulk, without signals, as the users and their rollups go too.
+    '''
+    user_ids = list(benchmark_users(prefix).values_list('id', flat=True))
+    User.objects.filter(username=f'{prefix}.staff').delete()
+    for alias in databases(user_ids):
+        with using_database(alias), transaction.atomic(using=alias):
+            for model_class in SHARDED:
+                rows = model_class.objects.filter(user_id__in=[user_id for user_id in user_ids
+                                                               if shard_for(user_id) == alias])
+                rows._raw_delete(rows.db)
+    User.objects.filter(id__in=user_ids).delete()
+    # Shards keep copies of every user for their foreign keys.
+    for alias in shard_aliases():
+        if alias != DEFAULT_DB_ALIAS:
+            copies = User.objects.using(alias).filter(id__in=user_ids)
+            copies._raw_delete(alias)
+    for user_id in user_ids:
+        bump_data_version(user_id)
+    return len(user_ids)
+
+
+def category_ids():
+    '''
+    Return {(type, name): id} for the categories used by the synthetic data, creating missing ones.
+    '''
+    names = [('expense', name) for name, *_ in EXPENSE_PROFILE] + [('expense', RENT[0]), ('income', SALARY[0]),
+                                                                   ('income', BONUS[0])]
+    ids = {}
+    for kind, name in names:
+        category = Category.objects.filter(type=kind, name=name).order_by('id').first()
+        ids[(kind, name)] = (category or Category.objects.create(type=kind, name=name)).id
+    return ids
+
+
+def synthetic_rows(random_source, transactions, start_date, end_date, categories):
+    '''
+    Yield about transactions (kind, category id, date, amount, comment) rows between two dates.
+
+    Every month has rent on the 1st and a salary on the 10th, plus an occasional bonus;
+    the other rows are expenses spread over the days, with more of them on weekends,
+    in categories and amounts drawn from EXPENSE_PROFILE.
+    '''
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    day_weights = list(accumulate(1.5 if day.weekday() >= 5 else 1 for day in days))
+    months = sorted({day.replace(day=1) for day in days})
+    fixed = 0
+    for month in months:
+        if fixed + 2 > transactions:
+            break
+        yield 'expense', categories[('expense', RENT[0])], month, RENT[1], 'Czynsz'
+        yield 'income', categories[('income', SALARY[0])], month.replace(day=10), SALARY[1], 'Wypłata'
+        fixed += 2
+        if random_source.random() < 0.1 and fixed < transactions:
+            amount = Decimal(str(round(random_source.lognormvariate(*BONUS[1:]) * 100, 2)))
+            yield 'income', categories[('income', BONUS[0])], month.replace(day=25), min(amount, MAX_AMOUNT), None
+            fixed += 1
+    weights = list(accumulate(share for _, share, *_ in EXPENSE_PROFILE))
+    for _ in range(max(transactions - fixed, 0)):
+        name, _, mu, sigma, comments = random_source.choices(EXPENSE_PROFILE, cum_weights=weights)[0]
+        amount = Decimal(str(round(random_source.lognormvariate(mu, sigma), 2))) or Decimal('0.01')
+        yield ('expense', categories[('expense', name)], random_source.choices(days, cum_weights=day_weights)[0],
+               min(amount, MAX_AMOUNT), random_source.choice(comments))
+
+
+def seed_data(users, transactions, years=2, seed=0, prefix=PREFIX, batch_size=BATCH_SIZE):
+    '''
+    Create users with transactions expenses and incomes each, spread over the last years.
+
+    Rows are written with bulk_create, then mirrored into the ledger and rolled up, so
+    the data looks as if it had been entered through the app. The users are regular
+    accounts that cannot log in with a password. Returns the new users.
+    '''
+    random_source = random.Random(seed)
+    categories = category_ids()
+    end_date = date.today()
+    start_date = end_date - timedelta(days=365 * years)
+    first = benchmark_users(prefix).count()
+    created = User.objects.bulk_create([User(username=f'{prefix}-{number}', password='!')
+                                        for number in range(first, first + users)])
+    created = list(benchmark_users(prefix).filter(username__in=[user.username for user in created]))
+    # bulk_create sends no post_save signals, so the users are placed on their shards here.
+    place_users(created)
+    for user in created:
+        batch = {'expense': [], 'income': []}
+        with using_shard_of(user.id):
+            for kind, category_id, day, amount, comment in synthetic_rows(random_source, transactions, start_date,
+                                                                          end_date, categories):
+                batch[kind].append(SOURCE_MODELS[kind](user_id=user.id, category_id=category_id, date=day,
+                                                       amount=amount, comment=comment,
+                                                       content_hash=transaction_hash(day, amount, comment)))
+                if len(batch[kind]) >= batch_size:
+                    insert_rows(kind, batch[kind], batch_size)
+                    batch[kind] = []
+            for kind, rows in batch.items():
+                insert_rows(kind, rows, batch_size)
+            rebuild_user_rollups(user.id)
+        bump_data_version(user.id)
+    return created
+
+
+def insert_rows(kind, rows, batch_size=BATCH_SIZE):
+    '''
+    Insert expenses or incomes and their ledger transactions in one transaction.
+    '''
+    with transaction.atomic(using=router.db_for_write(SOURCE_MODELS[kind])):
+        SOURCE_MODELS[kind].objects.bulk_create(rows, batch_size=batch_size)
+        mirror_rows(kind, rows, batch_size=batch_size)
+
+
+def benchmark_cases(today=None):
+    '''
+    Return the (name, URL name, args, GET parameters) of every timed request.
+    '''
+    today = today or date.today()
+    year_start = today.replace(month=1, day=1).isoformat()
+    return [
+        ('home', 'home', (), {}),
+        ('budget_summary', 'budget_summary', (), {}),
+        ('budgets', 'budgets', (), {}),
+        ('recurring', 'recurring', (), {}),
+        ('expenses_list', 'expenses_list', (), {}),
+        ('add_expenses', 'add_expenses', (), {}),
+        ('fetch_expenses', 'fetch_expenses', (), {'filter': 'year'}),
+        ('expenses_period', 'expenses_period', (), {'start-date': year_start, 'end-date': today.isoformat(),
+                                                    'compare': 'year'}),
+        ('incomes_list', 'incomes_list', (), {}),
+        ('add_income', 'add_income', (), {}),
+        ('fetch_incomes', 'fetch_incomes', (), {'filter': 'year'}),
+        ('incomes_period', 'incomes_period', (), {'start-date': year_start, 'end-date': today.isoformat()}),
+        ('import_transactions', 'import_transactions', (), {}),
+        ('login', 'login', (), {}),
+        ('register', 'register', (), {}),
+        ('charts', 'charts', (), {}),
+        ('get_data', 'get_data', (), {'year': today.year - 1, 'end_year': today.year}),
+        ('analytics', 'analytics', (), {}),
+        ('analytics_data', 'analytics_data', (), {}),
+        ('search', 'search', (), {'q': 'biedronka'}),
+        ('search_data', 'search_data', (), {'q': 'kino'}),
+        ('category_breakdown', 'category_breakdown', (), {'kind': 'expense', 'filter': 'year'}),
+        ('cache_stats', 'cache_stats', (), {}),
+        ('metrics', 'metrics', (), {}),
+        ('categories', 'categories', (), {}),
+        ('add_category', 'add_category', (), {}),
+        ('categories_expense', 'categories_expense', (), {}),
+        ('categories_income', 'categories_income', (), {}),
+        ('report', 'report', (), {}),
+        ('generate_csv_report', 'generate_csv_report', (), {}),
+        ('generate_csv_report_gzip', 'generate_csv_report', (), {'gzip': '1'}),
+        ('generate_pdf_report', 'generate_pdf_report', (), {}),
+        ('export_data', 'export_data', (), {}),
+        ('export_data_columnar', 'export_data', (), {'format': 'columnar'}),
+        ('atms', 'atms', (), {}),
+        ('api_list_expenses', 'api_list', ('expenses',), {}),
+        ('api_list_incomes', 'api_list', ('incomes',), {}),
+        ('api_list_categories', 'api_list', ('categories',), {}),
+    ]
+
+
+def untimed_routes():
+    '''
+    Return the names of URL patterns that are neither timed nor deliberately skipped.
+    '''
+    timed = {url_name for _, url_name, *_ in benchmark_cases()}
+    return sorted(name for name in get_resolver().reverse_dict if isinstance(name, str)
+                  and name not in timed and name not in SKIPPED_ROUTES)
+
+
+def benchmark_host():
+    '''
+    Return a host name the test client may use under ALLOWED_HOSTS.
+    '''
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def fetch(client, path, params):
+    '''
+    Request a page and read its whole body, streamed or not; returns the status code.
+    '''
+    response = client.get(path, params)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    else:
+        len(response.content)
+    response.close()
+    return response.status_code
+
+
+def timed_fetch(client, path, params):
+    '''
+    Return (status, milliseconds, queries) of one request.
+    '''
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        started = time.perf_counter()
+        status = fetch(client, path, params)
+        elapsed = (time.perf_counter() - started) * 1000
+    return status, elapsed, recorder.count
+
+
+def run_benchmarks(user, size, repeat=5, cases=None, prefix=PREFIX):
+    '''
+    Time every case as the given user and return one result dict per case.
+
+    Each case is requested once after clearing the cache (cold), then repeat times
+    (warm, the median is reported), then once more under tracemalloc for the peak
+    memory, which is measured separately so it does not slow the timed runs. Views
+    that fail are recorded with their status code. The STAFF_CASES are requested as
+    the staff_user(), which clear_seeded() deletes.
+    '''
+    user_client = Client(SERVER_NAME=benchmark_host(), raise_request_exception=False)
+    user_client.force_login(user)
+    staff_client = None
+    results = []
+    for name, url_name, args, params in cases or benchmark_cases():
+        path = reverse(url_name, args=args)
+        if name in STAFF_CASES and staff_client is None:
+            staff_client = Client(SERVER_NAME=benchmark_host(), raise_request_exception=False)
+            staff_client.force_login(staff_user(prefix))
+        client = staff_client if name in STAFF_CASES else user_client
+        cache.clear()
+        status, cold_ms, cold_queries = timed_fetch(client, path, params)
+        warm = [timed_fetch(client, path, params) for _ in range(repeat)]
+        tracemalloc.start()
+        fetch(client, path, params)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append({
+            'size': size, 'case': name, 'path': path, 'status': status,
+            'cold_ms': round(cold_ms, 2), 'cold_queries': cold_queries,
+            'warm_ms': round(statistics.median(elapsed for _, elapsed, _ in warm), 2) if warm else None,
+            'queries': warm[-1][2] if warm else cold_queries,
+            'peak_kb': round(peak / 1024, 1),
+        })
+    return results
+
+
+def compare_results(baseline, results, threshold=0.25, min_ms=5):
+    '''
+    Return descriptions of the results that regressed against a baseline run.
+
+    A case regresses when its warm (or, without warm runs, cold) time exceeds the
+    baseline by more than threshold and by more than min_ms, or when it runs more
+    queries than the baseline did. Cases missing from the baseline are not compared.
+    '''
+    previous = {(result['size'], result['case']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['size'], result['case']))
+        if before is None:
+            continue
+        label = f"{result['case']} at {result['size']} rows"
+        key = 'warm_ms' if result['warm_ms'] is not None and before['warm_ms'] is not None else 'cold_ms'
+        if result[key] > before[key] * (1 + threshold) and result[key] - before[key] > min_ms:
+            regressions.append(f'{label}: {before[key]:.1f} ms -> {result[key]:.1f} ms')
+        if result['queries'] > before['queries']:
+            regressions.append(f"{label}: {before['queries']} -> {result['queries']} queries")
+    return regressions
+
+
+def write_results(path, results, repeat):
+    '''
+    Write a benchmark run as JSON, to be compared against later runs.
+    '''
+    with open(path, 'w') as output:
+        json.dump({'created': date.today().isoformat(), 'database': connections['default'].vendor,
+                   'repeat': repeat, 'results': results}, output, indent=2)
+
+
+def concurrency_requests(names=CONCURRENCY_CASES, today=None):
+    '''
+    Return the (path, GET parameters) of the requests the concurrent clients cycle through.
+    '''
+    return [(reverse(url_name, args=args), params) for name, url_name, args, params in benchmark_cases(today)
+            if name in names]
+
+
+def client_jobs(requests, client, rounds):
+    '''
+    Return the requests one client sends, starting at a different one for each client.
+    '''
+    return [requests[(client + number) % len(requests)] for number in range(rounds)]
+
+
+def percentile(values, fraction):
+    '''
+    Return the value below which the given fraction of sorted values lies.
+    '''
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def load_summary(mode, outcomes, elapsed, clients):
+    '''
+    Return the throughput and latency percentiles of (status, milliseconds) outcomes.
+    '''
+    latencies = sorted(elapsed_ms for _, elapsed_ms in outcomes)
+    return {
+        'mode': mode, 'clients': clients, 'requests': len(outcomes),
+        'errors': sum(status != 200 for status, _ in outcomes),
+        'seconds': round(elapsed, 3), 'throughput': round(len(outcomes) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.5), 1), 'p95_ms': round(percentile(latencies, 0.95), 1),
+        'max_ms': round(latencies[-1], 1),
+    }
+
+
+def session_cookie(user):
+    '''
+    Return the session cookie value of a fresh login of the user.
+    '''
+    client = Client()
+    client.force_login(user)
+    return client.cookies[settings.SESSION_COOKIE_NAME].value
+
+
+def run_wsgi_load(user, clients=100, rounds=5, threads=8, requests=None):
+    '''
+    Serve clients simultaneous clients, each sending rounds requests one after another, through the sync
+    views and return the load summary.
+
+    Requests go through the WSGI-style handler of the test client, at most threads at a time, like a
+    threaded WSGI server process; latency includes the wait for a free thread.
+    '''
+    requests = requests or concurrency_requests()
+    cookie = session_cookie(user)
+    slots = threading.BoundedSemaphore(threads)
+
+    def client_session(client):
+        http = Client(SERVER_NAME=benchmark_host(), raise_request_exception=False)
+        http.cookies[settings.SESSION_COOKIE_NAME] = cookie
+        outcomes = []
+        for path, params in client_jobs(requests, client, rounds):
+            started = time.perf_counter()
+            with slots:
+                status = fetch(http, path, params)
+                close_old_connections()
+            outcomes.append((status, (time.perf_counter() - started) * 1000))
+        return outcomes
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        outcomes = [outcome for session in pool.map(client_session, range(clients)) for outcome in session]
+    return load_summary('wsgi', outcomes, time.perf_counter() - started, clients)
+
+
+async def afetch(client, path, params):
+    '''
+    Async version of fetch().
+    '''
+    response = await client.get(path, params)
+    if response.streaming:
+        if response.is_async:
+            async for _ in response.streaming_content:
+                pass
+        else:
+            for _ in response.streaming_content:
+                pass
+    else:
+        len(response.content)
+    return response.status_code
+
+
+def run_asgi_load(user, clients=100, rounds=5, requests=None):
+    '''
+    Serve the load of run_wsgi_load() through the async views of the ASGI profile and return the summary.
+
+    All clients share one event loop, as in one ASGI server process. Each request gets
+    its own thread for blocking work, like under Django's ASGI handler.
+    '''
+    requests = requests or concurrency_requests()
+    cookie = session_cookie(user)
+
+    async def client_session(client):
+        http = AsyncClient(raise_request_exception=False)
+        http.cookies[settings.SESSION_COOKIE_NAME] = cookie
+        outcomes = []
+        for path, params in client_jobs(requests, client, rounds):
+            started = time.perf_counter()
+            async with ThreadSensitiveContext():
+                status = await afetch(http, path, params)
+                await sync_to_async(close_old_connections)()
+            outcomes.append((status, (time.perf_counter() - started) * 1000))
+        return outcomes
+
+    async def load():
+        sessions = await asyncio.gather(*(client_session(client) for client in range(clients)))
+        return [outcome for session in sessions for outcome in session]
+
+    # The async test client always sends 'Host: testserver' in Django 4.2.
+    with override_settings(ROOT_URLCONF=ASGI_URLCONF, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+        started = time.perf_counter()
+        outcomes = asyncio.run(load())
+        elapsed = time.perf_counter() - started
+    return load_summary('asgi', outcomes, elapsed, clients)
@@ -0,0 +1,96 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db.models import Sum
+
+from .aggregates import first_day_of_next_month
+from .models import Budget, MonthlyRollup
+from .registry import registry
+
+AT_RISK = 'at_risk'
+OVER = 'over'
+OK = 'ok'
+CENTS = Decimal('0.01')
+
+
+def period_bounds(period, today):
+    '''
+    Return the first and last day of the month or year containing today.
+    '''
+    if period == 'year':
+        return date(today.year, 1, 1), date(today.year, 12, 31)
+    return today.replace(day=1), first_day_of_next_month(today) - timedelta(days=1)
+
+
+def period_spend(user, budgets, today):
+    '''
+    Return {(period, category id or None): spent} for the periods of the given budgets.
+
+    The totals come from the monthly rollups of the current year, so one query reads
+    at most one row per category and month whatever the number of expenses.
+    '''
+    rows = MonthlyRollup.objects.filter(user=user, kind='expense', year=today.year)
+    if all(budget.period == 'month' for budget in budgets):
+        rows = rows.filter(month=today.month)
+    if all(budget.category_id is not None for budget in budgets):
+        rows = rows.filter(category_id__in={budget.category_id for budget in budgets})
+    spent = defaultdict(Decimal)
+    for row in rows.values('category_id', 'month').annotate(total=Sum('total')).order_by():
+        periods = ('year', 'month') if row['month'] == today.month else ('year',)
+        for period in periods:
+            spent[(period, row['category_id'])] += row['total']
+            spent[(period, None)] += row['total']
+    return spent
+
+
+def budget_status(user, today=None):
+    '''
+    Return the spent, remaining and projected amounts of each of a user's budgets.
+
+    Budgets without a category cover all expenses. The projection extrapolates the
+    spend so far linearly to the end of the period; a budget is 'over' once spent
+    exceeds it and 'at_risk' when only the projection does. Two queries are made,
+    however many expenses the user has.
+    '''
+    today = today or date.today()
+    budgets = list(Budget.objects.filter(user=user).order_by('period', 'id'))
+    if not budgets:
+        return []
+    spent = period_spend(user, budgets, today)
+    categories = registry.snapshot()
+
+    statuses = []
+    for budget in budgets:
+        start_date, end_date = period_bounds(budget.period, today)
+        amount_spent = spent.get((budget.period, budget.category_id), Decimal('0'))
+        elapsed = (today - start_date).days + 1
+        length = (end_date - start_date).days + 1
+        projected = (amount_spent * length / elapsed).quantize(CENTS)
+        if amount_spent > budget.amount:
+            state = OVER
+        elif projected > budget.amount:
+            state = AT_RISK
+        else:
+            state = OK
+        statuses.append({
+            'budget': budget,
+            'name': categories.name(budget.category_id) if budget.category_id else 'Wszystkie wydatki',
+            'period': budget.get_period_display(),
+            'start_date': start_date,
+            'end_date': end_date,
+            'amount': budget.amount,
+            'spent': amount_spent,
+            'remaining': budget.amount - amount_spent,
+            'projected': projected,
+            'state': state,
+        })
+    return statuses
+
+
+def overspend_alerts(statuses):
+    '''
+    Return the statuses of the budgets that are over or at risk, the overspent ones first.
+    '''
+    return sorted((status for status in statuses if status['state'] != OK),
+                  key=lambda status: (status['state'] != OVER, status['remaining']))
@@ -0,0 +1,164 @@
+import threading
+import time
+
+from collections import Counter
+from functools import partial
+
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+
+from .routers import pin_to_primary
+from .sharding import current_database
+
+CATEGORIES_VERSION_KEY = 'data-version:categories'
+MISSING = object()
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def user_version_key(user_id):
+    '''
+    Return the cache key holding a user's data-version counter.
+    '''
+    return f'data-version:user:{user_id}'
+
+
+def _bump(key):
+    '''
+    Increment a version counter, starting a fresh one if it is missing or was evicted.
+    '''
+    try:
+        cache.incr(key)
+    except ValueError:
+        # A nanosecond timestamp never repeats a version an evicted counter already used.
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def _bump_now_and_on_commit(key):
+    '''
+    Bump a version immediately and again once the current transaction commits.
+
+    The second bump discards anything another request cached from the old data
+    while the transaction was still open.
+    '''
+    _bump(key)
+    transaction.on_commit(partial(_bump, key), using=current_database())
+
+
+def bump_data_version(user_id):
+    '''
+    Mark a user's expenses and incomes as changed.
+
+    This also pins the user's reads to the primary database until the replica has the change.
+    '''
+    _bump_now_and_on_commit(user_version_key(user_id))
+    pin_to_primary(user_id)
+
+
+def bump_categories_version():
+    '''
+    Mark categories, which are shared by all users, as changed.
+    '''
+    _bump_now_and_on_commit(CATEGORIES_VERSION_KEY)
+
+
+def current_versions(*keys):
+    '''
+    Return the current values of version counters, creating missing ones.
+    '''
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def acurrent_versions(*keys):
+    '''
+    Async version of current_versions().
+    '''
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await cache.aadd(key, time.time_ns(), timeout=None)
+            versions[key] = await cache.aget(key)
+    return [versions[key] for key in keys]
+
+
+def data_version(user_id):
+    '''
+    Return a token that changes whenever the user's data or any category changes.
+    '''
+    user_version, categories_version = current_versions(user_version_key(user_id), CATEGORIES_VERSION_KEY)
+    return f'{user_version}.{categories_version}'
+
+
+async def adata_version(user_id):
+    '''
+    Async version of data_version().
+    '''
+    user_version, categories_version = await acurrent_versions(user_version_key(user_id), CATEGORIES_VERSION_KEY)
+    return f'{user_version}.{categories_version}'
+
+
+def user_data_key(user, name, version, args):
+    '''
+    Return the cache key of a cached_for_user() value.
+    '''
+    return ':'.join(['user-data', name, str(user.id), version, *map(str, args)])
+
+
+def cached_for_user(user, name, compute, *args, timeout=DEFAULT_TIMEOUT):
+    '''
+    Return compute(user, *args), cached under the user's current data version.
+
+    Entries are never deleted explicitly: a change bumps the version, so later
+    lookups use new keys and the stale entries simply expire or get evicted.
+    '''
+    key = user_data_key(user, name, data_version(user.id), args)
+    value = cache.get(key, MISSING)
+    if value is MISSING:
+        record('misses')
+        value = compute(user, *args)
+        cache.set(key, value, timeout)
+    else:
+        record('hits')
+    return value
+
+
+async def acached_for_user(user, name, acompute, *args, timeout=DEFAULT_TIMEOUT):
+    '''
+    Async version of cached_for_user(), for a coroutine function acompute.
+
+    Values are shared with cached_for_user() when acompute returns the same as its
+    sync counterpart and both are cached under the same name.
+    '''
+    key = user_data_key(user, name, await adata_version(user.id), args)
+    value = await cache.aget(key, MISSING)
+    if value is MISSING:
+        record('misses')
+        value = await acompute(user, *args)
+        await cache.aset(key, value, timeout)
+    else:
+        record('hits')
+    return value
+
+
+def record(outcome):
+    '''
+    Count a cache hit or miss in this process.
+    '''
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def cache_stats():
+    '''
+    Return the hit and miss counts of this process and the resulting hit ratio.
+    '''
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    return {'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses) if hits + misses else 0}
@@ -0,0 +1,69 @@
+import hashlib
+
+from datetime import date
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .caching import adata_version, data_version
+
+# PDFs are compressed already, as are the gzip variants of the CSV report.
+COMPRESSED_TYPES = ('text/', 'application/json')
+
+gzip = GZipMiddleware(lambda request: None)
+
+
+def data_etag(request, version):
+    '''
+    Return the ETag of the response to a request for a user's data at a data version.
+
+    Besides the version it covers the path, the query string, the user and the day,
+    as filters such as 'this month' are relative to it.
+    '''
+    key = '|'.join([request.path, request.GET.urlencode(), str(request.user.id), version, date.today().isoformat()])
+    return f'"{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}"'
+
+
+def validated(request, response, etag):
+    '''
+    Add the ETag and revalidation headers to a response and gzip its text body if the client accepts that.
+    '''
+    if response.status_code not in (200, 304):
+        return response
+    response['ETag'] = etag
+    # Browsers keep the response but ask again every time; shared caches must not keep it.
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    if response.status_code == 200 and response.get('Content-Type', '').startswith(COMPRESSED_TYPES):
+        response = gzip.process_response(request, response)
+    return response
+
+
+def conditional_on_data(view):
+    '''
+    Answer a repeated GET of a view, sync or async, built from the user's data with 304 Not Modified.
+
+    The ETag is derived from the user's data version, which is read from the cache,
+    so while the data is unchanged the view does not run and the database is not
+    queried. Text responses are gzip-compressed. Apply it inside login_required.
+    '''
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            etag = data_etag(request, await adata_version(request.user.id))
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            return validated(request, response, etag)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        etag = data_etag(request, data_version(request.user.id))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        return validated(request, response, etag)
+    return wrapper
@@ -0,0 +1,279 @@
+import gzip
+import json
+import struct
+import zlib
+
+from datetime import date
+from functools import partial
+
+import numpy as np
+
+from django.contrib.auth.models import User
+
+from .archive import archived_positions, archived_users, archived_years
+from .models import Transaction
+from .registry import registry
+from .sharding import databases, shard_for
+
+CHUNK_SIZE = 10000
+EXPORT_FIELDS = ('id', 'user_id', 'type', 'date', 'category_id', 'amount', 'comment')
+# Content type and file extension of each format.
+EXPORT_FORMATS = {
+    'ndjson': ('application/gzip', 'ndjson.gz'),
+    'columnar': ('application/octet-stream', 'bgex'),
+}
+KINDS = ('expense', 'income')
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+MAGIC = b'BGEX'
+VERSION = 1
+# magic, version; once at the start of a columnar file.
+FILE_HEADER = struct.Struct('<4sH')
+# rows, compressed payload size, cursor size; before every block.
+BLOCK_HEADER = struct.Struct('<IIH')
+# The columns of a block's payload, in order, followed by its JSON comment dictionary;
+# archived rows, which have no id, get id 0.
+COLUMNS = (('id', '<i8'), ('user_id', '<u4'), ('kind', '<u1'), ('day', '<i4'), ('category_id', '<u4'),
+           ('amount', '<i8'), ('comment', '<i4'))
+EPOCH = date(1970, 1, 1).toordinal()
+NO_COMMENT = -1
+
+
+class ExportError(Exception):
+    '''
+    Raised when a columnar export file cannot be read.
+    '''
+
+
+def archive_segment(user_id, year):
+    '''
+    Return the segment of an export holding the rows of a user's archive file of a year.
+    '''
+    return f'a.{user_id}.{year}'
+
+
+def encode_export_cursor(segment, position):
+    '''
+    Return the cursor of the position after a row: its segment and its position there.
+
+    A segment is the index of a database in databases(), where the position is the
+    row's id, or an archive_segment(), where it is the row's position in the file.
+    '''
+    return f'{segment}.{position}'
+
+
+def decode_export_cursor(cursor):
+    '''
+    Return the key of an export cursor, which sorts in export order.
+
+    Keys are (0, user id, year, position) in the archived rows, which come first,
+    and (1, database index, row id) in the ledger. Raises ValueError when the
+    cursor is malformed.
+    '''
+    parts = cursor.split('.')
+    if len(parts) == 4 and parts[0] == 'a':
+        key = (0, *(int(part) for part in parts[1:]))
+    elif len(parts) == 2:
+        key = (1, *(int(part) for part in parts))
+    else:
+        raise ValueError(f'Invalid export cursor {cursor!r}.')
+    if min(key) < 0:
+        raise ValueError(f'Invalid export cursor {cursor!r}.')
+    return key
+
+
+def parse_export_params(params):
+    '''
+    Read the format (default ndjson) and the optional after cursor of an export request.
+
+    Raises ValueError when the format is unknown or the cursor malformed.
+    '''
+    export_format = params.get('format') or 'ndjson'
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format {export_format!r}.')
+    after = params.get('after') or None
+    if after:
+        decode_export_cursor(after)
+    return export_format, after
+
+
+def export_archives(user_id=None):
+    '''
+    Return the (user id, year) archive files of a user, or of everybody, in cursor order.
+    '''
+    if user_id is not None:
+        return [(user_id, year) for year in archived_years(user_id)]
+    # Archive directories of deleted accounts are left out.
+    user_ids = set(User.objects.filter(id__in=archived_users()).values_list('id', flat=True))
+    return [(archived_user_id, year) for archived_user_id in sorted(user_ids)
+            for year in archived_years(archived_user_id)]
+
+
+def export_sources(user_id=None):
+    '''
+    Return (database index, queryset) pairs of the ledger rows of a user, or of everybody, in cursor order.
+
+    A user's rows are read through the router, from the user's shard or the
+    replica chosen for the request; everybody's from each database in turn.
+    '''
+    aliases = databases()
+    if user_id is not None:
+        return [(aliases.index(shard_for(user_id)), Transaction.objects.filter(user_id=user_id))]
+    return [(index, Transaction.objects.using(alias)) for index, alias in enumerate(aliases)]
+
+
+def archive_rows(user_id, year, after, categories):
+    '''
+    Iterate over the export rows of a user's archive file of a year after a position.
+
+    Rows of since deleted categories are skipped, as their ledger rows would have
+    been deleted.
+    '''
+    for position, (kind, day, category_id, amount, comment) in archived_positions(user_id, year, after):
+        if category_id in categories.by_id:
+            yield position, None, user_id, kind, day, category_id, amount, comment
+
+
+def segment_rows(user_id=None, after=None, chunk_size=CHUNK_SIZE):
+    '''
+    Iterate over the (segment, rows) of an export after a cursor: each archive file, then each database.
+    '''
+    start = decode_export_cursor(after) if after else (0,)
+    categories = registry.snapshot()
+    for archived_user_id, year in export_archives(user_id):
+        key = (0, archived_user_id, year)
+        if key >= start[:3]:
+            yield (archive_segment(archived_user_id, year),
+                   archive_rows(archived_user_id, year, start[3] if key == start[:3] else 0, categories))
+    for index, rows in export_sources(user_id):
+        key = (1, index)
+        if key == start[:2]:
+            rows = rows.filter(id__gt=start[2])
+        if key >= start[:2]:
+            yield index, rows.order_by('id').values_list('id', *EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+
+
+def export_batches(user_id=None, after=None, chunk_size=CHUNK_SIZE):
+    '''
+    Iterate over (segment, rows) batches of the transactions of a user, or of everybody, after a cursor.
+
+    Rows are (position, id, user id, kind, date, category id, amount, comment)
+    tuples. Rows of archived years come first, from each archive file in user and
+    year order, with no id; the ledger follows in id order, read without building
+    model instances through one server-side cursor per database. Batches hold up
+    to chunk_size rows of one segment.
+    '''
+    for segment, rows in segment_rows(user_id, after, chunk_size):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                yield segment, batch
+                batch = []
+        if batch:
+            yield segment, batch
+
+
+def ndjson_chunk(segment, rows, categories):
+    '''
+    Return rows as one gzip member of NDJSON lines.
+
+    Every line carries the cursor to resume after it; amounts are decimal strings
+    without their sign, as in the API and the CSV report.
+    '''
+    encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    lines = [encode({
+        'cursor': encode_export_cursor(segment, position), 'id': row_id, 'user_id': user_id, 'kind': kind,
+        'date': day.isoformat(), 'category_id': category_id, 'category': categories.name(category_id),
+        'amount': f'{abs(amount):f}', 'comment': comment,
+    }) for position, row_id, user_id, kind, day, category_id, amount, comment in rows]
+    lines.append('')
+    return gzip.compress('\n'.join(lines).encode('utf-8'), compresslevel=6, mtime=0)
+
+
+def columnar_chunk(segment, rows):
+    '''
+    Return rows as one block of the columnar format.
+
+    The block header is followed by the cursor after its last row and a
+    zlib-compressed payload: the COLUMNS one after another, little-endian, with
+    dates as days since 1970-01-01, amounts as cents without their sign, kinds as
+    their index in KINDS and comments as references to the block's comment
+    dictionary, which comes last as a JSON list.
+    '''
+    count = len(rows)
+    comments = {}
+    refs = [NO_COMMENT if row[7] is None else comments.setdefault(row[7], len(comments)) for row in rows]
+    payload = zlib.compress(b''.join([
+        struct.pack(f'<{count}q', *(row[1] or 0 for row in rows)),
+        struct.pack(f'<{count}I', *(row[2] for row in rows)),
+        struct.pack(f'<{count}B', *(KIND_CODES[row[3]] for row in rows)),
+        struct.pack(f'<{count}i', *(row[4].toordinal() - EPOCH for row in rows)),
+        struct.pack(f'<{count}I', *(row[5] for row in rows)),
+        struct.pack(f'<{count}q', *(int(abs(row[6]) * 100) for row in rows)),
+        struct.pack(f'<{count}i', *refs),
+        json.dumps(list(comments), ensure_ascii=False).encode('utf-8'),
+    ]), 6)
+    cursor = encode_export_cursor(segment, rows[-1][0]).encode('ascii')
+    return BLOCK_HEADER.pack(count, len(payload), len(cursor)) + cursor + payload
+
+
+def export_header(export_format):
+    '''
+    Return the bytes an export file of a format starts with.
+    '''
+    return FILE_HEADER.pack(MAGIC, VERSION) if export_format == 'columnar' else b''
+
+
+def export_chunks(export_format, user_id=None, after=None, chunk_size=CHUNK_SIZE):
+    '''
+    Iterate over (cursor, bytes) chunks of an export, each complete on its own.
+
+    A chunk is a gzip member or a columnar block of up to chunk_size rows, so a
+    file cut after any chunk is valid and the export resumes after its cursor.
+    '''
+    batches = export_batches(user_id, after, chunk_size)
+    if export_format == 'columnar':
+        chunk = columnar_chunk
+    else:
+        chunk = partial(ndjson_chunk, categories=registry.snapshot())
+    for segment, rows in batches:
+        yield encode_export_cursor(segment, rows[-1][0]), chunk(segment, rows)
+
+
+def export_stream(export_format, user_id=None, after=None, chunk_size=CHUNK_SIZE):
+    '''
+    Yield an export of a format as bytes.
+    '''
+    header = export_header(export_format)
+    if header:
+        yield header
+    for cursor, chunk in export_chunks(export_format, user_id, after, chunk_size):
+        yield chunk
+
+
+def read_columnar(source):
+    '''
+    Iterate over the (cursor, columns) blocks of a columnar export read from a binary file.
+
+    Columns map the names of COLUMNS to numpy arrays and 'comments' to the
+    block's comment dictionary.
+    '''
+    header = source.read(FILE_HEADER.size)
+    if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header) != (MAGIC, VERSION):
+        raise ExportError(f'Not a version {VERSION} columnar export.')
+    while header := source.read(BLOCK_HEADER.size):
+        if len(header) < BLOCK_HEADER.size:
+            raise ExportError('The export ends inside a block header.')
+        count, payload_size, cursor_size = BLOCK_HEADER.unpack(header)
+        cursor = source.read(cursor_size)
+        packed = source.read(payload_size)
+        if len(cursor) < cursor_size or len(packed) < payload_size:
+            raise ExportError('The export ends inside a block.')
+        payload = zlib.decompress(packed)
+        columns = {}
+        offset = 0
+        for name, dtype in COLUMNS:
+            columns[name] = np.frombuffer(payload, dtype=dtype, count=count, offset=offset)
+            offset += columns[name].nbytes
+        columns['comments'] = json.loads(payload[offset:].decode('utf-8'))
+        yield cursor.decode('ascii'), columns
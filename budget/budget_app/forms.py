@@ -2,7 +2,7 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django import forms
 
-from .models import Expense, Income
+from .models import Budget, Category, Expense, Income, RecurringRule
 
 
 class RegistrationForm(UserCreationForm):
@@ -69,6 +69,70 @@ class IncomeForm(forms.ModelForm):
                                                                                        user=user).distinct()
 
 
+class BudgetForm(forms.ModelForm):
+    '''
+    Form for adding budgets.
+    '''
+    class Meta:
+        '''
+        Meta class specifying the Budget model and fields.
+        '''
+        model = Budget
+        fields = ['category', 'amount', 'period']
+        labels = {'category': 'Kategoria', 'amount': 'Kwota', 'period': 'Okres'}
+
+    def __init__(self, *args, **kwargs):
+        '''
+        Constructor method for BudgetForm, offering only expense categories.
+        '''
+        super(BudgetForm, self).__init__(*args, **kwargs)
+        self.fields['category'].queryset = Category.objects.filter(type='expense').order_by('id')
+        self.fields['category'].required = False
+        self.fields['category'].empty_label = 'Wszystkie wydatki'
+
+    def clean_amount(self):
+        '''
+        Require a positive amount.
+        '''
+        amount = self.cleaned_data['amount']
+        if amount <= 0:
+            raise forms.ValidationError('Kwota musi być większa od zera.')
+        return amount
+
+
+class RecurringRuleForm(forms.ModelForm):
+    '''
+    Form for adding recurring expenses and incomes.
+    '''
+    class Meta:
+        '''
+        Meta class specifying the RecurringRule model and fields.
+        '''
+        model = RecurringRule
+        fields = ['kind', 'category', 'amount', 'comment', 'frequency', 'interval', 'start_date', 'end_date']
+        labels = {'kind': 'Typ', 'category': 'Kategoria', 'amount': 'Kwota', 'comment': 'Komentarz',
+                  'frequency': 'Częstotliwość', 'interval': 'Co ile', 'start_date': 'Od', 'end_date': 'Do'}
+        widgets = {
+            'start_date': forms.DateInput(attrs={'type': 'date'}),
+            'end_date': forms.DateInput(attrs={'type': 'date'}),
+        }
+
+    def clean(self):
+        '''
+        Require a positive interval, a category of the chosen type and an end date after the start date.
+        '''
+        cleaned_data = super().clean()
+        category = cleaned_data.get('category')
+        if category is not None and category.type != cleaned_data.get('kind'):
+            self.add_error('category', 'Kategoria nie pasuje do typu.')
+        if cleaned_data.get('interval') == 0:
+            self.add_error('interval', 'Odstęp musi być większy od zera.')
+        start_date, end_date = cleaned_data.get('start_date'), cleaned_data.get('end_date')
+        if start_date and end_date and end_date < start_date:
+            self.add_error('end_date', 'Data końcowa nie może być wcześniejsza niż początkowa.')
+        return cleaned_data
+
+
 class CategoryForm(forms.Form):
     '''
     Form for adding categories.
@@ -76,3 +140,38 @@ class CategoryForm(forms.Form):
     new_category = forms.CharField(label='Nowa kategoria', max_length=100)
     category_type = forms.ChoiceField(label='Typ', choices=(('expense', 'Wydatek'), ('income', 'Dochód')))
 
+
+class ImportForm(forms.Form):
+    '''
+    Form for importing a CSV bank statement.
+    '''
+    file = forms.FileField(label='Plik CSV')
+    file_format = forms.ChoiceField(label='Format', choices=(('report', 'Raport CSV'), ('mapped', 'Własne kolumny')))
+    date_column = forms.CharField(label='Kolumna daty', required=False)
+    amount_column = forms.CharField(label='Kolumna kwoty', required=False)
+    category_column = forms.CharField(label='Kolumna kategorii', required=False)
+    comment_column = forms.CharField(label='Kolumna komentarza', required=False)
+    kind_column = forms.CharField(label='Kolumna typu', required=False)
+    date_format = forms.CharField(label='Format daty', initial='%Y-%m-%d')
+    delimiter = forms.CharField(label='Separator', initial=',', max_length=1, strip=False)
+    decimal_comma = forms.BooleanField(label='Przecinek dziesiętny', required=False)
+
+    def clean(self):
+        '''
+        Require the date and amount columns for the mapped format.
+        '''
+        cleaned_data = super().clean()
+        if cleaned_data.get('file_format') == 'mapped':
+            for field in ('date_column', 'amount_column'):
+                if not cleaned_data.get(field):
+                    self.add_error(field, 'To pole jest wymagane dla własnych kolumn.')
+        return cleaned_data
+
+    def mapping(self):
+        '''
+        Return the column mapping for StatementImporter, or None for the report format.
+        '''
+        if self.cleaned_data['file_format'] != 'mapped':
+            return None
+        return {field: self.cleaned_data[f'{field}_column']
+                for field in ('date', 'amount', 'category', 'comment', 'kind')}
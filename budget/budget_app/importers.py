@@ -0,0 +1,178 @@
+import csv
+import hashlib
+import time
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.db import router, transaction
+
+from .caching import bump_data_version
+from .ledger import mirror_rows
+from .models import Category, Expense, Income
+from .rollups import apply_deltas
+
+LEDGER_MODELS = {'expense': Expense, 'income': Income}
+REPORT_MAPPING = {'kind': 'Section', 'date': 'Date', 'category': 'Category', 'amount': 'Amount',
+                  'comment': 'Comment'}
+REQUIRED_FIELDS = ('date', 'amount')
+BATCH_SIZE = 2000
+MAX_ERRORS = 100
+MAX_CACHED_DATES = 10000
+MAX_AMOUNT = Decimal('99999999.99')
+CENT = Decimal('0.01')
+
+
+def transaction_hash(day, amount, comment):
+    '''
+    Return the content hash used to detect duplicate transactions of a user.
+    '''
+    key = f"{day.isoformat()}|{amount:.2f}|{(comment or '').strip()}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class StatementImporter:
+    '''
+    Import a user's expenses and incomes from a CSV statement.
+
+    mapping maps the fields kind, date, category, amount and comment to column names;
+    only date and amount are required. Without a kind column negative amounts become
+    expenses and positive amounts incomes. Rows are parsed while the file is read,
+    inserted with bulk_create one batch per transaction, and rows whose content hash
+    already exists for the user are skipped.
+    '''
+    def __init__(self, user, mapping=None, date_format='%Y-%m-%d', delimiter=',', decimal_comma=False,
+                 batch_size=BATCH_SIZE, default_category='Import'):
+        self.user = user
+        self.mapping = {field: column for field, column in (mapping or REPORT_MAPPING).items() if column}
+        self.date_format = date_format
+        self.delimiter = delimiter
+        self.decimal_comma = decimal_comma
+        self.batch_size = batch_size
+        self.default_category = default_category
+        self.categories = {}
+        self.dates = {}
+
+    def parse_amount(self, value):
+        '''
+        Parse an amount, accepting spaces as thousands separators and optionally a decimal comma.
+        '''
+        value = value.replace('\xa0', '').replace(' ', '')
+        if self.decimal_comma:
+            value = value.replace('.', '').replace(',', '.')
+        amount = Decimal(value).quantize(CENT)
+        if abs(amount) > MAX_AMOUNT:
+            raise ValueError(f'Amount {value} is too large.')
+        return amount
+
+    def parse_date(self, value):
+        '''
+        Parse a date, caching results since statements repeat the same dates many times.
+        '''
+        day = self.dates.get(value)
+        if day is None:
+            if len(self.dates) >= MAX_CACHED_DATES:
+                self.dates.clear()
+            day = self.dates[value] = datetime.strptime(value.strip(), self.date_format).date()
+        return day
+
+    def parse_row(self, row):
+        '''
+        Return (kind, date, category name, amount, comment) for one CSV row.
+
+        Raises ValueError when the row is invalid.
+        '''
+        try:
+            amount = self.parse_amount(row[self.mapping['amount']] or '')
+        except InvalidOperation:
+            raise ValueError(f"Invalid amount: {row[self.mapping['amount']]!r}")
+        day = self.parse_date(row[self.mapping['date']] or '')
+        if 'kind' in self.mapping:
+            kind = (row[self.mapping['kind']] or '').strip().lower()
+            if kind not in LEDGER_MODELS:
+                raise ValueError(f"Invalid type: {row[self.mapping['kind']]!r}")
+        else:
+            kind = 'expense' if amount < 0 else 'income'
+        category_name = (row[self.mapping['category']] or '').strip() if 'category' in self.mapping else ''
+        comment = (row[self.mapping['comment']] or '').strip() or None if 'comment' in self.mapping else None
+        return kind, day, category_name or self.default_category, abs(amount), comment
+
+    def category_id(self, kind, name):
+        '''
+        Return the id of the category with the given type and name, creating it if needed.
+        '''
+        key = (kind, name)
+        if key not in self.categories:
+            category = Category.objects.filter(type=kind, name=name).first()
+            if category is None:
+                category = Category.objects.create(type=kind, name=name)
+            self.categories[key] = category.id
+        return self.categories[key]
+
+    def insert_batch(self, kind, rows):
+        '''
+        Insert one batch of parsed rows of a kind, skipping duplicates, and update the rollups.
+
+        Returns the number of rows created.
+        '''
+        model_class = LEDGER_MODELS[kind]
+        unique_rows = {}
+        for day, category_name, amount, comment in rows:
+            unique_rows.setdefault(transaction_hash(day, amount, comment), (day, category_name, amount, comment))
+        with transaction.atomic(using=router.db_for_write(model_class)):
+            existing = set(model_class.objects.filter(user=self.user, content_hash__in=list(unique_rows))
+                           .values_list('content_hash', flat=True))
+            objects = []
+            deltas = defaultdict(lambda: [0, 0])
+            for content_hash, (day, category_name, amount, comment) in unique_rows.items():
+                if content_hash in existing:
+                    continue
+                category_id = self.category_id(kind, category_name)
+                objects.append(model_class(user_id=self.user.id, category_id=category_id, date=day, amount=amount,
+                                           comment=comment, content_hash=content_hash))
+                delta = deltas[(category_id, day.year, day.month)]
+                delta[0] += amount
+                delta[1] += 1
+            model_class.objects.bulk_create(objects, batch_size=self.batch_size)
+            mirror_rows(kind, objects, batch_size=self.batch_size)
+            apply_deltas(self.user.id, kind, deltas)
+            if objects:
+                bump_data_version(self.user.id)
+        return len(objects)
+
+    def import_file(self, text_stream):
+        '''
+        Import all rows of a text stream and return a report of what happened.
+        '''
+        started = time.perf_counter()
+        reader = csv.DictReader(text_stream, delimiter=self.delimiter)
+        missing = [column for column in self.mapping.values() if column not in (reader.fieldnames or [])]
+        missing += [field for field in REQUIRED_FIELDS if field not in self.mapping]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+
+        report = {'rows': 0, 'created': 0, 'duplicates': 0, 'error_count': 0, 'errors': []}
+        batches = {kind: [] for kind in LEDGER_MODELS}
+        for row in reader:
+            report['rows'] += 1
+            try:
+                kind, day, category_name, amount, comment = self.parse_row(row)
+            except (ValueError, TypeError) as error:
+                report['error_count'] += 1
+                if len(report['errors']) < MAX_ERRORS:
+                    report['errors'].append((reader.line_num, str(error)))
+                continue
+            batch = batches[kind]
+            batch.append((day, category_name, amount, comment))
+            if len(batch) >= self.batch_size:
+                report['created'] += self.insert_batch(kind, batch)
+                batch.clear()
+        for kind, batch in batches.items():
+            if batch:
+                report['created'] += self.insert_batch(kind, batch)
+
+        report['duplicates'] = report['rows'] - report['error_count'] - report['created']
+        report['seconds'] = time.perf_counter() - started
+        report['rows_per_second'] = report['rows'] / report['seconds'] if report['seconds'] else 0
+        return report
@@ -0,0 +1,119 @@
+import heapq
+
+from django.db import router, transaction
+
+from .archive import archived_rows
+from .models import Expense, Income, Transaction
+from .registry import registry
+from .sharding import databases, using_database
+
+LEDGER_SIGNS = {'expense': -1, 'income': 1}
+SOURCE_MODELS = {'expense': Expense, 'income': Income}
+MIRRORED_FIELDS = ['user', 'category', 'amount', 'date', 'comment']
+BATCH_SIZE = 5000
+
+
+def ledger_transaction(kind, row):
+    '''
+    Return the unsaved ledger transaction mirroring an Expense or Income row.
+    '''
+    return Transaction(type=kind, source_id=row.id, user_id=row.user_id, category_id=row.category_id,
+                       amount=LEDGER_SIGNS[kind] * row.amount, date=row.date, comment=row.comment)
+
+
+def mirror_row(kind, row):
+    '''
+    Create or update the ledger transaction of one Expense or Income row.
+    '''
+    mirrored = ledger_transaction(kind, row)
+    updated = Transaction.objects.filter(type=kind, source_id=row.id).update(
+        user_id=mirrored.user_id, category_id=mirrored.category_id, amount=mirrored.amount, date=mirrored.date,
+        comment=mirrored.comment)
+    if not updated:
+        mirrored.save()
+
+
+def mirror_rows(kind, rows, batch_size=BATCH_SIZE):
+    '''
+    Create or update the ledger transactions of Expense or Income rows written in bulk.
+
+    Existing transactions are updated in place, so they keep the ids exports resume after.
+    '''
+    mirrored = [ledger_transaction(kind, row) for row in rows]
+    with transaction.atomic(using=router.db_for_write(Transaction)):
+        ids = dict(Transaction.objects.filter(type=kind, source_id__in=[row.source_id for row in mirrored]).values_list(
+            'source_id', 'id'))
+        for row in mirrored:
+            row.id = ids.get(row.source_id)
+        Transaction.objects.bulk_update([row for row in mirrored if row.id is not None], MIRRORED_FIELDS,
+                                        batch_size=batch_size)
+        Transaction.objects.bulk_create([row for row in mirrored if row.id is None], batch_size=batch_size)
+
+
+def unmirror_row(kind, row_id):
+    '''
+    Delete the ledger transaction of a deleted Expense or Income row.
+    '''
+    Transaction.objects.filter(type=kind, source_id=row_id).delete()
+
+
+def backfill_ledger(batch_size=BATCH_SIZE, user_ids=None):
+    '''
+    Mirror Expense and Income rows missing from the ledger, e.g. after bulk writes.
+
+    Rows are copied in id order, one short transaction per batch, on every shard;
+    returns the number of transactions created.
+    '''
+    created = 0
+    for alias in databases(user_ids):
+        with using_database(alias):
+            created += backfill_database(batch_size, user_ids)
+    return created
+
+
+def backfill_database(batch_size, user_ids):
+    '''
+    backfill_ledger() for the database sharded queries currently go to.
+    '''
+    created = 0
+    for kind, model_class in SOURCE_MODELS.items():
+        rows = model_class.objects.order_by('id')
+        if user_ids:
+            rows = rows.filter(user_id__in=user_ids)
+        last_id = 0
+        while True:
+            batch = list(rows.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic(using=router.db_for_write(Transaction)):
+                mirrored = set(Transaction.objects.filter(
+                    type=kind, source_id__in=[row.id for row in batch]).values_list('source_id', flat=True))
+                missing = [ledger_transaction(kind, row) for row in batch if row.id not in mirrored]
+                Transaction.objects.bulk_create(missing)
+            created += len(missing)
+            last_id = batch[-1].id
+    return created
+
+
+def ledger_rows(user, filters, kind=None, chunk_size=2000):
+    '''
+    Iterate over (kind, date, category name, amount, comment) tuples with one scan of the ledger.
+
+    Incomes come before expenses ('income' sorts after 'expense'), each in date order;
+    amounts are returned without their sign. Rows of archived years are read from the
+    user's archive files and merged in.
+    '''
+    user_id = getattr(user, 'id', user)
+    queryset = Transaction.objects.filter(user_id=user_id, **filters)
+    if kind:
+        queryset = queryset.filter(type=kind)
+    categories = registry.snapshot()
+    rows = ((row_kind, day, category_id, abs(amount), comment) for row_kind, day, category_id, amount, comment in
+            queryset.values_list('type', 'date', 'category_id', 'amount', 'comment').order_by(
+                '-type', 'date', 'source_id').iterator(chunk_size=chunk_size))
+    # Archived rows of since deleted categories are skipped, as their hot rows would have been deleted.
+    archived = (row for archive_kind in ([kind] if kind else ['income', 'expense'])
+                for row in archived_rows(user_id, archive_kind, filters) if row[2] in categories.by_id)
+    rows = heapq.merge(archived, rows, key=lambda row: (row[0] != 'income', row[1]))
+    return ((row_kind, day, categories.name(category_id), amount, comment)
+            for row_kind, day, category_id, amount, comment in rows)
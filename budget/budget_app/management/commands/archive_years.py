@@ -0,0 +1,30 @@
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from budget_app.archive import archive_year
+from budget_app.models import MonthlyRollup
+from budget_app.sharding import using_shard_of
+
+
+class Command(BaseCommand):
+    help = 'Move expenses and incomes of closed years into per-user archive files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=int, default=date.today().year - 1,
+                            help='Archive years before this one (default: all but the current and last year).')
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Only archive the given user id (may be repeated).')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or list(User.objects.values_list('id', flat=True))
+        moved = 0
+        for user_id in user_ids:
+            with using_shard_of(user_id):
+                years = MonthlyRollup.objects.filter(
+                    user_id=user_id, year__lt=options['before'], count__gt=0
+                ).values_list('year', flat=True).distinct().order_by('year')
+                for year in years:
+                    moved += archive_year(user_id, year)
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} rows of {len(user_ids)} users.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from budget_app.ledger import BATCH_SIZE, backfill_ledger
+
+
+class Command(BaseCommand):
+    help = 'Copy expenses and incomes that are missing from the unified ledger, e.g. after bulk writes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows copied per transaction.')
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Only backfill the given user id (may be repeated).')
+
+    def handle(self, *args, **options):
+        created = backfill_ledger(options['batch_size'], options['users'])
+        self.stdout.write(self.style.SUCCESS(f'Copied {created} rows into the ledger.'))
@@ -0,0 +1,77 @@
+import time
+
+from datetime import date, timedelta
+
+import numpy as np
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from budget_app.analytics import Columns, day_number, insights, load_columns, monthly_category_spend, \
+    rolling_spend, spend_percentiles, top_movers
+from budget_app.sharding import using_shard_of
+
+
+def synthetic_columns(rows, categories, as_of, seed=0):
+    '''
+    Return Columns with random expenses and incomes spread over the two years before as_of.
+    '''
+    random = np.random.default_rng(seed)
+    end = day_number(as_of)
+    days = random.integers(end - 730, end + 1, rows).astype(np.int32)
+    cents = random.lognormal(8, 1.2, rows).astype(np.int64)
+    cents[random.random(rows) < 0.9] *= -1
+    codes = random.integers(0, categories, rows).astype(np.int32)
+    return Columns(days, cents, codes, np.arange(1, categories + 1, dtype=np.int64))
+
+
+def best_of(repeat, function, *args):
+    '''
+    Return the fastest of repeat runs of function(*args) in milliseconds.
+    '''
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        timings.append((time.perf_counter() - started) * 1000)
+    return min(timings)
+
+
+class Command(BaseCommand):
+    help = 'Time the analytics engine on synthetic columns and, optionally, on a real user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Number of synthetic transactions.')
+        parser.add_argument('--categories', type=int, default=40, help='Number of synthetic categories.')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement; the best is reported.')
+        parser.add_argument('--user', help='Also time loading and analysing this username from the database.')
+
+    def handle(self, *args, **options):
+        as_of = date.today()
+        repeat = options['repeat']
+        columns = synthetic_columns(options['rows'], options['categories'], as_of)
+        matrix = monthly_category_spend(columns, as_of)
+        stages = [
+            ('rolling 30/90-day spend', rolling_spend, columns, as_of),
+            ('month-over-month matrix', monthly_category_spend, columns, as_of),
+            ('percentiles and medians', spend_percentiles, columns, as_of),
+            ('top movers', top_movers, np.diff(matrix, axis=1)[:, -1]),
+        ]
+        self.stdout.write(f"{options['rows']} synthetic rows, best of {repeat}:")
+        total = 0
+        for name, function, *arguments in stages:
+            elapsed = best_of(repeat, function, *arguments)
+            total += elapsed
+            self.stdout.write(f'  {name:<26} {elapsed:8.2f} ms')
+        self.stdout.write(self.style.SUCCESS(f"  {'compute total':<26} {total:8.2f} ms"))
+
+        if options['user']:
+            user = User.objects.get(username=options['user'])
+            with using_shard_of(user.id):
+                start_date = as_of - timedelta(days=455)
+                rows = len(load_columns(user.id, start_date, as_of))
+                self.stdout.write(f"User {user.username}, {rows} rows in the analysed window, best of {repeat}:")
+                elapsed = best_of(repeat, load_columns, user.id, start_date, as_of)
+                self.stdout.write(f"  {'load_columns':<26} {elapsed:8.2f} ms")
+                elapsed = best_of(repeat, insights, user, as_of)
+                self.stdout.write(f"  {'insights (load + compute)':<26} {elapsed:8.2f} ms")
@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from budget_app.benchmarks import clear_seeded, run_asgi_load, run_wsgi_load, seed_data
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of the sync views (WSGI) and their async versions (ASGI profile) '
+            'under many simultaneous clients. Seeds synthetic data into the configured database, so run it '
+            'on a development copy; on PostgreSQL allow at least --clients extra connections.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=100, help='Simultaneous clients.')
+        parser.add_argument('--rounds', type=int, default=5, help='Requests each client sends one after another.')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Requests the WSGI side serves at once, like the threads of a WSGI process.')
+        parser.add_argument('--transactions', type=int, default=10000,
+                            help='Transactions of the synthetic user the clients log in as.')
+        parser.add_argument('--output', help='Where to write the results as JSON.')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic data.')
+
+    def handle(self, *args, **options):
+        clear_seeded()
+        user = seed_data(1, options['transactions'])[0]
+        results = [
+            run_wsgi_load(user, options['clients'], options['rounds'], options['threads']),
+            run_asgi_load(user, options['clients'], options['rounds']),
+        ]
+        if not options['keep']:
+            clear_seeded()
+        for result in results:
+            self.stdout.write(f"{result['mode']}: {result['requests']} requests from {result['clients']} clients "
+                              f"in {result['seconds']:.1f} s, {result['throughput']:.1f} req/s, "
+                              f"p50 {result['p50_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms, "
+                              f"max {result['max_ms']:.0f} ms, {result['errors']} errors")
+        wsgi, asgi = results
+        self.stdout.write(f"ASGI/WSGI throughput: {asgi['throughput'] / wsgi['throughput']:.2f}x")
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({'results': results}, output, indent=2)
+            self.stdout.write(f"Results written to {options['output']}.")
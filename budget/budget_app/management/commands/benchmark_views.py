@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from budget_app.benchmarks import clear_seeded, compare_results, run_benchmarks, seed_data, untimed_routes, \
+    write_results
+
+
+class Command(BaseCommand):
+    help = ('Seed synthetic data at several sizes and time every page, report and endpoint on it. '
+            'Writes to the configured database and clears the cache, so run it on a development copy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100,1000,10000',
+                            help='Comma-separated numbers of transactions of the timed user.')
+        parser.add_argument('--users', type=int, default=5,
+                            help='Synthetic users per size; the others only add rows to the tables.')
+        parser.add_argument('--repeat', type=int, default=5, help='Warm runs per request; the median is reported.')
+        parser.add_argument('--output', default='benchmark-results.json', help='Where to write the results.')
+        parser.add_argument('--baseline', help='Results of an earlier run to compare against.')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='Relative slowdown against the baseline that counts as a regression.')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic data of the last size.')
+
+    def handle(self, *args, **options):
+        missing = untimed_routes()
+        if missing:
+            self.stderr.write(f"Not timed: {', '.join(missing)}")
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        results = []
+        for size in sizes:
+            clear_seeded()
+            user = seed_data(options['users'], size)[0]
+            self.stdout.write(f'{size} transactions per user:')
+            for result in run_benchmarks(user, size, options['repeat']):
+                results.append(result)
+                self.stdout.write(f"  {result['case']:<26} {result['status']} {result['cold_ms']:9.1f} ms cold "
+                                  f"{result['warm_ms'] or 0:9.1f} ms warm {result['queries']:4} queries "
+                                  f"{result['peak_kb']:9.1f} KiB")
+        if not options['keep']:
+            clear_seeded()
+        write_results(options['output'], results, options['repeat'])
+        self.stdout.write(f"Results written to {options['output']}.")
+
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                regressions = compare_results(json.load(baseline_file), results, options['threshold'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,96 @@
+import json
+import os
+
+from contextlib import nullcontext
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from budget_app.exports import CHUNK_SIZE, EXPORT_FORMATS, decode_export_cursor, export_chunks, export_header
+from budget_app.sharding import using_shard_of
+
+
+def checkpoint_path(path):
+    '''
+    Return the path of the file recording how far the export into a file got.
+    '''
+    return f'{path}.checkpoint'
+
+
+def write_checkpoint(path, checkpoint):
+    '''
+    Replace the checkpoint of an export file, so it is never seen half-written.
+    '''
+    temporary_path = f'{checkpoint_path(path)}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as output:
+        json.dump(checkpoint, output)
+    os.replace(temporary_path, checkpoint_path(path))
+
+
+def read_checkpoint(path):
+    '''
+    Return the checkpoint of an export file, or None if it has none.
+    '''
+    try:
+        with open(checkpoint_path(path), encoding='utf-8') as source:
+            return json.load(source)
+    except FileNotFoundError:
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Export the ledger of a user, or of all users, as gzip-compressed NDJSON or in the columnar format, '
+            'in chunks that a later run can resume after.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='File to write.')
+        parser.add_argument('--user', help='Username to export (default: all users).')
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='ndjson')
+        parser.add_argument('--after', help='Only export the rows after this export cursor.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue an interrupted or earlier export into the file after its last chunk, '
+                                 'adding the rows written since.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows per chunk.')
+
+    def handle(self, *args, **options):
+        path = options['output']
+        export_format = options['format']
+        user_id = None
+        if options['user']:
+            try:
+                user_id = User.objects.get(username=options['user']).id
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist.")
+        after = options['after']
+        if options['resume']:
+            checkpoint = read_checkpoint(path)
+            if checkpoint is None:
+                raise CommandError(f'{path} has no checkpoint to resume from.')
+            if checkpoint['format'] != export_format or checkpoint['user_id'] != user_id:
+                raise CommandError(f'{path} is an export of another format or user.')
+            after = checkpoint['cursor']
+        try:
+            if after:
+                decode_export_cursor(after)
+        except ValueError:
+            raise CommandError(f'Invalid export cursor {after}.')
+
+        with open(path, 'r+b' if options['resume'] else 'wb') as output, \
+                using_shard_of(user_id) if user_id else nullcontext():
+            if options['resume']:
+                # Drop whatever an interrupted run wrote after its last complete chunk.
+                output.truncate(checkpoint['offset'])
+                output.seek(checkpoint['offset'])
+            else:
+                output.write(export_header(export_format))
+            checkpoint = {'format': export_format, 'user_id': user_id, 'cursor': after, 'offset': output.tell()}
+            write_checkpoint(path, checkpoint)
+            for cursor, chunk in export_chunks(export_format, user_id, after, options['chunk_size']):
+                output.write(chunk)
+                # The checkpoint never gets ahead of what is in the file.
+                output.flush()
+                checkpoint.update(cursor=cursor, offset=output.tell())
+                write_checkpoint(path, checkpoint)
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported the ledger to {path} up to cursor {checkpoint['cursor'] or '-'}; "
+            f"run again with --resume to add newer rows."))
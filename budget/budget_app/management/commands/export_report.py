@@ -0,0 +1,36 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from budget_app.reports import csv_lines, parse_report_filters
+from budget_app.sharding import using_shard_of
+
+
+class Command(BaseCommand):
+    help = "Write a user's CSV report, as the report view produces it, to a file or standard output."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('--output', help='File to write (default: standard output).')
+        parser.add_argument('--start-date', help='First day to include, YYYY-MM-DD.')
+        parser.add_argument('--end-date', help='Last day to include, YYYY-MM-DD.')
+        parser.add_argument('--category', help='Only include this category id.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist.")
+        try:
+            filters = parse_report_filters({'start-date': options['start_date'], 'end-date': options['end_date'],
+                                            'category': options['category']})
+        except ValueError:
+            raise CommandError('Invalid report filters.')
+        with using_shard_of(user.id):
+            lines = csv_lines(user, filters)
+            if not options['output']:
+                for block in lines:
+                    self.stdout.write(block, ending='')
+                return
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(lines)
+        self.stdout.write(self.style.SUCCESS(f"Wrote the report of {user.username} to {options['output']}."))
@@ -0,0 +1,46 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from budget_app.importers import BATCH_SIZE, StatementImporter
+from budget_app.sharding import using_shard_of
+
+
+class Command(BaseCommand):
+    help = "Import a CSV statement into a user's expenses and incomes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument('--date-column', help='Column with the date (enables the mapped format).')
+        parser.add_argument('--amount-column')
+        parser.add_argument('--category-column')
+        parser.add_argument('--comment-column')
+        parser.add_argument('--kind-column')
+        parser.add_argument('--date-format', default='%Y-%m-%d')
+        parser.add_argument('--delimiter', default=',')
+        parser.add_argument('--decimal-comma', action='store_true')
+        parser.add_argument('--encoding', default='utf-8-sig')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User {options['username']} does not exist.")
+        mapping = None
+        if options['date_column']:
+            mapping = {field: options[f'{field}_column'] for field in ('date', 'amount', 'category', 'comment', 'kind')}
+        importer = StatementImporter(user, mapping=mapping, date_format=options['date_format'],
+                                     delimiter=options['delimiter'], decimal_comma=options['decimal_comma'],
+                                     batch_size=options['batch_size'])
+        with open(options['path'], encoding=options['encoding'], newline='') as text_stream, using_shard_of(user.id):
+            try:
+                report = importer.import_file(text_stream)
+            except ValueError as error:
+                raise CommandError(str(error))
+        for line, message in report['errors']:
+            self.stderr.write(f'Line {line}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['created']} of {report['rows']} rows ({report['duplicates']} duplicates, "
+            f"{report['error_count']} errors) in {report['seconds']:.2f}s, "
+            f"{report['rows_per_second']:.0f} rows/s."))
@@ -0,0 +1,21 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from budget_app.recurring import BATCH_SIZE, materialize_due
+
+
+class Command(BaseCommand):
+    help = 'Create the expenses and incomes of recurring rules that are due; safe to run repeatedly, e.g. from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--until', type=date.fromisoformat, default=None,
+                            help='Materialize occurrences up to this date, YYYY-MM-DD (default: today).')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Rules read and rows created per transaction.')
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Only materialize the rules of the given user id (may be repeated).')
+
+    def handle(self, *args, **options):
+        created = materialize_due(options['until'], options['batch_size'], options['users'])
+        self.stdout.write(self.style.SUCCESS(f'Created {created} recurring transactions.'))
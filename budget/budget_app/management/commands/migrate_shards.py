@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from budget_app.models import UserShard
+from budget_app.sharding import BATCH_SIZE, place_users, shard_aliases, sync_reference_rows
+
+
+class Command(BaseCommand):
+    help = ('Migrate the default database and every shard, copy the users and categories to the shards '
+            'and record the shard of every user without one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--place-on', help='Record users without a shard on this alias, e.g. on default, where '
+                                               'their data is when sharding is turned on (default: place by id).')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows copied per query.')
+
+    def handle(self, *args, **options):
+        aliases = shard_aliases()
+        if not aliases:
+            raise CommandError('No SHARDS are configured.')
+        if options['place_on'] and options['place_on'] not in aliases:
+            raise CommandError(f"{options['place_on']} is not one of the SHARDS.")
+        for alias in dict.fromkeys([DEFAULT_DB_ALIAS, *aliases]):
+            self.stdout.write(f'Migrating {alias}.')
+            call_command('migrate', database=alias, interactive=False, verbosity=options['verbosity'],
+                         stdout=self.stdout)
+        for alias in aliases:
+            copied = sync_reference_rows(alias, options['batch_size'])
+            self.stdout.write(f'Copied {copied} users and categories to {alias}.')
+        placed = 0
+        unplaced = User.objects.exclude(id__in=UserShard.objects.values('user_id')).order_by('id')
+        while users := list(unplaced[:options['batch_size']]):
+            place_users(users, options['place_on'])
+            placed += len(users)
+        self.stdout.write(self.style.SUCCESS(f'Migrated {len(aliases)} shards and placed {placed} users.'))
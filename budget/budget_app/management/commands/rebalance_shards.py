@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from budget_app.rebalance import move_user
+from budget_app.sharding import BATCH_SIZE, ShardError, shard_aliases, shard_for
+
+
+class Command(BaseCommand):
+    help = "Move users' expenses, incomes, budgets and recurring rules to another shard, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', required=True,
+                            help='Id of a user to move (may be repeated).')
+        parser.add_argument('--to', required=True, dest='target', help='Database alias of the target shard.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows copied per transaction.')
+
+    def handle(self, *args, **options):
+        if options['target'] not in shard_aliases():
+            raise CommandError(f"{options['target']} is not one of the SHARDS.")
+        for user_id in options['users']:
+            source = shard_for(user_id)
+            try:
+                moved = move_user(user_id, options['target'], options['batch_size'])
+            except ShardError as error:
+                raise CommandError(str(error))
+            self.stdout.write(f"Moved {moved} rows of user {user_id} from {source} to {options['target']}.")
+        self.stdout.write(self.style.SUCCESS(f"Moved {len(options['users'])} users."))
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from budget_app.rollups import rebuild_user_rollups
+from budget_app.sharding import users_on, using_shard_of
+
+
+def rebuild_on_shard(user_id):
+    '''
+    Rebuild one user's rollups on the user's shard.
+    '''
+    with using_shard_of(user_id):
+        return rebuild_user_rollups(user_id)
+
+
+def rebuild_in_thread(user_id):
+    '''
+    Rebuild one user's rollups and release the thread's database connections.
+    '''
+    try:
+        return rebuild_on_shard(user_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the monthly rollup table from the expense and income tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of users rebuilt in parallel.')
+        parser.add_argument('--user', type=int, action='append', dest='users',
+                            help='Only rebuild the given user id (may be repeated).')
+        parser.add_argument('--shard', help='Only rebuild the users on the given database alias.')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or list(User.objects.values_list('id', flat=True))
+        if options['shard']:
+            on_shard = set(users_on(options['shard']))
+            user_ids = [user_id for user_id in user_ids if user_id in on_shard]
+        workers = options['workers']
+        if connections[DEFAULT_DB_ALIAS].vendor == 'sqlite':
+            # SQLite serialises writers, so parallel rebuilds would only contend for the lock.
+            workers = 1
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                rows = sum(executor.map(rebuild_in_thread, user_ids))
+        else:
+            rows = sum(rebuild_on_shard(user_id) for user_id in user_ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rows} rollup rows for {len(user_ids)} users.'))
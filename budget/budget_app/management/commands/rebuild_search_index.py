@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from budget_app.search import install_search_index
+from budget_app.sharding import databases
+
+
+class Command(BaseCommand):
+    help = 'Recreate the full-text index of the ledger, e.g. after a migration rebuilt its table on SQLite.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', help='Database to index (default: every database holding a ledger).')
+
+    def handle(self, *args, **options):
+        for alias in [options['database']] if options['database'] else databases():
+            install_search_index(connections[alias])
+        self.stdout.write(self.style.SUCCESS('Rebuilt the search index.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from budget_app.benchmarks import PREFIX, clear_seeded, seed_data
+
+
+class Command(BaseCommand):
+    help = 'Create synthetic users with realistic expenses and incomes, e.g. for benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help='Number of users to create.')
+        parser.add_argument('--transactions', type=int, default=1000, help='Expenses and incomes per user.')
+        parser.add_argument('--years', type=int, default=2, help='Spread the transactions over this many years.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data.')
+        parser.add_argument('--prefix', default=PREFIX, help='Username prefix of the synthetic users.')
+        parser.add_argument('--clear', action='store_true', help='Delete the existing synthetic users first.')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            self.stdout.write(f"Deleted {clear_seeded(options['prefix'])} synthetic users.")
+        users = seed_data(options['users'], options['transactions'], options['years'], options['seed'],
+                          options['prefix'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users with {options['transactions']} transactions each."))
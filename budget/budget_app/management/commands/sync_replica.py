@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from budget_app.routers import copy_sqlite_database, replica_alias
+
+
+class Command(BaseCommand):
+    help = ('Copy the SQLite primary database into the SQLite replica, standing in for replication '
+            'in local setups (see budget/settings_replica.py).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Copy again every this many seconds until interrupted; 0 copies once.')
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError('No replica database is configured.')
+        primary, replica = connections[DEFAULT_DB_ALIAS], connections[alias]
+        if primary.vendor != 'sqlite' or replica.vendor != 'sqlite':
+            raise CommandError('Only SQLite stand-ins are copied; real replicas are kept up to date by the database.')
+        replica.close()
+        while True:
+            started = time.perf_counter()
+            copy_sqlite_database(primary.settings_dict['NAME'], replica.settings_dict['NAME'])
+            self.stdout.write(f"Copied {primary.settings_dict['NAME']} to {replica.settings_dict['NAME']} "
+                              f'in {time.perf_counter() - started:.2f} s.')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
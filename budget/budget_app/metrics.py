@@ -0,0 +1,247 @@
+import logging
+import re
+import threading
+import time
+
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+from .caching import cache_stats
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+N_PLUS_ONE_THRESHOLD = 10
+UNMATCHED_ROUTE = '<unmatched>'
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+# Literals and parameter lists that vary between otherwise identical queries.
+SQL_SHAPES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+]
+
+
+def sql_shape(sql):
+    '''
+    Return a query with its literals and parameter lists replaced, so repeats of a query compare equal.
+    '''
+    for pattern, replacement in SQL_SHAPES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class Histogram:
+    '''
+    Cumulative-bucket histogram in the Prometheus sense.
+    '''
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        '''
+        Count one observation.
+        '''
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        '''
+        Return (upper bound, count of observations up to it) pairs, ending with '+Inf'.
+        '''
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield bound, total
+
+
+class QueryRecorder:
+    '''
+    Database execute wrapper counting and timing the queries of one request.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[sql_shape(sql)] += 1
+
+    def repeated(self, threshold):
+        '''
+        Return the (shape, count) pairs of queries run at least threshold times, most repeated first.
+        '''
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+class Metrics:
+    '''
+    Per-route request metrics of this process.
+
+    Each worker process keeps its own; Prometheus adds them up when every worker
+    is scraped, or scrape a single-process deployment.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget everything recorded so far.
+        '''
+        with self._lock:
+            self.requests = Counter()
+            self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+            self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+            self.sql_seconds = Counter()
+            self.n_plus_one = Counter()
+
+    def observe(self, route, method, status, duration, recorder, repeated):
+        '''
+        Record one finished request.
+        '''
+        with self._lock:
+            self.requests[(route, method, str(status))] += 1
+            self.latency[(route, method)].observe(duration)
+            self.queries[(route, method)].observe(recorder.count)
+            self.sql_seconds[(route, method)] += recorder.duration
+            if repeated:
+                self.n_plus_one[(route, method)] += 1
+
+    def render(self):
+        '''
+        Return the metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        def histogram(name, histograms):
+            for (route, method), values in sorted(histograms.items()):
+                route_labels = labels(route, method)
+                for bound, count in values.cumulative():
+                    lines.append(f'{name}_bucket{{{route_labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_sum{{{route_labels}}} {values.sum:.6f}')
+                lines.append(f'{name}_count{{{route_labels}}} {values.count}')
+
+        with self._lock:
+            family('budget_requests_total', 'counter', 'Requests by route, method and status code.')
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append(f'budget_requests_total{{{labels(route, method)},status="{status}"}} {count}')
+            family('budget_request_duration_seconds', 'histogram', 'Time spent in the view and middleware.')
+            histogram('budget_request_duration_seconds', self.latency)
+            family('budget_request_queries', 'histogram', 'SQL queries run per request.')
+            histogram('budget_request_queries', self.queries)
+            family('budget_sql_duration_seconds_total', 'counter', 'Time spent running SQL queries.')
+            for (route, method), seconds in sorted(self.sql_seconds.items()):
+                lines.append(f'budget_sql_duration_seconds_total{{{labels(route, method)}}} {seconds:.6f}')
+            family('budget_n_plus_one_requests_total', 'counter',
+                   'Requests that repeated one query shape at least the N+1 threshold.')
+            for (route, method), count in sorted(self.n_plus_one.items()):
+                lines.append(f'budget_n_plus_one_requests_total{{{labels(route, method)}}} {count}')
+
+        stats = cache_stats()
+        family('budget_cache_hits_total', 'counter', 'Summary cache hits.')
+        lines.append(f"budget_cache_hits_total {stats['hits']}")
+        family('budget_cache_misses_total', 'counter', 'Summary cache misses.')
+        lines.append(f"budget_cache_misses_total {stats['misses']}")
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    '''
+    Escape a Prometheus label value.
+    '''
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def labels(route, method):
+    '''
+    Return the route and method labels of a series.
+    '''
+    return f'route="{escape(route)}",method="{escape(method)}"'
+
+
+metrics = Metrics()
+
+
+def wrap_connections(stack, recorder):
+    '''
+    Install a query recorder on every database connection of this thread until the stack closes.
+    '''
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(recorder))
+
+
+class MetricsMiddleware:
+    '''
+    Record latency, SQL query count and SQL time of every request under its URL route.
+
+    Routes are the patterns from budget/urls.py (e.g. 'api/<str:resource>/'), so the
+    number of series stays bounded. A request running one query shape at least
+    METRICS_N_PLUS_ONE_THRESHOLD times is counted and logged as a likely N+1 pattern.
+    Streamed responses are timed until the response object is returned. Works in
+    both sync and async stacks, so async views under ASGI stay async.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'METRICS_N_PLUS_ONE_THRESHOLD', N_PLUS_ONE_THRESHOLD)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            wrap_connections(stack, recorder)
+            response = self.get_response(request)
+        self.record(request, response, recorder, time.perf_counter() - start)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            # Database connections are thread-local and an async request queries from
+            # its sync thread, so the recorder is installed on that thread's connections.
+            await sync_to_async(wrap_connections)(stack, recorder)
+            response = await self.get_response(request)
+        self.record(request, response, recorder, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, recorder, duration):
+        '''
+        Record a finished request and log its likely N+1 patterns.
+        '''
+        match = request.resolver_match
+        route = match.route if match else UNMATCHED_ROUTE
+        repeated = recorder.repeated(self.threshold)
+        method = request.method if request.method in METHODS else 'OTHER'
+        for shape, count in repeated:
+            logger.warning('Likely N+1 queries in %s %s: %d x %s', method, route or '/', count, shape)
+        metrics.observe(route or '/', method, response.status_code, duration, recorder, repeated)
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.6 on 2026-10-18 05:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def populate_rollups(apps, schema_editor):
+    MonthlyRollup = apps.get_model('budget_app', 'MonthlyRollup')
+    for kind, model_name in (('expense', 'Expense'), ('income', 'Income')):
+        model_class = apps.get_model('budget_app', model_name)
+        rows = model_class.objects.annotate(
+            year=ExtractYear('date'), month=ExtractMonth('date')
+        ).values('user_id', 'year', 'month', 'category_id').annotate(
+            total=Sum('amount'), count=Count('id')
+        ).order_by()
+        MonthlyRollup.objects.bulk_create((MonthlyRollup(kind=kind, **row) for row in rows), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('budget_app', '0007_alter_budget_category'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('kind', models.CharField(max_length=10)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_rollups', to='budget_app.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'year', 'month', 'category', 'kind'), name='unique_monthly_rollup'),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
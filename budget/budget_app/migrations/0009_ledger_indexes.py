@@ -0,0 +1,26 @@
+# Generated by Django 4.2.6 on 2026-10-18 05:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget_app', '0008_monthlyrollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='type',
+            field=models.CharField(db_index=True, default='expense', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', '-date', '-id'], include=('amount', 'category'), name='expense_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='income',
+            index=models.Index(fields=['user', '-date', '-id'], include=('amount', 'category'), name='income_user_date_idx'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.6 on 2026-10-18 05:37
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def populate_content_hashes(apps, schema_editor):
+    for model_name in ('Expense', 'Income'):
+        model_class = apps.get_model('budget_app', model_name)
+        batch = []
+        rows = model_class.objects.values_list('id', 'date', 'amount', 'comment').iterator(chunk_size=2000)
+        for row_id, date, amount, comment in rows:
+            key = f"{date.isoformat()}|{amount:.2f}|{(comment or '').strip()}"
+            batch.append(model_class(id=row_id, content_hash=hashlib.sha1(key.encode('utf-8')).hexdigest()))
+            if len(batch) == 2000:
+                model_class.objects.bulk_update(batch, ['content_hash'])
+                batch = []
+        model_class.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget_app', '0009_ledger_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='expense',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='income',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+        migrations.RunPython(populate_content_hashes, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['user', 'content_hash'], name='expense_user_hash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='income',
+            index=models.Index(fields=['user', 'content_hash'], name='income_user_hash_idx'),
+        ),
+    ]
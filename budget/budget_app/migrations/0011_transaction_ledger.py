@@ -0,0 +1,53 @@
+# Generated by Django 4.2.6 on 2026-10-18 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget_app', '0010_content_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerExpense',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('budget_app.transaction',),
+        ),
+        migrations.CreateModel(
+            name='LedgerIncome',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('budget_app.transaction',),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='comment',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='source_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user', 'type', 'date'], name='ledger_user_type_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(fields=('type', 'source_id'), name='unique_ledger_source'),
+        ),
+    ]
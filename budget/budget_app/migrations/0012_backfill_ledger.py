@@ -0,0 +1,50 @@
+# Generated by Django 4.2.6 on 2026-10-18 06:20
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 5000
+LEDGER_SIGNS = {'Expense': -1, 'Income': 1}
+
+
+def backfill_ledger(apps, schema_editor):
+    '''
+    Copy expenses and incomes into the ledger in id order, one short transaction per batch.
+
+    The migration is not atomic, so each batch commits on its own and no table stays
+    locked for the whole copy; rows that are already mirrored are skipped, so an
+    interrupted run can simply be repeated.
+    '''
+    ledger = apps.get_model('budget_app', 'Transaction')
+    for model_name, sign in LEDGER_SIGNS.items():
+        model_class = apps.get_model('budget_app', model_name)
+        kind = model_name.lower()
+        last_id = 0
+        while True:
+            rows = list(model_class.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', 'user_id', 'category_id', 'amount', 'date', 'comment')[:BATCH_SIZE])
+            if not rows:
+                break
+            with transaction.atomic():
+                ledger.objects.bulk_create([
+                    ledger(type=kind, source_id=row_id, user_id=user_id, category_id=category_id,
+                           amount=sign * amount, date=date, comment=comment)
+                    for row_id, user_id, category_id, amount, date, comment in rows
+                ], ignore_conflicts=True)
+            last_id = rows[-1][0]
+
+
+def clear_ledger(apps, schema_editor):
+    ledger = apps.get_model('budget_app', 'Transaction')
+    ledger.objects.filter(source_id__isnull=False).delete()
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('budget_app', '0011_transaction_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_ledger, clear_ledger),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget_app', '0012_backfill_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='budget',
+            name='period',
+            field=models.CharField(choices=[('month', 'Miesięczny'), ('year', 'Roczny')], default='month', max_length=10),
+        ),
+    ]
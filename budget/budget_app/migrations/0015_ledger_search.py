@@ -0,0 +1,62 @@
+# Generated by Django 4.2.6 on 2026-10-18 06:40
+
+from django.db import migrations
+
+# The index as it was first installed, kept here so later changes to
+# budget_app.search do not alter what this migration does.
+POSTGRES_INSTALL = [
+    "CREATE INDEX IF NOT EXISTS ledger_search_idx ON budget_app_transaction USING gin "
+    "((setweight(to_tsvector('simple', 'u' || user_id), 'D') || to_tsvector('simple', COALESCE(comment, ''))))",
+]
+POSTGRES_UNINSTALL = ['DROP INDEX IF EXISTS ledger_search_idx']
+SQLITE_INSTALL = [
+    "CREATE VIEW IF NOT EXISTS budget_app_transaction_search_source AS "
+    "SELECT id, 'u' || user_id AS owner, comment FROM budget_app_transaction",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS budget_app_transaction_search USING fts5(owner, comment, "
+    "content='budget_app_transaction_search_source', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS budget_app_transaction_search_insert AFTER INSERT ON budget_app_transaction BEGIN "
+    "INSERT INTO budget_app_transaction_search(rowid, owner, comment) "
+    "VALUES (new.id, 'u' || new.user_id, new.comment); END",
+    "CREATE TRIGGER IF NOT EXISTS budget_app_transaction_search_delete AFTER DELETE ON budget_app_transaction BEGIN "
+    "INSERT INTO budget_app_transaction_search(budget_app_transaction_search, rowid, owner, comment) "
+    "VALUES ('delete', old.id, 'u' || old.user_id, old.comment); END",
+    "CREATE TRIGGER IF NOT EXISTS budget_app_transaction_search_update "
+    "AFTER UPDATE OF user_id, comment ON budget_app_transaction BEGIN "
+    "INSERT INTO budget_app_transaction_search(budget_app_transaction_search, rowid, owner, comment) "
+    "VALUES ('delete', old.id, 'u' || old.user_id, old.comment); "
+    "INSERT INTO budget_app_transaction_search(rowid, owner, comment) "
+    "VALUES (new.id, 'u' || new.user_id, new.comment); END",
+    "INSERT INTO budget_app_transaction_search(budget_app_transaction_search) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    'DROP TRIGGER IF EXISTS budget_app_transaction_search_insert',
+    'DROP TRIGGER IF EXISTS budget_app_transaction_search_delete',
+    'DROP TRIGGER IF EXISTS budget_app_transaction_search_update',
+    'DROP TABLE IF EXISTS budget_app_transaction_search',
+    'DROP VIEW IF EXISTS budget_app_transaction_search_source',
+]
+
+
+def run(schema_editor, statements):
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def install(apps, schema_editor):
+    run(schema_editor, {'postgresql': POSTGRES_INSTALL, 'sqlite': SQLITE_UNINSTALL + SQLITE_INSTALL})
+
+
+def uninstall(apps, schema_editor):
+    run(schema_editor, {'postgresql': POSTGRES_UNINSTALL, 'sqlite': SQLITE_UNINSTALL})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget_app', '0014_recurringrule'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
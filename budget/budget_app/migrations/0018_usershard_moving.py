@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget_app', '0017_ledger_user_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usershard',
+            name='moving',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -7,27 +7,117 @@ class Category(models.Model):
     Model representing a category, such as 'Paycheck', 'Transport', etc.
     '''
     name = models.CharField(max_length=100)
-    type = models.CharField(max_length=10, default='expense')
+    type = models.CharField(max_length=10, default='expense', db_index=True)
 
 
 class Transaction(models.Model):
     '''
-    Model representing a transaction.
+    Model representing a transaction of the unified ledger.
+
+    Expenses have negative and incomes positive amounts, type is 'expense' or 'income'.
+    While Expense and Income are still written, every row of theirs is mirrored here
+    and source_id holds its id.
     '''
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField()
     type = models.CharField(max_length=10)
+    comment = models.TextField(blank=True, null=True)
+    source_id = models.BigIntegerField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['type', 'source_id'], name='unique_ledger_source'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'type', 'date'], name='ledger_user_type_date_idx'),
+            models.Index(fields=['user', 'id'], name='ledger_user_id_idx'),
+        ]
+
+    @property
+    def magnitude(self):
+        '''
+        The amount without its sign, as stored in Expense and Income.
+        '''
+        return abs(self.amount)
+
+
+READ_ONLY_LEDGER = 'The ledger is written by mirroring Expense and Income; write those instead.'
+
+
+class ReadOnlyLedgerError(Exception):
+    '''
+    Raised when the ledger is written through LedgerExpense or LedgerIncome.
+    '''
+
+
+class ReadOnlyLedgerQuerySet(models.QuerySet):
+    '''
+    QuerySet of ledger rows that can be read but not written.
+    '''
+    def read_only(self, *args, **kwargs):
+        raise ReadOnlyLedgerError(READ_ONLY_LEDGER)
+
+    update = delete = bulk_create = bulk_update = read_only
+
+
+class LedgerKindManager(models.Manager.from_queryset(ReadOnlyLedgerQuerySet)):
+    '''
+    Manager restricting the ledger to one type of transaction.
+    '''
+    def __init__(self, kind):
+        super().__init__()
+        self.kind = kind
+
+    def get_queryset(self):
+        return super().get_queryset().filter(type=self.kind)
+
+
+class ReadOnlyLedgerMixin:
+    '''
+    Refuse to save or delete ledger rows through a view of the ledger.
+
+    Expense and Income are still the source of truth the ledger and the rollups are
+    built from, so a row written through a view would be lost on the next rebuild.
+    '''
+    def save(self, *args, **kwargs):
+        raise ReadOnlyLedgerError(READ_ONLY_LEDGER)
+
+    def delete(self, *args, **kwargs):
+        raise ReadOnlyLedgerError(READ_ONLY_LEDGER)
+
+
+class LedgerExpense(ReadOnlyLedgerMixin, Transaction):
+    '''
+    Read-only view of the expenses of the unified ledger, with negative amounts.
+    '''
+    objects = LedgerKindManager('expense')
+
+    class Meta:
+        proxy = True
+
+
+class LedgerIncome(ReadOnlyLedgerMixin, Transaction):
+    '''
+    Read-only view of the incomes of the unified ledger.
+    '''
+    objects = LedgerKindManager('income')
+
+    class Meta:
+        proxy = True
 
 
 class Budget(models.Model):
     '''
-    Model representing a budget.
+    Model representing a monthly or yearly spending limit, for one category or (without one) for all expenses.
     '''
+    PERIODS = (('month', 'Miesięczny'), ('year', 'Roczny'))
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
+    period = models.CharField(max_length=10, choices=PERIODS, default='month')
 
 
 class Expense(models.Model):
@@ -39,6 +129,14 @@ class Expense(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField()
     comment = models.TextField(blank=True, null=True)
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-date', '-id'], include=['amount', 'category'],
+                         name='expense_user_date_idx'),
+            models.Index(fields=['user', 'content_hash'], name='expense_user_hash_idx'),
+        ]
 
 
 class Income(models.Model):
@@ -50,3 +148,73 @@ class Income(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     date = models.DateField()
     comment = models.TextField(blank=True, null=True)
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-date', '-id'], include=['amount', 'category'],
+                         name='income_user_date_idx'),
+            models.Index(fields=['user', 'content_hash'], name='income_user_hash_idx'),
+        ]
+
+
+class RecurringRule(models.Model):
+    '''
+    Model representing a repeated expense or income, such as rent or a salary.
+
+    Occurrences fall every interval days, weeks, months or years from start_date up
+    to end_date; monthly and yearly ones keep the day of start_date, moved to the
+    last day of shorter months. occurrences counts those already materialized and
+    next_date is the first one that is not, or None once the rule has ended.
+    '''
+    KINDS = (('expense', 'Wydatek'), ('income', 'Dochód'))
+    FREQUENCIES = (('daily', 'Codziennie'), ('weekly', 'Co tydzień'), ('monthly', 'Co miesiąc'), ('yearly', 'Co rok'))
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='recurring_rules')
+    kind = models.CharField(max_length=10, choices=KINDS, default='expense')
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    comment = models.TextField(blank=True, null=True)
+    frequency = models.CharField(max_length=10, choices=FREQUENCIES, default='monthly')
+    interval = models.PositiveSmallIntegerField(default=1)
+    start_date = models.DateField()
+    end_date = models.DateField(blank=True, null=True)
+    occurrences = models.PositiveIntegerField(default=0)
+    next_date = models.DateField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_date', 'id'], name='recurring_due_idx'),
+        ]
+
+
+class MonthlyRollup(models.Model):
+    '''
+    Model representing the monthly total of a user's expenses or incomes in one category.
+    '''
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='monthly_rollups')
+    kind = models.CharField(max_length=10)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'year', 'month', 'category', 'kind'],
+                                    name='unique_monthly_rollup'),
+        ]
+
+
+class UserShard(models.Model):
+    '''
+    Model recording which database alias of settings.SHARDS holds a user's data.
+
+    It lives in the default database with the users, so it can be read before the
+    user's shard is known. moving is set while the user's data is being moved to
+    another shard.
+    '''
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shard')
+    database = models.CharField(max_length=100)
+    moving = models.BooleanField(default=False)
@@ -0,0 +1,74 @@
+from datetime import date
+
+from django.db.models import Q
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(row):
+    '''
+    Return the cursor pointing just after the given row or values() dict, e.g. '2024-02-28.42'.
+    '''
+    if isinstance(row, dict):
+        return f"{row['date'].isoformat()}.{row['id']}"
+    return f'{row.date.isoformat()}.{row.id}'
+
+
+def decode_cursor(cursor):
+    '''
+    Return the (date, id) pair encoded in a cursor.
+
+    Raises ValueError when the cursor is malformed.
+    '''
+    day, row_id = cursor.split('.')
+    return date.fromisoformat(day), int(row_id)
+
+
+def page_size_from(params, default=PAGE_SIZE):
+    '''
+    Read the requested page size, clamped to 1..MAX_PAGE_SIZE.
+    '''
+    try:
+        return max(1, min(int(params.get('page_size', default)), MAX_PAGE_SIZE))
+    except ValueError:
+        return default
+
+
+def page_query(queryset, cursor, page_size):
+    '''
+    Return the query of the page after a cursor, with one extra row telling whether another page follows.
+
+    Raises ValueError when the cursor is malformed.
+    '''
+    queryset = queryset.order_by('-date', '-id')
+    if cursor:
+        day, row_id = decode_cursor(cursor)
+        queryset = queryset.filter(Q(date__lt=day) | Q(date=day, id__lt=row_id))
+    return queryset[:page_size + 1]
+
+
+def split_page(rows, page_size):
+    '''
+    Return (rows, next_cursor) from the rows read by page_query().
+    '''
+    if len(rows) > page_size:
+        return rows[:page_size], encode_cursor(rows[page_size - 1])
+    return rows, None
+
+
+def keyset_page(queryset, cursor=None, page_size=PAGE_SIZE):
+    '''
+    Return (rows, next_cursor) for one page of a queryset ordered by (-date, -id).
+
+    The page starts after the cursor using a (date, id) comparison, so its cost does not
+    depend on how many rows were skipped. next_cursor is None on the last page.
+    '''
+    return split_page(list(page_query(queryset, cursor, page_size)), page_size)
+
+
+async def akeyset_page(queryset, cursor=None, page_size=PAGE_SIZE):
+    '''
+    Async version of keyset_page().
+    '''
+    return split_page([row async for row in page_query(queryset, cursor, page_size)], page_size)
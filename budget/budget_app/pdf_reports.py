@@ -0,0 +1,349 @@
+import gc
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Sum
+
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import LongTable, Paragraph, SimpleDocTemplate, TableStyle
+
+from .archive import archived_totals
+from .models import MonthlyRollup, Transaction
+from .registry import registry
+from .reports import REPORT_SECTIONS, report_rows
+from .routers import current_replica, route_process_reads
+from .sharding import current_database, route_process_shard
+
+logger = logging.getLogger(__name__)
+
+PAGE_ROWS = 40
+COLUMN_WIDTHS = [70, 130, 70, 250]
+HEADER = ["Date", "Category", "Amount", "Comment"]
+TABLE_STYLE = TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+                          ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+                          ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+                          ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                          ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+                          ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+                          ('GRID', (0, 0), (-1, -1), 1, colors.black)])
+
+
+def page_tables(rows, header=HEADER, col_widths=COLUMN_WIDTHS, page_rows=PAGE_ROWS):
+    '''
+    Yield page-sized LongTables with a repeated header from an iterable of rows.
+    '''
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == page_rows:
+            yield LongTable([header] + chunk, colWidths=col_widths, repeatRows=1, style=TABLE_STYLE)
+            chunk = []
+    if chunk:
+        yield LongTable([header] + chunk, colWidths=col_widths, repeatRows=1, style=TABLE_STYLE)
+
+
+def build_pdf(flowables, path):
+    '''
+    Render flowables into a PDF file.
+    '''
+    SimpleDocTemplate(path, pagesize=letter).build(list(flowables))
+
+
+class PdfConcatenation:
+    '''
+    Single PDF written to a binary file from the pages of PDF files, appended one file at a time.
+
+    PdfWriter.append keeps every page of every file until the document is written;
+    here the objects of a file's pages are renumbered and written out as soon as it
+    is appended, so memory is bounded by the largest file and only the numbers of
+    the pages are kept for the page tree that close() writes at the end.
+    '''
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, output):
+        self.output = output
+        self.start = output.tell()
+        self.offsets = {}
+        self.pages = []
+        self.next_number = self.PAGES + 1
+        output.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def write_object(self, number, value):
+        '''
+        Write one numbered object and remember where it starts.
+        '''
+        self.offsets[number] = self.output.tell() - self.start
+        self.output.write(f'{number} 0 obj\n'.encode('ascii'))
+        value.write_to_stream(self.output)
+        self.output.write(b'\nendobj\n')
+
+    def renumber(self, value, numbers, pending):
+        '''
+        Replace the references inside a value of the file being appended, in place, with numbers of the output.
+
+        numbers maps the (number, generation) of the file's objects to theirs in the
+        output; objects first referred to are numbered and added to pending.
+        '''
+        if isinstance(value, IndirectObject):
+            key = (value.idnum, value.generation)
+            if key not in numbers:
+                numbers[key] = self.next_number
+                self.next_number += 1
+                pending.append(value)
+            return IndirectObject(numbers[key], 0, None)
+        if isinstance(value, DictionaryObject):
+            for name, item in list(value.items()):
+                value[name] = self.renumber(item, numbers, pending)
+        elif isinstance(value, ArrayObject):
+            value[:] = [self.renumber(item, numbers, pending) for item in value]
+        return value
+
+    def append(self, path):
+        '''
+        Write the pages of a PDF file, with everything they refer to, after the pages appended so far.
+        '''
+        reader = PdfReader(path)
+        numbers = {}
+        pending = []
+        pages = list(reader.pages)
+        for page in pages:
+            reference = page.indirect_reference
+            numbers[(reference.idnum, reference.generation)] = self.next_number
+            self.pages.append(self.next_number)
+            self.next_number += 1
+        parent = IndirectObject(self.PAGES, 0, None)
+        for page in pages:
+            # Pages come flattened, with the attributes they inherited from the old page tree.
+            page.pop(NameObject('/Parent'), None)
+            self.renumber(page, numbers, pending)
+            page[NameObject('/Parent')] = parent
+            reference = page.indirect_reference
+            self.write_object(numbers[(reference.idnum, reference.generation)], page)
+            while pending:
+                reference = pending.pop()
+                self.write_object(numbers[(reference.idnum, reference.generation)],
+                                  self.renumber(reference.get_object(), numbers, pending))
+        # The reader and its pages refer to each other; free them before the next file is read.
+        del reader, pages
+        gc.collect()
+
+    def close(self):
+        '''
+        Write the page tree, the catalog, the cross-reference table and the trailer.
+        '''
+        self.write_object(self.PAGES, DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Kids'): ArrayObject(IndirectObject(number, 0, None) for number in self.pages),
+            NameObject('/Count'): NumberObject(len(self.pages)),
+        }))
+        self.write_object(self.CATALOG, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(self.PAGES, 0, None),
+        }))
+        xref = self.output.tell() - self.start
+        entries = ''.join(f'{self.offsets[number]:010d} 00000 n \n' for number in range(1, self.next_number))
+        self.output.write(f'xref\n0 {self.next_number}\n0000000000 65535 f \n{entries}'
+                          f'trailer\n<< /Size {self.next_number} /Root {self.CATALOG} 0 R >>\n'
+                          f'startxref\n{xref}\n%%EOF\n'.encode('ascii'))
+
+
+def category_subtotals(model_class, user_id, filters):
+    '''
+    Return (category name, total, count) rows summed from the ledger, ordered by name.
+    '''
+    kind = model_class.__name__.lower()
+    totals = archived_totals(user_id, kind, filters.get('date__gte'), filters.get('date__lte'),
+                             filters.get('category_id'))
+    rows = Transaction.objects.filter(user_id=user_id, type=kind, **filters).values('category_id').annotate(
+        total=Sum('amount'), count=Count('id')).order_by()
+    for row in rows:
+        total = totals.setdefault(row['category_id'], [0, 0])
+        total[0] += abs(row['total'])
+        total[1] += row['count']
+    categories = registry.snapshot()
+    return sorted((categories.name(category_id), total, count) for category_id, (total, count) in totals.items()
+                  if category_id in categories.by_id)
+
+
+def section_parts(user_id, section, kind, filters, rows_per_part):
+    '''
+    Split one report section into date ranges of roughly rows_per_part rows.
+
+    Ranges never cross a year boundary and are sized using the monthly rollup counts,
+    so planning the report does not scan the ledger table.
+    '''
+    rollups = MonthlyRollup.objects.filter(user_id=user_id, kind=kind, count__gt=0)
+    if 'category_id' in filters:
+        rollups = rollups.filter(category_id=filters['category_id'])
+    months = rollups.values_list('year', 'month').annotate(rows=Sum('count')).order_by('year', 'month')
+
+    parts = []
+    current = None
+    for year, month, rows in months:
+        if current is None or current['year'] != year or current['rows'] >= rows_per_part:
+            current = {'section': section, 'year': year, 'first_month': month, 'rows': 0}
+            parts.append(current)
+        current['last_month'] = month
+        current['rows'] += rows
+    return parts
+
+
+def part_filters(filters, part):
+    '''
+    Return the report filters narrowed to the date range covered by a part.
+    '''
+    year = part['year']
+    start = date(year, part['first_month'], 1)
+    end = date(year, 12, 31) if part['last_month'] == 12 else date(year, part['last_month'] + 1, 1) - timedelta(days=1)
+    return dict(filters, date__gte=max(start, filters.get('date__gte', start)),
+                date__lte=min(end, filters.get('date__lte', end)))
+
+
+def render_part(user_id, filters, part, path):
+    '''
+    Render one date range of a report section into a PDF file and return the seconds it took.
+    '''
+    started = time.perf_counter()
+    model_class = dict(REPORT_SECTIONS)[part['section']]
+    styles = getSampleStyleSheet()
+    rows = report_rows(model_class, user_id, part_filters(filters, part))
+    data = ([day.strftime("%Y-%m-%d"), category_name, amount, comment or '']
+            for day, category_name, amount, comment in rows)
+    title = f"{part['section']} {part['year']}/{part['first_month']:02d}-{part['last_month']:02d}"
+    build_pdf([Paragraph(title, styles['Heading2'])] + list(page_tables(data)), path)
+    return time.perf_counter() - started
+
+
+def render_summary(user_id, filters, path):
+    '''
+    Render the per-section category subtotals into a PDF file and return the seconds it took.
+    '''
+    started = time.perf_counter()
+    styles = getSampleStyleSheet()
+    flowables = [Paragraph('Report', styles['Title'])]
+    for section, model_class in REPORT_SECTIONS:
+        flowables.append(Paragraph(section, styles['Heading1']))
+        subtotals = category_subtotals(model_class, user_id, filters)
+        flowables.extend(page_tables(subtotals, header=["Category", "Total", "Count"], col_widths=[200, 100, 60]))
+    build_pdf(flowables, path)
+    return time.perf_counter() - started
+
+
+def init_worker():
+    '''
+    Make sure Django is configured in report worker processes.
+    '''
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+def render_part_in_worker(user_id, filters, part, path, replica=None, shard=None):
+    '''
+    Render a part in a report worker process, reading from the replica and shard aliases of the request.
+    '''
+    route_process_reads(replica)
+    route_process_shard(shard)
+    return render_part(user_id, filters, part, path)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def worker_pool():
+    '''
+    Return the process pool rendering report parts, started on first use and kept for the life of the process.
+
+    Workers are spawned rather than forked, so they open their own database
+    connections instead of sharing the request's.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=getattr(settings, 'PDF_REPORT_WORKERS', 4),
+                                        mp_context=multiprocessing.get_context('spawn'), initializer=init_worker)
+        return _pool
+
+
+def discard_worker_pool(pool):
+    '''
+    Forget a broken pool, so the next report starts a new one.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_parts(user_id, filters, parts, directory):
+    '''
+    Iterate over the (path, seconds) of the parts of a report, rendered into files in a directory, in order.
+
+    With more than one PDF_REPORT_WORKERS the parts are rendered in worker_pool();
+    only the paths travel back, so the request never holds the rendered parts.
+    '''
+    paths = [os.path.join(directory, f'part-{number}.pdf') for number in range(len(parts))]
+    workers = min(getattr(settings, 'PDF_REPORT_WORKERS', 4), os.cpu_count() or 1)
+    if workers <= 1 or len(parts) <= 1:
+        for part, path in zip(parts, paths):
+            yield path, render_part(user_id, filters, part, path)
+        return
+    pool = worker_pool()
+    try:
+        futures = [pool.submit(render_part_in_worker, user_id, filters, part, path, current_replica(),
+                               current_database()) for part, path in zip(parts, paths)]
+        for future, path in zip(futures, paths):
+            yield path, future.result()
+    except BrokenProcessPool:
+        discard_worker_pool(pool)
+        raise
+
+
+def render_pdf_report(user_id, filters, output):
+    '''
+    Render the full PDF report into the output file object and return section timings.
+
+    Each section is split into parts that are rendered into temporary files, in a
+    process pool, and written to the output in order one file at a time, so no single
+    reportlab document has to lay out the whole ledger and no more than one part is
+    held in memory.
+    '''
+    rows_per_part = getattr(settings, 'PDF_REPORT_ROWS_PER_PART', 5000)
+    parts = []
+    for section in dict(REPORT_SECTIONS):
+        for part in section_parts(user_id, section, section.lower(), filters, rows_per_part):
+            narrowed = part_filters(filters, part)
+            if narrowed['date__gte'] <= narrowed['date__lte']:
+                parts.append(part)
+
+    timings = []
+    document = PdfConcatenation(output)
+    with tempfile.TemporaryDirectory(prefix='pdf-report-') as directory:
+        summary_path = os.path.join(directory, 'summary.pdf')
+        timings.append(('summary', render_summary(user_id, filters, summary_path)))
+        document.append(summary_path)
+        for part, (path, elapsed) in zip(parts, render_parts(user_id, filters, parts, directory)):
+            document.append(path)
+            os.remove(path)
+            timings.append((f"{part['section'].lower()}-{part['year']}-{part['first_month']:02d}", elapsed))
+    document.close()
+    for name, elapsed in timings:
+        logger.info('PDF report section %s rendered in %.3fs', name, elapsed)
+    return timings
@@ -0,0 +1,76 @@
+import time
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .caching import bump_data_version
+from .ledger import mirror_rows
+from .models import Budget, Expense, Income, RecurringRule, UserShard
+from .rollups import kind_of, rebuild_user_rollups
+from .sharding import (BATCH_SIZE, ShardError, assign_shard, move_settle_seconds, purge_user, shard_aliases,
+                       shard_for, sync_reference_rows, upsert_rows, user_copies, using_database)
+
+# The rows copied as they are; the ledger and the rollups are rebuilt from the copies.
+MOVED_MODELS = (Expense, Income, Budget, RecurringRule)
+MIRRORED_MODELS = (Expense, Income)
+
+
+def copy_user_rows(model_class, user_id, source, target, batch_size=BATCH_SIZE):
+    '''
+    Copy a user's rows of one table between databases; returns the number copied.
+
+    Rows are read in id order and written in one short transaction per batch, under
+    new ids, as ids are only unique within a database. Expenses and incomes are
+    mirrored into the target's ledger with their batch.
+    '''
+    fields = [field.attname for field in model_class._meta.concrete_fields if not field.primary_key]
+    rows = model_class.objects.using(source).filter(user_id=user_id).order_by('id')
+    copied = 0
+    last_id = 0
+    while batch := list(rows.filter(id__gt=last_id)[:batch_size]):
+        copies = [model_class(**{field: getattr(row, field) for field in fields}) for row in batch]
+        with transaction.atomic(using=target):
+            model_class.objects.using(target).bulk_create(copies)
+            if model_class in MIRRORED_MODELS:
+                mirror_rows(kind_of(model_class), copies, batch_size=batch_size)
+        copied += len(copies)
+        last_id = batch[-1].id
+    return copied
+
+
+def move_user(user_id, target, batch_size=BATCH_SIZE):
+    '''
+    Move a user's data to another shard; returns the number of rows moved.
+
+    The move is first marked in the UserShard directory, so ShardMiddleware turns
+    away requests that could change the user's data in every process, and the writes
+    admitted before that get move_settle_seconds() to finish. The user's rows are
+    then copied in batches and the ledger and rollups rebuilt on the target while
+    the user stays on the source. Only then does the directory send the user to the
+    target, and the source rows are deleted, again in batches. Other writers, such as
+    materialize_recurring, must not run for the user. A move that fails leaves the
+    user on the source and can simply be repeated.
+    '''
+    if target not in shard_aliases():
+        raise ShardError(f'{target} is not one of the SHARDS.')
+    source = shard_for(user_id)
+    if source == target:
+        return 0
+    user = User.objects.get(id=user_id)
+    assign_shard(user_id, source, moving=True)
+    try:
+        time.sleep(move_settle_seconds())
+        # Rows left behind by an earlier, interrupted move.
+        purge_user(user_id, target, batch_size)
+        sync_reference_rows(target, batch_size)
+        upsert_rows(User, user_copies([user]), target)
+        with using_database(target):
+            moved = sum(copy_user_rows(model_class, user_id, source, target, batch_size)
+                        for model_class in MOVED_MODELS)
+            rebuild_user_rollups(user_id)
+        assign_shard(user_id, target, moving=True)
+        purge_user(user_id, source, batch_size)
+    finally:
+        UserShard.objects.filter(user_id=user_id).update(moving=False)
+    bump_data_version(user_id)
+    return moved
@@ -0,0 +1,164 @@
+from calendar import monthrange
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.db import router, transaction
+
+from .caching import bump_data_version
+from .importers import transaction_hash
+from .ledger import SOURCE_MODELS, mirror_rows
+from .models import RecurringRule
+from .rollups import apply_user_deltas
+from .sharding import databases, using_database
+
+BATCH_SIZE = 2000
+REQUEST_LIMIT = 100
+
+
+def add_months(day, months):
+    '''
+    Return the day months after the given one, moved to the last day of shorter months.
+    '''
+    year, month = divmod(day.month - 1 + months, 12)
+    year += day.year
+    return date(year, month + 1, min(day.day, monthrange(year, month + 1)[1]))
+
+
+def occurrence(rule, number):
+    '''
+    Return the date of the occurrence with the given zero-based number of a rule.
+
+    Every date is computed from start_date, so the 31st of a month comes back after
+    a shorter month instead of drifting to the 28th.
+    '''
+    steps = number * rule.interval
+    if rule.frequency == 'daily':
+        return rule.start_date + timedelta(days=steps)
+    if rule.frequency == 'weekly':
+        return rule.start_date + timedelta(weeks=steps)
+    if rule.frequency == 'yearly':
+        steps *= 12
+    return add_months(rule.start_date, steps)
+
+
+def next_occurrence(rule):
+    '''
+    Return the first occurrence of a rule that is not materialized yet, or None if the rule has ended.
+    '''
+    day = occurrence(rule, rule.occurrences)
+    if rule.end_date is not None and day > rule.end_date:
+        return None
+    return day
+
+
+def schedule(rule):
+    '''
+    Set next_date of a new or changed rule; call it before saving.
+    '''
+    rule.next_date = next_occurrence(rule)
+    return rule
+
+
+def take_due_dates(rule, until, limit):
+    '''
+    Advance a rule over at most limit occurrences due on or before until and return their dates.
+    '''
+    days = []
+    while len(days) < limit and rule.next_date is not None and rule.next_date <= until:
+        days.append(rule.next_date)
+        rule.occurrences += 1
+        rule.next_date = next_occurrence(rule)
+    return days
+
+
+def insert_occurrences(rules, occurrences, batch_size=BATCH_SIZE):
+    '''
+    Create the expenses and incomes of (rule, date) pairs and save the rules' progress.
+
+    Rows are written with bulk_create, so the ledger, rollups and cached data versions
+    are updated here rather than by signals.
+    '''
+    rows = defaultdict(list)
+    deltas = defaultdict(lambda: defaultdict(lambda: [0, 0]))
+    for rule, day in occurrences:
+        rows[rule.kind].append(SOURCE_MODELS[rule.kind](
+            user_id=rule.user_id, category_id=rule.category_id, amount=rule.amount, date=day, comment=rule.comment,
+            content_hash=transaction_hash(day, rule.amount, rule.comment)))
+        delta = deltas[rule.kind][(rule.user_id, rule.category_id, day.year, day.month)]
+        delta[0] += rule.amount
+        delta[1] += 1
+    for kind, kind_rows in rows.items():
+        SOURCE_MODELS[kind].objects.bulk_create(kind_rows, batch_size=batch_size)
+        mirror_rows(kind, kind_rows, batch_size=batch_size)
+        apply_user_deltas(kind, deltas[kind])
+    RecurringRule.objects.bulk_update(rules, ['occurrences', 'next_date'], batch_size=batch_size)
+    for user_id in {rule.user_id for rule, _ in occurrences}:
+        bump_data_version(user_id)
+
+
+def materialize_due(until=None, batch_size=BATCH_SIZE, user_ids=None):
+    '''
+    Create every occurrence of the recurring rules due on or before until (default: today).
+
+    Rules are read in id order, at most batch_size per transaction, and each transaction
+    creates at most batch_size rows and advances the rules' next_date with them, so a
+    rerun or a concurrent run never creates an occurrence twice and memory use does not
+    depend on the number of rules or how far back they start. A rule with more due
+    occurrences than fit in one batch is continued in the next one. Returns the number
+    of rows created. Each shard is worked through in turn.
+    '''
+    until = until or date.today()
+    created = 0
+    for alias in databases(user_ids):
+        with using_database(alias):
+            created += materialize_database(until, batch_size, user_ids)
+    return created
+
+
+def materialize_rule(rule, limit=REQUEST_LIMIT, until=None):
+    '''
+    Create at most limit of the due occurrences of one saved rule and return how many were created.
+
+    Occurrences beyond the limit are left to materialize_due(), so a rule that starts
+    far back costs a bounded amount of work in the request that adds it.
+    '''
+    until = until or date.today()
+    with transaction.atomic(using=router.db_for_write(RecurringRule)):
+        rule = RecurringRule.objects.select_for_update().filter(id=rule.id).first()
+        if rule is None:
+            return 0
+        days = take_due_dates(rule, until, limit)
+        if days:
+            insert_occurrences([rule], [(rule, day) for day in days])
+    return len(days)
+
+
+def materialize_database(until, batch_size, user_ids):
+    '''
+    materialize_due() for the database sharded queries currently go to.
+    '''
+    due = RecurringRule.objects.filter(next_date__lte=until)
+    if user_ids:
+        due = due.filter(user_id__in=user_ids)
+    created = 0
+    last_id = 0
+    while True:
+        with transaction.atomic(using=router.db_for_write(RecurringRule)):
+            rules = list(due.select_for_update(skip_locked=True).filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not rules:
+                break
+            advanced = []
+            occurrences = []
+            for rule in rules:
+                days = take_due_dates(rule, until, batch_size - len(occurrences))
+                if not days:
+                    break
+                advanced.append(rule)
+                occurrences.extend((rule, day) for day in days)
+                if rule.next_date is not None and rule.next_date <= until:
+                    # Out of room in this batch; the rule is read again by the next one.
+                    break
+                last_id = rule.id
+            insert_occurrences(advanced, occurrences, batch_size)
+        created += len(occurrences)
+    return created
@@ -0,0 +1,78 @@
+import threading
+
+from .caching import CATEGORIES_VERSION_KEY, current_versions
+from .models import Category
+
+
+class CategoryRegistry:
+    '''
+    In-process copy of all categories, reloaded when the shared categories version changes.
+
+    The version lives in the cache and is bumped by every category change (see
+    signals.py), so with a shared cache backend all workers notice a change on
+    their next lookup. Call snapshot() once per request or export and look
+    categories up in the returned object; it does not change under the caller.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def snapshot(self):
+        '''
+        Return the categories as of the current version, loading them if they changed.
+        '''
+        version = current_versions(CATEGORIES_VERSION_KEY)[0]
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.version != version:
+                    # The version is read before the rows, so a concurrent change is never missed.
+                    snapshot = self._snapshot = CategorySnapshot(version, Category.objects.order_by('id'))
+        return snapshot
+
+
+class CategorySnapshot:
+    '''
+    Immutable id -> category and type -> categories lookups.
+    '''
+    def __init__(self, version, categories):
+        self.version = version
+        self.by_id = {category.id: category for category in categories}
+        self.by_type = {}
+        for category in self.by_id.values():
+            self.by_type.setdefault(category.type, []).append(category)
+
+    def get(self, category_id):
+        '''
+        Return the category with the given id, or None.
+        '''
+        return self.by_id.get(category_id)
+
+    def name(self, category_id):
+        '''
+        Return the name of the category with the given id, or '' if it does not exist.
+        '''
+        category = self.by_id.get(category_id)
+        return category.name if category else ''
+
+    def of_type(self, category_type):
+        '''
+        Return the categories of a type, ordered by id.
+        '''
+        return self.by_type.get(category_type, [])
+
+    def attach(self, rows):
+        '''
+        Set row.category from the registry for expenses or incomes, so templates need no queries.
+
+        Rows whose category is missing from the snapshot keep loading it lazily.
+        '''
+        for row in rows:
+            category = self.by_id.get(row.category_id)
+            if category is not None:
+                row.category = category
+        return rows
+
+
+registry = CategoryRegistry()
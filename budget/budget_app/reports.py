@@ -0,0 +1,76 @@
+import csv
+import zlib
+
+from datetime import datetime
+
+from .ledger import ledger_rows
+from .models import Expense, Income
+
+REPORT_SECTIONS = (('Income', Income), ('Expense', Expense))
+CHUNK_SIZE = 2000
+FLUSH_SIZE = 64 * 1024
+
+
+class Echo:
+    '''
+    Pseudo-buffer whose write() returns the value, so csv.writer produces strings.
+    '''
+    def write(self, value):
+        return value
+
+
+def parse_report_filters(params):
+    '''
+    Read the optional start-date, end-date and category report filters.
+
+    Raises ValueError when a date or category id is malformed.
+    '''
+    filters = {}
+    start_date_str = params.get('start-date')
+    end_date_str = params.get('end-date')
+    category_id = params.get('category')
+    if start_date_str:
+        filters['date__gte'] = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+    if end_date_str:
+        filters['date__lte'] = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+    if category_id:
+        filters['category_id'] = int(category_id)
+    return filters
+
+
+def report_rows(model_class, user, filters, chunk_size=CHUNK_SIZE):
+    '''
+    Iterate over the (date, category name, amount, comment) tuples of one section in server-side chunks.
+    '''
+    rows = ledger_rows(user, filters, model_class.__name__.lower(), chunk_size)
+    return ((day, category_name, amount, comment) for kind, day, category_name, amount, comment in rows)
+
+
+def csv_lines(user, filters, chunk_size=CHUNK_SIZE):
+    '''
+    Yield the CSV report as text blocks of roughly FLUSH_SIZE characters.
+    '''
+    writer = csv.writer(Echo())
+    buffer = [writer.writerow(["Section", "Date", "Category", "Amount", "Comment"])]
+    size = len(buffer[0])
+    for kind, date, category_name, amount, comment in ledger_rows(user, filters, chunk_size=chunk_size):
+        line = writer.writerow([kind.capitalize(), date.strftime("%Y-%m-%d"), category_name, amount, comment])
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_SIZE:
+            yield ''.join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def gzip_stream(blocks, level=6):
+    '''
+    Compress an iterable of text blocks into a gzip byte stream.
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for block in blocks:
+        data = compressor.compress(block.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
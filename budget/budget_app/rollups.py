@@ -0,0 +1,111 @@
+from datetime import date
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+from .archive import archived_rollups
+from .models import Category, Expense, Income, MonthlyRollup
+
+ROLLUP_MODELS = {'expense': Expense, 'income': Income}
+
+
+def kind_of(model_class):
+    '''
+    Return the rollup kind ('expense' or 'income') of a ledger model.
+    '''
+    return model_class.__name__.lower()
+
+
+def apply_delta(user_id, category_id, kind, date, amount, count):
+    '''
+    Add amount and count to the rollup row of the month containing date.
+    '''
+    rows = MonthlyRollup.objects.filter(user_id=user_id, year=date.year, month=date.month,
+                                        category_id=category_id, kind=kind)
+    if rows.update(total=F('total') + amount, count=F('count') + count) or count <= 0:
+        return
+    try:
+        with transaction.atomic(using=router.db_for_write(MonthlyRollup)):
+            MonthlyRollup.objects.create(user_id=user_id, year=date.year, month=date.month,
+                                         category_id=category_id, kind=kind, total=amount, count=count)
+    except IntegrityError:
+        rows.update(total=F('total') + amount, count=F('count') + count)
+
+
+def apply_deltas(user_id, kind, deltas):
+    '''
+    Apply {(category_id, year, month): (amount, count)} to a user's rollups in bulk.
+    '''
+    apply_user_deltas(kind, {(user_id, *key): delta for key, delta in deltas.items()})
+
+
+def apply_user_deltas(kind, deltas):
+    '''
+    Apply {(user_id, category_id, year, month): (amount, count)} to the rollups of any users in bulk.
+
+    The affected rows are locked, merged with the deltas in Python and replaced with
+    one delete and one bulk_create. If another writer creates one of the missing rows
+    concurrently, the deltas are applied row by row instead.
+    '''
+    if not deltas:
+        return
+    try:
+        with transaction.atomic(using=router.db_for_write(MonthlyRollup)):
+            rows = MonthlyRollup.objects.select_for_update().filter(
+                kind=kind, user_id__in={key[0] for key in deltas}, category_id__in={key[1] for key in deltas},
+                year__in={key[2] for key in deltas}, month__in={key[3] for key in deltas})
+            merged = {key: list(delta) for key, delta in deltas.items()}
+            replaced = []
+            for row in rows:
+                key = (row.user_id, row.category_id, row.year, row.month)
+                if key in merged:
+                    merged[key][0] += row.total
+                    merged[key][1] += row.count
+                    replaced.append(row.id)
+            MonthlyRollup.objects.filter(id__in=replaced).delete()
+            MonthlyRollup.objects.bulk_create([
+                MonthlyRollup(user_id=user_id, kind=kind, category_id=category_id, year=year, month=month,
+                              total=total, count=count)
+                for (user_id, category_id, year, month), (total, count) in merged.items() if count > 0
+            ], batch_size=1000)
+    except IntegrityError:
+        for (user_id, category_id, year, month), (amount, count) in deltas.items():
+            apply_delta(user_id, category_id, kind, date(year, month, 1), amount, count)
+
+
+def grouped_rollups(model_class, **filters):
+    '''
+    Return rollup rows computed from the raw ledger table with one grouped query.
+    '''
+    return model_class.objects.filter(**filters).annotate(
+        year=ExtractYear('date'), month=ExtractMonth('date')
+    ).values('user_id', 'year', 'month', 'category_id').annotate(
+        total=Sum('amount'), count=Count('id')
+    ).order_by()
+
+
+def rebuild_user_rollups(user_id, batch_size=1000):
+    '''
+    Recompute all rollup rows of one user from the raw ledger tables and the user's archive.
+
+    Run it inside using_shard_of(user_id) when users are sharded.
+    '''
+    with transaction.atomic(using=router.db_for_write(MonthlyRollup)):
+        MonthlyRollup.objects.filter(user_id=user_id).delete()
+        totals = archived_rollups(user_id)
+        if totals:
+            existing = set(Category.objects.filter(id__in={key[1] for key in totals}).values_list('id', flat=True))
+            totals = {key: total for key, total in totals.items() if key[1] in existing}
+        for kind, model_class in ROLLUP_MODELS.items():
+            for row in grouped_rollups(model_class, user_id=user_id):
+                total = totals.setdefault((kind, row['category_id'], row['year'], row['month']), [0, 0])
+                total[0] += row['total']
+                total[1] += row['count']
+        rollups = [
+            MonthlyRollup(user_id=user_id, kind=kind, category_id=category_id, year=year, month=month, total=total,
+                          count=count)
+            for (kind, category_id, year, month), (total, count) in totals.items()
+        ]
+        MonthlyRollup.objects.bulk_create(rollups, batch_size=batch_size)
+    return len(rollups)
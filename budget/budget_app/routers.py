@@ -0,0 +1,334 @@
+import math
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial, wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.http import FileResponse
+
+REPLICA_DATABASE = 'replica'
+PIN_SECONDS = 10
+MAX_LAG_SECONDS = 10
+LAG_CHECK_SECONDS = 5
+# The category registry caches what it reads under the categories version, so it must
+# never load a replica's older copy of the categories; a stale shard directory would
+# send a moved user's requests to their old shard.
+PRIMARY_MODELS = {'budget_app.category', 'budget_app.usershard'}
+STATUS_TABLE = 'replication_status'
+
+POSTGRES_LAG = ('SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() '
+                'THEN 0 ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+SQLITE_LAG = f'SELECT MAX(synced_at) FROM {STATUS_TABLE}'
+SQLITE_STAMP = [
+    f'CREATE TABLE IF NOT EXISTS {STATUS_TABLE} (synced_at REAL NOT NULL)',
+    f'DELETE FROM {STATUS_TABLE}',
+    f'INSERT INTO {STATUS_TABLE} (synced_at) VALUES (?)',
+]
+
+# Alias of the replica the reads of the running read-only view go to, if any.
+_replica = ContextVar('replica_database', default=None)
+
+
+def replica_alias():
+    '''
+    Return the alias of the replica database, or None if none is configured.
+    '''
+    alias = getattr(settings, 'REPLICA_DATABASE', REPLICA_DATABASE)
+    return alias if alias in settings.DATABASES else None
+
+
+def pin_window():
+    '''
+    Return how many seconds a user's reads stay on the primary after a write.
+
+    Never shorter than the lag the replica is allowed, so a user reading from the
+    replica again always finds their own writes there.
+    '''
+    return max(getattr(settings, 'REPLICA_PIN_SECONDS', PIN_SECONDS),
+               getattr(settings, 'REPLICA_MAX_LAG_SECONDS', MAX_LAG_SECONDS))
+
+
+def pin_key(user_id):
+    '''
+    Return the cache key present while a user's reads are pinned to the primary.
+    '''
+    return f'replica-pin:user:{user_id}'
+
+
+def _pin(user_id):
+    '''
+    Start or restart a user's pin window.
+    '''
+    cache.set(pin_key(user_id), True, pin_window())
+
+
+def pin_to_primary(user_id):
+    '''
+    Send a user's reads to the primary for the pin window, starting now and again once the current
+    transaction commits, which is when the replica starts receiving the write.
+    '''
+    if replica_alias() is None:
+        return
+    _pin(user_id)
+    transaction.on_commit(partial(_pin, user_id))
+
+
+def is_pinned(user_id):
+    '''
+    Return True while a user's recent write may not have reached the replica.
+    '''
+    return cache.get(pin_key(user_id)) is not None
+
+
+def measure_lag(connection):
+    '''
+    Return how many seconds a replica is behind its primary.
+
+    PostgreSQL standbys report the age of the last replayed transaction, or 0 when
+    everything received is replayed. The SQLite stand-in is as old as its last copy
+    made by the sync_replica command. Other databases are assumed to be current.
+    '''
+    if connection.vendor == 'postgresql':
+        sql = POSTGRES_LAG
+    elif connection.vendor == 'sqlite':
+        sql = SQLITE_LAG
+    else:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        value = cursor.fetchone()[0]
+    if value is None:
+        return math.inf
+    return float(value) if connection.vendor == 'postgresql' else max(0, time.time() - value)
+
+
+def copy_sqlite_database(source_path, target_path):
+    '''
+    Copy an SQLite primary into its stand-in replica and record when; returns that time.
+
+    The copy is made with SQLite's online backup, so the primary stays usable meanwhile.
+    The time is taken before copying, so the replica never looks fresher than it is.
+    '''
+    synced_at = time.time()
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+        for statement in SQLITE_STAMP:
+            target.execute(statement, (synced_at,) if '?' in statement else ())
+        target.commit()
+    finally:
+        source.close()
+        target.close()
+    return synced_at
+
+
+class ReplicaMonitor:
+    '''
+    Per-process view of the replica's lag, measured at most every LAG_CHECK_SECONDS.
+
+    An unreachable replica counts as infinitely behind, so reads fall back to the
+    primary until it answers again.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget the last measurement.
+        '''
+        with self._lock:
+            self._lag = None
+            self._checked_at = -math.inf
+
+    def lag(self, alias):
+        '''
+        Return the replica's lag in seconds as last measured.
+        '''
+        now = time.monotonic()
+        if now - self._checked_at >= getattr(settings, 'REPLICA_LAG_CHECK_SECONDS', LAG_CHECK_SECONDS):
+            with self._lock:
+                if now - self._checked_at >= getattr(settings, 'REPLICA_LAG_CHECK_SECONDS', LAG_CHECK_SECONDS):
+                    try:
+                        self._lag = measure_lag(connections[alias])
+                    except DatabaseError:
+                        self._lag = math.inf
+                    self._checked_at = now
+        return self._lag
+
+    def healthy(self, alias):
+        '''
+        Return True if the replica is within REPLICA_MAX_LAG_SECONDS of the primary.
+        '''
+        return self.lag(alias) <= getattr(settings, 'REPLICA_MAX_LAG_SECONDS', MAX_LAG_SECONDS)
+
+
+monitor = ReplicaMonitor()
+
+
+def is_primary(alias):
+    '''
+    Return True if an alias connects to the primary database itself, as a test mirror does.
+    '''
+    replica, primary = connections[alias].settings_dict, connections[DEFAULT_DB_ALIAS].settings_dict
+    return all(replica.get(key) == primary.get(key) for key in ('ENGINE', 'NAME', 'HOST', 'PORT'))
+
+
+def choose_database(user_id):
+    '''
+    Return the replica alias if a user's reads may go to the replica now, else None.
+    '''
+    alias = replica_alias()
+    if alias is None or is_primary(alias) or is_pinned(user_id) or not monitor.healthy(alias):
+        return None
+    return alias
+
+
+class ReplicaRouter:
+    '''
+    Send the reads of views marked with read_from_replica to the replica database.
+
+    Everything else, all writes and the reads of a user who wrote within the pin
+    window go to the primary, as do all reads while the replica lags. Without a
+    replica in DATABASES the router does nothing.
+    '''
+    def db_for_read(self, model, **hints):
+        '''
+        Return the replica chosen for the running view, if any.
+        '''
+        alias = _replica.get()
+        if alias is None or model._meta.label_lower in PRIMARY_MODELS:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        '''
+        Write everything to the primary, also objects read from the replica.
+        '''
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        '''
+        Allow relations between objects of the primary and the replica, which hold the same rows.
+        '''
+        databases = {DEFAULT_DB_ALIAS, replica_alias()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        '''
+        Never migrate the replica, which receives its schema from the primary.
+        '''
+        if db == replica_alias():
+            return False
+        return None
+
+
+@contextmanager
+def replica_reads(alias):
+    '''
+    Send the reads of the enclosed block to the given replica alias (None: the primary).
+    '''
+    token = _replica.set(alias)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def current_replica():
+    '''
+    Return the replica alias reads currently go to, or None.
+    '''
+    return _replica.get()
+
+
+def route_process_reads(alias):
+    '''
+    Send the reads of the whole current process to a replica alias, e.g. in a report worker process.
+    '''
+    _replica.set(alias)
+
+
+def stream_within(iterator, context):
+    '''
+    Produce the items of a response stream, which are read after the view returns, each inside context().
+    '''
+    iterator = iter(iterator)
+    while True:
+        with context():
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+async def astream_within(iterator, context):
+    '''
+    Async version of stream_within().
+    '''
+    iterator = aiter(iterator)
+    while True:
+        with context():
+            try:
+                item = await anext(iterator)
+            except StopAsyncIteration:
+                return
+        yield item
+
+
+def keep_context(response, context):
+    '''
+    Produce a streamed response inside the context (e.g. the database routing) its view ran in.
+    '''
+    # A FileResponse is complete already; reading it needs no database.
+    if response.streaming and not isinstance(response, FileResponse):
+        if response.is_async:
+            response.streaming_content = astream_within(response.streaming_content, context)
+        else:
+            response.streaming_content = stream_within(response.streaming_content, context)
+    return response
+
+
+def keep_replica_reads(response, alias):
+    '''
+    Keep routing reads to the replica while a streamed response is produced.
+    '''
+    if alias is None:
+        return response
+    return keep_context(response, partial(replica_reads, alias))
+
+
+def read_from_replica(view):
+    '''
+    Let a read-only view, sync or async, read from the replica; apply it inside login_required.
+
+    The database is chosen once per request, so a response never mixes data from the
+    primary and the replica.
+    '''
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            alias = await sync_to_async(choose_database)(request.user.id)
+            with replica_reads(alias):
+                response = await view(request, *args, **kwargs)
+            return keep_replica_reads(response, alias)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        alias = choose_database(request.user.id)
+        with replica_reads(alias):
+            response = view(request, *args, **kwargs)
+        return keep_replica_reads(response, alias)
+    return wrapper
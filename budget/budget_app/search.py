@@ -0,0 +1,148 @@
+import re
+
+from django.db import connections
+
+from .models import Transaction
+from .registry import registry
+
+MAX_TERMS = 8
+CATEGORY_SCORE = 1.0
+SEARCH_TABLE = 'budget_app_transaction_search'
+LEDGER_TABLE = Transaction._meta.db_table
+
+# The document of a ledger row is an owner token ('u' and the user id) followed by
+# its comment. Putting the owner into the index lets the full-text engine intersect
+# a user's rows with the query terms, so a common word costs only that user's matches.
+# Owner tokens get weight D, which ts_rank ignores ('{0, ...}').
+POSTGRES_DOCUMENT = ("(setweight(to_tsvector('simple', 'u' || {table}user_id), 'D') || "
+                     "to_tsvector('simple', COALESCE({table}comment, '')))")
+POSTGRES_INSTALL = [
+    f"CREATE INDEX IF NOT EXISTS ledger_search_idx ON {LEDGER_TABLE} USING gin "
+    f"({POSTGRES_DOCUMENT.format(table='')})",
+]
+POSTGRES_UNINSTALL = ['DROP INDEX IF EXISTS ledger_search_idx']
+POSTGRES_MATCHES = (f"SELECT id, ts_rank('{{0, 0.2, 0.4, 1}}', {POSTGRES_DOCUMENT.format(table='')}, "
+                    f"to_tsquery('simple', %s)) AS score FROM {LEDGER_TABLE} "
+                    f"WHERE {POSTGRES_DOCUMENT.format(table='')} @@ to_tsquery('simple', %s)")
+
+# SQLite keeps an FTS5 index over a view of the ledger, maintained by triggers, so
+# bulk_create, queryset updates and raw deletes are indexed too. Django rebuilds a
+# table when a migration alters it on SQLite, which drops its triggers; run
+# rebuild_search_index after such a migration.
+SQLITE_INSTALL = [
+    f"CREATE VIEW IF NOT EXISTS {SEARCH_TABLE}_source AS "
+    f"SELECT id, 'u' || user_id AS owner, comment FROM {LEDGER_TABLE}",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(owner, comment, "
+    f"content='{SEARCH_TABLE}_source', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON {LEDGER_TABLE} BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, owner, comment) VALUES (new.id, 'u' || new.user_id, new.comment); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON {LEDGER_TABLE} BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, owner, comment) "
+    f"VALUES ('delete', old.id, 'u' || old.user_id, old.comment); END",
+    f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF user_id, comment ON {LEDGER_TABLE} BEGIN "
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, owner, comment) "
+    f"VALUES ('delete', old.id, 'u' || old.user_id, old.comment); "
+    f"INSERT INTO {SEARCH_TABLE}(rowid, owner, comment) VALUES (new.id, 'u' || new.user_id, new.comment); END",
+    f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')",
+]
+SQLITE_UNINSTALL = [
+    f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {SEARCH_TABLE}_update',
+    f'DROP TABLE IF EXISTS {SEARCH_TABLE}',
+    f'DROP VIEW IF EXISTS {SEARCH_TABLE}_source',
+]
+SQLITE_MATCHES = (f"SELECT rowid AS id, -bm25({SEARCH_TABLE}, 0, 1) AS score FROM {SEARCH_TABLE} "
+                  f"WHERE {SEARCH_TABLE} MATCH %s")
+
+
+def install_search_index(connection):
+    '''
+    Create the full-text index of the ledger, or recreate and refill it on SQLite.
+
+    Other databases are left without one and fall back to scanning comments.
+    '''
+    statements = {'postgresql': POSTGRES_INSTALL, 'sqlite': SQLITE_UNINSTALL + SQLITE_INSTALL}
+    with connection.cursor() as cursor:
+        for statement in statements.get(connection.vendor, []):
+            cursor.execute(statement)
+
+
+def uninstall_search_index(connection):
+    '''
+    Drop the full-text index of the ledger.
+    '''
+    statements = {'postgresql': POSTGRES_UNINSTALL, 'sqlite': SQLITE_UNINSTALL}
+    with connection.cursor() as cursor:
+        for statement in statements.get(connection.vendor, []):
+            cursor.execute(statement)
+
+
+def search_terms(text):
+    '''
+    Return the lower-cased words of a search text, at most MAX_TERMS of them.
+
+    Only letters, digits and underscores are kept, so the terms can be put into
+    full-text query syntax without escaping.
+    '''
+    return re.findall(r'\w+', text.lower())[:MAX_TERMS]
+
+
+def comment_matches(vendor, user_id, terms):
+    '''
+    Return the SQL and parameters of the (id, score) rows of a user whose comments contain all terms.
+
+    The last term also matches as a prefix, so results follow the text as it is typed.
+    '''
+    if vendor == 'postgresql':
+        query = ' & '.join([f'u{user_id}', *terms[:-1], f'{terms[-1]}:*'])
+        return POSTGRES_MATCHES, [query, query]
+    if vendor == 'sqlite':
+        query = ' AND '.join([f'owner : u{user_id}', *(f'"{term}"' for term in terms[:-1]), f'"{terms[-1]}" *'])
+        return SQLITE_MATCHES, [query]
+    conditions = ' AND '.join(['UPPER(comment) LIKE UPPER(%s)'] * len(terms))
+    return (f'SELECT id, 1.0 AS score FROM {LEDGER_TABLE} WHERE user_id = %s AND {conditions}',
+            [user_id, *(f'%{term}%' for term in terms)])
+
+
+def search_transactions(user, text, page=1, page_size=20, kind=None):
+    '''
+    Return (results, has_next) for one page of a user's transactions matching a search text.
+
+    A transaction matches when its comment contains all words of the text (through the
+    full-text index) or its category name does (looked up in the category registry).
+    Results are dicts with the transaction's id, kind, date, category name, unsigned
+    amount, comment and score, best matches first, then the newest.
+    '''
+    terms = search_terms(text)
+    if not terms:
+        return [], False
+    user_id = getattr(user, 'id', user)
+    categories = registry.snapshot()
+    category_ids = [category.id for category in categories.by_id.values()
+                    if all(term in category.name.lower() for term in terms)]
+
+    vendor = connections[Transaction.objects.db].vendor
+    sql, params = comment_matches(vendor, user_id, terms)
+    if category_ids:
+        sql += (f' UNION ALL SELECT id, {CATEGORY_SCORE} FROM {LEDGER_TABLE} WHERE user_id = %s AND category_id IN '
+                f"({', '.join(['%s'] * len(category_ids))})")
+        params += [user_id, *category_ids]
+    where = ''
+    if kind:
+        where = 'WHERE t.type = %s'
+        params.append(kind)
+    # SQLite can only evaluate bm25() in the query running the MATCH, so the matches
+    # must not be flattened into the outer query.
+    materialized = 'MATERIALIZED ' if vendor == 'sqlite' else ''
+    rows = list(Transaction.objects.raw(
+        f'WITH m AS {materialized}({sql}) '
+        f'SELECT t.id, t.user_id, t.type, t.date, t.category_id, t.amount, t.comment, SUM(m.score) AS score '
+        f'FROM m JOIN {LEDGER_TABLE} t ON t.id = m.id {where} '
+        f'GROUP BY t.id, t.user_id, t.type, t.date, t.category_id, t.amount, t.comment '
+        f'ORDER BY score DESC, t.date DESC, t.id DESC LIMIT %s OFFSET %s',
+        params + [page_size + 1, (page - 1) * page_size]))
+    results = [{'id': row.id, 'kind': row.type, 'date': row.date, 'category_name': categories.name(row.category_id),
+                'amount': row.magnitude, 'comment': row.comment, 'score': round(float(row.score), 4)}
+               for row in rows[:page_size]]
+    return results, len(rows) > page_size
@@ -0,0 +1,385 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial, wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, router
+from django.http import HttpResponse
+
+from .models import Budget, Category, Expense, Income, MonthlyRollup, RecurringRule, Transaction, UserShard
+from .routers import keep_context
+
+# A user's expenses, incomes and budgets live on the user's shard, together with
+# everything derived from them or creating them: the ledger, the rollups and the
+# recurring rules.
+SHARDED = (Transaction, MonthlyRollup, Budget, RecurringRule, Expense, Income)
+SHARDED_MODELS = {model_class._meta.label_lower for model_class in SHARDED}
+SHARD_CACHE_SECONDS = 300
+# How long a move waits after turning away writes, for the ones already admitted to finish.
+MOVE_SETTLE_SECONDS = 10
+BATCH_SIZE = 1000
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS', 'TRACE'}
+MOVING_MESSAGE = 'Trwa przenoszenie Twoich danych. Spróbuj ponownie za chwilę.'
+
+# Alias of the database the sharded queries of the running request or job go to.
+_shard = ContextVar('shard_database', default=None)
+
+
+class ShardError(Exception):
+    '''
+    Raised when a sharded table is queried without knowing whose shard to use.
+    '''
+
+
+def shard_aliases():
+    '''
+    Return the database aliases users are sharded across, or [] when sharding is off.
+    '''
+    return list(getattr(settings, 'SHARDS', []))
+
+
+def databases(user_ids=None):
+    '''
+    Return the aliases holding the sharded rows of the given users, or of everybody.
+
+    Without sharding that is the default database alone.
+    '''
+    if user_ids:
+        return sorted({shard_for(user_id) for user_id in user_ids})
+    return shard_aliases() or [DEFAULT_DB_ALIAS]
+
+
+def shard_key(user_id):
+    '''
+    Return the cache key holding the alias of a user's shard.
+    '''
+    return f'shard:user:{user_id}'
+
+
+def placement(user_id):
+    '''
+    Return the shard a user without a directory entry belongs on.
+    '''
+    aliases = shard_aliases()
+    return aliases[user_id % len(aliases)]
+
+
+def shard_for(user_id):
+    '''
+    Return the alias of the database holding a user's data.
+
+    The UserShard directory is cached for SHARD_CACHE_SECONDS, so the cache must be
+    shared between processes (as for the data versions) for reads to follow a move
+    at once; writes use directory_entry() instead. Users without an entry are placed
+    by id.
+    '''
+    if not shard_aliases():
+        return DEFAULT_DB_ALIAS
+    alias = cache.get(shard_key(user_id))
+    if alias is None:
+        alias = UserShard.objects.filter(user_id=user_id).values_list('database', flat=True).first()
+        alias = alias or placement(user_id)
+        cache.set(shard_key(user_id), alias, SHARD_CACHE_SECONDS)
+    return alias
+
+
+def directory_entry(user_id):
+    '''
+    Return (shard alias, whether the user is being moved) from the UserShard directory, bypassing the cache.
+    '''
+    entry = UserShard.objects.filter(user_id=user_id).values_list('database', 'moving').first()
+    return entry or (placement(user_id), False)
+
+
+def assign_shard(user_id, alias, moving=False):
+    '''
+    Record that a user's data is on a shard and whether it is being moved away from there.
+    '''
+    UserShard.objects.update_or_create(user_id=user_id, defaults={'database': alias, 'moving': moving})
+    cache.set(shard_key(user_id), alias, SHARD_CACHE_SECONDS)
+
+
+def is_moving(user_id):
+    '''
+    Return True while a user's data is being moved to another shard.
+    '''
+    return UserShard.objects.filter(user_id=user_id, moving=True).exists()
+
+
+def move_settle_seconds():
+    '''
+    Return how long a move waits for the writes admitted before it to finish.
+    '''
+    return getattr(settings, 'SHARD_MOVE_SETTLE_SECONDS', MOVE_SETTLE_SECONDS)
+
+
+@contextmanager
+def using_database(alias):
+    '''
+    Send the queries of sharded models in the enclosed block to the given database alias.
+    '''
+    token = _shard.set(alias)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+
+def using_shard_of(user_id):
+    '''
+    Send the queries of sharded models in the enclosed block to a user's shard.
+    '''
+    return using_database(shard_for(user_id))
+
+
+def current_database():
+    '''
+    Return the alias sharded queries currently go to, or None.
+    '''
+    return _shard.get()
+
+
+def route_process_shard(alias):
+    '''
+    Send the sharded queries of the whole current context to an alias, e.g. in a report worker process.
+    '''
+    _shard.set(alias)
+
+
+def users_on(alias):
+    '''
+    Return the ids of the users whose data is on a database, in id order.
+    '''
+    return [user_id for user_id in User.objects.order_by('id').values_list('id', flat=True)
+            if shard_for(user_id) == alias]
+
+
+def upsert_rows(model_class, values, alias):
+    '''
+    Create or update rows given as {pk: {field: value}} directly in a database, without signals.
+    '''
+    rows = model_class.objects.using(alias)
+    existing = set(rows.filter(pk__in=list(values)).values_list('pk', flat=True))
+    for pk in existing:
+        rows.filter(pk=pk).update(**values[pk])
+    rows.bulk_create([model_class(pk=pk, **fields) for pk, fields in values.items() if pk not in existing])
+
+
+def user_copies(users):
+    '''
+    Return the values of the copies of users kept on shards.
+
+    Shards only need the rows their foreign keys point at; passwords and permissions
+    stay in the default database.
+    '''
+    return {user.id: {'username': user.username, 'password': UNUSABLE_PASSWORD_PREFIX} for user in users}
+
+
+def category_copies(categories):
+    '''
+    Return the values of the copies of categories kept on shards.
+    '''
+    return {category.id: {'name': category.name, 'type': category.type} for category in categories}
+
+
+REFERENCE_COPIES = ((User, user_copies), (Category, category_copies))
+
+
+def copy_categories_to_shards(categories):
+    '''
+    Create or update the copies of categories of the default database on every other shard.
+    '''
+    for alias in shard_aliases():
+        if alias != DEFAULT_DB_ALIAS:
+            upsert_rows(Category, category_copies(categories), alias)
+
+
+def copy_users_to_shards(users):
+    '''
+    Create or update the copies of users of the default database on every other shard.
+    '''
+    for alias in shard_aliases():
+        if alias != DEFAULT_DB_ALIAS:
+            upsert_rows(User, user_copies(users), alias)
+
+
+def sync_reference_rows(alias, batch_size=BATCH_SIZE):
+    '''
+    Copy all users and categories of the default database to a shard; returns the number of rows copied.
+    '''
+    if alias == DEFAULT_DB_ALIAS:
+        return 0
+    copied = 0
+    for model_class, copies in REFERENCE_COPIES:
+        last_id = 0
+        while True:
+            rows = list(model_class.objects.using(DEFAULT_DB_ALIAS).filter(pk__gt=last_id).order_by('pk')[:batch_size])
+            if not rows:
+                break
+            upsert_rows(model_class, copies(rows), alias)
+            copied += len(rows)
+            last_id = rows[-1].pk
+    return copied
+
+
+def place_users(users, alias=None):
+    '''
+    Record the shard of users without one and copy their user rows there.
+
+    Users go to the given alias, or are placed by id.
+    '''
+    if not shard_aliases():
+        return
+    placed = defaultdict(list)
+    for user in users:
+        placed[alias or placement(user.id)].append(user)
+    for shard, shard_users in placed.items():
+        if shard != DEFAULT_DB_ALIAS:
+            upsert_rows(User, user_copies(shard_users), shard)
+        UserShard.objects.bulk_create([UserShard(user_id=user.id, database=shard) for user in shard_users],
+                                      ignore_conflicts=True)
+        for user in shard_users:
+            cache.delete(shard_key(user.id))
+
+
+def purge_user(user_id, alias, batch_size=BATCH_SIZE):
+    '''
+    Delete all rows of a user from one database in batches, without signals; returns the number deleted.
+
+    The copy of the user row goes too, unless the database is the default one.
+    '''
+    deleted = 0
+    for model_class in SHARDED:
+        rows = model_class.objects.using(alias).filter(user_id=user_id)
+        while ids := list(rows.order_by('id').values_list('id', flat=True)[:batch_size]):
+            batch = model_class.objects.using(alias).filter(id__in=ids)
+            deleted += batch._raw_delete(alias)
+    if alias != DEFAULT_DB_ALIAS:
+        copies = User.objects.using(alias).filter(id=user_id)
+        copies._raw_delete(alias)
+    return deleted
+
+
+class ShardRouter:
+    '''
+    Send the queries of users' expenses, incomes, budgets, recurring rules, ledger and rollups to their shard.
+
+    The shard is the one of the object a query is made for (a row's own database or
+    its user's shard, e.g. for user.expense_set) or else the one set with
+    using_database(), which ShardMiddleware does from request.user. A sharded query
+    with neither raises ShardError rather than guess. Every database gets the full
+    schema. Without SHARDS the router does nothing.
+    '''
+    def database(self, model, hints):
+        '''
+        Return the alias of the shard a query of model should use, or None for unsharded models.
+        '''
+        aliases = shard_aliases()
+        if not aliases or model._meta.label_lower not in SHARDED_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None:
+            if instance._state.db in aliases:
+                return instance._state.db
+            user_id = instance.pk if isinstance(instance, User) else getattr(instance, 'user_id', None)
+            if user_id is not None:
+                return shard_for(user_id)
+        alias = _shard.get()
+        if alias is None:
+            raise ShardError(f'{model._meta.label} is sharded by user; query it inside using_shard_of().')
+        return alias
+
+    def db_for_read(self, model, **hints):
+        return self.database(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self.database(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        '''
+        Allow relations between rows of the shards and the users and categories of the default database.
+        '''
+        aliases = shard_aliases()
+        if aliases and {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, *aliases}:
+            return True
+        return None
+
+
+def on_instance_database(handler):
+    '''
+    Run a signal handler of a sharded model with the sharded queries it makes sent to its instance's database.
+    '''
+    @wraps(handler)
+    def wrapper(sender, instance, **kwargs):
+        with using_database(instance._state.db or router.db_for_write(sender, instance=instance)):
+            return handler(sender, instance, **kwargs)
+    return wrapper
+
+
+def request_shard(request):
+    '''
+    Return (shard alias, whether the user is being moved) for the user of a request.
+
+    The alias is None when sharding is off or nobody is logged in. Requests that
+    could change data read the directory itself, so that a move made by another
+    process is never missed for a stale cache; the others use the cached shard.
+    '''
+    if not shard_aliases() or request.user.id is None:
+        return None, False
+    if request.method in SAFE_METHODS:
+        return shard_for(request.user.id), False
+    return directory_entry(request.user.id)
+
+
+def moving_response():
+    '''
+    Return the response turning away a change to the data of a user being moved.
+    '''
+    response = HttpResponse(MOVING_MESSAGE, status=503)
+    response['Retry-After'] = '60'
+    return response
+
+
+class ShardMiddleware:
+    '''
+    Send the sharded queries of a logged-in user's request to the user's shard.
+
+    Put it after AuthenticationMiddleware. Streamed responses keep the routing while
+    they are produced. Requests that could change the data of a user being moved to
+    another shard are turned away with 503 until the move is done. Works in both sync
+    and async stacks.
+    '''
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        alias, moving = request_shard(request)
+        if alias is None:
+            return self.get_response(request)
+        if moving:
+            return moving_response()
+        with using_database(alias):
+            response = self.get_response(request)
+        return keep_context(response, partial(using_database, alias))
+
+    async def __acall__(self, request):
+        alias, moving = await sync_to_async(request_shard)(request)
+        if alias is None:
+            return await self.get_response(request)
+        if moving:
+            return moving_response()
+        with using_database(alias):
+            response = await self.get_response(request)
+        return keep_context(response, partial(using_database, alias))
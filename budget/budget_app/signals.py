@@ -0,0 +1,223 @@
+from functools import partial
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete, pre_migrate, pre_save
+from django.dispatch import receiver
+
+from .archive import delete_archives
+from .caching import bump_categories_version, bump_data_version
+from .models import Category, Expense, Income
+from .importers import transaction_hash
+from .ledger import mirror_row, unmirror_row
+from .rollups import apply_delta, kind_of
+from .sharding import (copy_categories_to_shards, copy_users_to_shards, on_instance_database, place_users, purge_user,
+                       route_process_shard, shard_aliases, shard_for, shard_key, using_database)
+
+
+def rollup_key(instance):
+    '''
+    Return the (user, category, date, amount) values of a ledger row as Python types.
+    '''
+    date = instance._meta.get_field('date').to_python(instance.date)
+    amount = instance._meta.get_field('amount').to_python(instance.amount)
+    return instance.user_id, instance.category_id, date, amount
+
+
+@receiver(pre_save, sender=Expense)
+@receiver(pre_save, sender=Income)
+@on_instance_database
+def remember_previous_values(sender, instance, raw=False, **kwargs):
+    '''
+    Store the values a row had before an update so its old rollup can be decremented.
+    '''
+    instance._rollup_previous = None
+    if raw or instance.pk is None:
+        return
+    previous = sender.objects.filter(pk=instance.pk).first()
+    if previous is not None:
+        instance._rollup_previous = rollup_key(previous)
+
+
+@receiver(pre_save, sender=Expense)
+@receiver(pre_save, sender=Income)
+def set_content_hash(sender, instance, raw=False, **kwargs):
+    '''
+    Store the hash used to skip duplicates when importing statements.
+    '''
+    if raw:
+        return
+    user_id, category_id, date, amount = rollup_key(instance)
+    instance.content_hash = transaction_hash(date, amount, instance.comment)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+@on_instance_database
+def update_rollup_on_save(sender, instance, raw=False, **kwargs):
+    '''
+    Keep monthly rollups current when an expense or income is created or updated.
+    '''
+    if raw:
+        return
+    kind = kind_of(sender)
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous is not None:
+        user_id, category_id, date, amount = previous
+        apply_delta(user_id, category_id, kind, date, -amount, -1)
+    user_id, category_id, date, amount = rollup_key(instance)
+    apply_delta(user_id, category_id, kind, date, amount, 1)
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+@on_instance_database
+def update_rollup_on_delete(sender, instance, **kwargs):
+    '''
+    Keep monthly rollups current when an expense or income is deleted.
+    '''
+    user_id, category_id, date, amount = rollup_key(instance)
+    apply_delta(user_id, category_id, kind_of(sender), date, -amount, -1)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+@on_instance_database
+def bump_version_on_ledger_change(sender, instance, **kwargs):
+    '''
+    Invalidate the cached summaries of the owner of a changed expense or income.
+    '''
+    bump_data_version(instance.user_id)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_version_on_category_change(sender, instance, **kwargs):
+    '''
+    Invalidate all cached summaries when a category changes.
+    '''
+    bump_categories_version()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_version_on_user_change(sender, instance, created=True, **kwargs):
+    '''
+    Start new or deleted accounts on a fresh data version, in case their id is reused.
+    '''
+    if created:
+        bump_data_version(instance.id)
+
+
+@receiver(post_save, sender=Expense)
+@receiver(post_save, sender=Income)
+@on_instance_database
+def mirror_to_ledger_on_save(sender, instance, raw=False, **kwargs):
+    '''
+    Keep the unified ledger in step with a created or updated expense or income.
+    '''
+    if raw:
+        return
+    mirror_row(kind_of(sender), instance)
+
+
+@receiver(post_delete, sender=Expense)
+@receiver(post_delete, sender=Income)
+@on_instance_database
+def mirror_to_ledger_on_delete(sender, instance, **kwargs):
+    '''
+    Remove the ledger transaction of a deleted expense or income.
+    '''
+    unmirror_row(kind_of(sender), instance.id)
+
+
+@receiver(post_save, sender=User)
+def place_new_user(sender, instance, created, raw=False, **kwargs):
+    '''
+    Give a new account its shard.
+    '''
+    if created and not raw and instance._state.db == DEFAULT_DB_ALIAS:
+        place_users([instance])
+
+
+@receiver(post_save, sender=User)
+def copy_user_to_shards(sender, instance, created, update_fields=None, **kwargs):
+    '''
+    Keep the copies of a changed account on the shards current, so its old username is free again everywhere.
+
+    New accounts are copied to their own shard by place_new_user; saves that do not
+    touch the username, such as the one recording a login, are skipped.
+    '''
+    if created or instance._state.db != DEFAULT_DB_ALIAS:
+        return
+    if update_fields is None or 'username' in update_fields:
+        copy_users_to_shards([instance])
+
+
+@receiver(pre_delete, sender=User)
+def delete_user_from_shard(sender, instance, **kwargs):
+    '''
+    Delete the rows of a deleted account from its shard and its copies from every shard.
+
+    The deletion does not cascade to the shards, and migrate_shards copies every
+    account to every shard, so a copy left behind would keep the username taken.
+    '''
+    if shard_aliases() and instance._state.db == DEFAULT_DB_ALIAS:
+        for alias in sorted({shard_for(instance.id), *shard_aliases()}):
+            purge_user(instance.id, alias)
+        cache.delete(shard_key(instance.id))
+
+
+@receiver(post_delete, sender=User)
+def delete_user_archives(sender, instance, **kwargs):
+    '''
+    Delete the archived years of a deleted account, once its rows are gone for good.
+
+    Otherwise they would outlive the account and be served to a later one with the same id.
+    '''
+    if instance._state.db == DEFAULT_DB_ALIAS:
+        transaction.on_commit(partial(delete_archives, instance.id))
+
+
+@receiver(post_save, sender=Category)
+def copy_category_to_shards(sender, instance, raw=False, **kwargs):
+    '''
+    Keep the copies of a category on the shards, which their rows' foreign keys point at, current.
+
+    A copy made inside a shard transaction that rolls back is lost; migrate_shards
+    copies all categories again.
+    '''
+    if instance._state.db == DEFAULT_DB_ALIAS:
+        copy_categories_to_shards([instance])
+
+
+@receiver(post_delete, sender=Category)
+def delete_category_from_shards(sender, instance, **kwargs):
+    '''
+    Delete the copies of a deleted category and, through them, its rows on every shard.
+    '''
+    if instance._state.db != DEFAULT_DB_ALIAS:
+        return
+    for alias in shard_aliases():
+        if alias != DEFAULT_DB_ALIAS:
+            with using_database(alias):
+                Category.objects.using(alias).filter(pk=instance.pk).delete()
+
+
+@receiver(pre_migrate)
+def route_data_migrations(sender, using, **kwargs):
+    '''
+    Run the data migrations of sharded tables against the database being migrated.
+    '''
+    route_process_shard(using)
+
+
+@receiver(post_migrate)
+def end_data_migrations(sender, **kwargs):
+    '''
+    Stop routing sharded queries to the database that was migrated.
+    '''
+    route_process_shard(None)
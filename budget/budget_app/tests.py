@@ -1,17 +1,64 @@
+import asyncio
+import csv
 import datetime
+import gzip
+import io
 import json
-
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from decimal import Decimal
+from unittest import skipUnless
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib.auth.models import User
-from django.http import HttpResponseRedirect
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import ConnectionHandler, DatabaseError, connection, connections, transaction
+from django.db.models import Sum
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.test.client import RequestFactory, Client
-from django.urls import reverse
-
-from .views import user_logout, fetch_expenses, fetch_data, charts_view, get_data
-from .models import Budget, Expense, Income, Category
+from django.urls import resolve, reverse
+from pypdf import PdfReader
+
+from . import async_views
+from .aggregates import MAX_SERIES_YEARS, kind_totals, monthly_series
+from .analytics import insights, load_columns
+from .archive import ArchiveFile, archive_path, archive_year, archived_years
+from .benchmarks import benchmark_cases, clear_seeded, compare_results, concurrency_requests, run_asgi_load, \
+    run_benchmarks, run_wsgi_load, seed_data, untimed_routes
+from .budgets import budget_status, overspend_alerts
+from .caching import cache_stats, cached_for_user
+from .exports import BLOCK_HEADER, FILE_HEADER, ExportError, export_batches, read_columnar
+from .views import user_logout, fetch_expenses, fetch_data, charts_view, get_data, home
+from .models import Budget, Expense, Income, Category, LedgerExpense, LedgerIncome, MonthlyRollup, \
+    ReadOnlyLedgerError, RecurringRule, Transaction, UserShard
 from .forms import ExpenseForm
+from .importers import StatementImporter
+from .metrics import MetricsMiddleware, metrics, sql_shape
+from .pdf_reports import render_pdf_report, worker_pool
+from .rebalance import move_user
+from .recurring import materialize_due, occurrence, schedule
+from .registry import registry
+from .routers import SQLITE_STAMP, ReplicaRouter, choose_database, copy_sqlite_database, current_replica, \
+    is_pinned, keep_replica_reads, measure_lag, monitor, replica_reads
+from .search import search_transactions
+from .sharding import ShardError, assign_shard, directory_entry, is_moving, shard_for, using_database, using_shard_of
+from .reports import csv_lines
 
 
 class HomeViewTestCase(TestCase):
@@ -589,3 +636,2217 @@ class TestViews(TestCase):
         response = self.client.get(self.categories_income_url)
         self.assertEquals(response.status_code, 200)
         self.assertTemplateUsed(response, 'categories_income.html')
+
+
+class MonthlySeriesTestCase(TestCase):
+    """
+    Test case for the grouped monthly aggregation used by the chart views.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and transactions across two years.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.category_income = Category.objects.create(name='Income', type='income')
+        self.category_expense = Category.objects.create(name='Expense', type='expense')
+        Income.objects.create(user=self.user, category=self.category_income, amount=100, date='2024-01-15')
+        Income.objects.create(user=self.user, category=self.category_income, amount=200, date='2024-01-20')
+        Income.objects.create(user=self.user, category=self.category_income, amount=999, date='2023-01-20')
+        Expense.objects.create(user=self.user, category=self.category_expense, amount=25, date='2024-01-10')
+        Expense.objects.create(user=self.user, category=self.category_expense, amount=100, date='2024-03-25')
+        self.client.login(username='testuser', password='12345')
+
+    def test_get_data_single_year(self):
+        """
+        Test that get_data only sums the requested year, using a single rollup query.
+        """
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('get_data'), {'year': 2024})
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(data), 12)
+        self.assertEqual(float(data[0]['income']), 300)
+        self.assertEqual(float(data[0]['expense']), 25)
+        self.assertEqual(float(data[0]['balance']), 275)
+        self.assertEqual(float(data[2]['balance']), -100)
+
+    def test_get_data_year_range(self):
+        """
+        Test that get_data returns one entry per month for a range of years.
+        """
+        response = self.client.get(reverse('get_data'), {'year': 2023, 'end_year': 2024})
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(data), 24)
+        self.assertEqual((data[0]['year'], data[0]['month']), (2023, 1))
+        self.assertEqual(float(data[0]['income']), 999)
+        self.assertEqual(float(data[12]['income']), 300)
+
+    def test_get_data_missing_year(self):
+        """
+        Test that get_data rejects a request without a year.
+        """
+        response = self.client.get(reverse('get_data'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_data_invalid_range(self):
+        """
+        Test that get_data rejects years outside 1-9999, reversed ranges and ranges of too many years.
+        """
+        for params in ({'year': 0}, {'year': 10000}, {'year': 2024, 'end_year': 10000},
+                       {'year': 2024, 'end_year': 2023}, {'year': 1, 'end_year': 9999}, {'year': 2000, 'end_year': 2000 + MAX_SERIES_YEARS}):
+            response = self.client.get(reverse('get_data'), params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+        response = self.client.get(reverse('get_data'), {'year': 2001, 'end_year': 2000 + MAX_SERIES_YEARS})
+        self.assertEqual(len(response.json()), 12 * MAX_SERIES_YEARS)
+
+    def test_charts_view_uses_latest_year(self):
+        """
+        Test that charts_view does not mix months from different years.
+        """
+        response = self.client.get(reverse('charts'))
+        self.assertEqual(response.context['selected_year'], 2024)
+        data = json.loads(response.context['monthly_data'])
+        self.assertEqual(float(data[0]['income']), 300)
+
+
+class MonthlyRollupTestCase(TestCase):
+    """
+    Test case for the incrementally maintained monthly rollup table.
+    """
+    def setUp(self):
+        """
+        Set up method creating user and categories.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.rent = Category.objects.create(name='Rent', type='expense')
+
+    def rollup(self, category, year, month):
+        """
+        Helper method returning (total, count) of a rollup row.
+        """
+        row = MonthlyRollup.objects.filter(user=self.user, category=category, year=year, month=month,
+                                           kind='expense').first()
+        return (row.total, row.count) if row else None
+
+    def test_create_update_delete(self):
+        """
+        Test that rollups follow creating, moving and deleting an expense.
+        """
+        expense = Expense.objects.create(user=self.user, category=self.food, amount=10, date='2024-01-05')
+        Expense.objects.create(user=self.user, category=self.food, amount=5, date='2024-01-07')
+        self.assertEqual(self.rollup(self.food, 2024, 1), (15, 2))
+
+        expense.amount = 20
+        expense.category = self.rent
+        expense.date = datetime.date(2024, 2, 1)
+        expense.save()
+        self.assertEqual(self.rollup(self.food, 2024, 1), (5, 1))
+        self.assertEqual(self.rollup(self.rent, 2024, 2), (20, 1))
+
+        expense.delete()
+        self.assertEqual(self.rollup(self.rent, 2024, 2), (0, 0))
+
+    def test_category_delete_cascades(self):
+        """
+        Test that deleting a category removes its expenses and rollups.
+        """
+        Expense.objects.create(user=self.user, category=self.food, amount=10, date='2024-01-05')
+        self.food.delete()
+        self.assertFalse(MonthlyRollup.objects.exists())
+
+    def test_rebuild_command(self):
+        """
+        Test that the rebuild command repairs rollups after bulk writes that bypass signals.
+        """
+        Expense.objects.bulk_create([
+            Expense(user=self.user, category=self.food, amount=3, date=datetime.date(2024, 3, day))
+            for day in range(1, 11)
+        ])
+        self.assertIsNone(self.rollup(self.food, 2024, 3))
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertEqual(self.rollup(self.food, 2024, 3), (30, 10))
+
+    def test_period_combines_rollups_and_edges(self):
+        """
+        Test that a period spanning partial and whole months is summed correctly.
+        """
+        Expense.objects.create(user=self.user, category=self.food, amount=1, date='2024-01-30')
+        Expense.objects.create(user=self.user, category=self.food, amount=2, date='2024-01-10')
+        Expense.objects.create(user=self.user, category=self.food, amount=4, date='2024-02-15')
+        Expense.objects.create(user=self.user, category=self.rent, amount=8, date='2024-03-01')
+        Expense.objects.create(user=self.user, category=self.rent, amount=16, date='2024-03-02')
+        self.client.login(username='testuser', password='12345')
+        response = self.client.get(reverse('expenses_period'), {'start-date': '2024-01-20',
+                                                                 'end-date': '2024-03-01'})
+        self.assertEqual(response.context['expense_categories'], {'Food': 5.0, 'Rent': 8.0})
+
+
+class CsvReportTestCase(TestCase):
+    """
+    Test case for the streaming CSV report.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and transactions.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+        Income.objects.create(user=self.user, category=self.salary, amount=1000, date='2024-01-01')
+        for day in range(1, 21):
+            Expense.objects.create(user=self.user, category=self.food, amount=day, date=f'2024-02-{day:02d}',
+                                   comment=f'Meal {day}')
+        self.client.login(username='testuser', password='12345')
+
+    def read_rows(self, response):
+        """
+        Helper method parsing a streamed CSV response.
+        """
+        content = b''.join(response.streaming_content).decode('utf-8')
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_csv_report_without_per_row_queries(self):
+        """
+        Test that the report streams all rows from one ledger scan without per-row category queries.
+        """
+        registry.snapshot()  # category names come from the warm registry
+        response = self.client.get(reverse('generate_csv_report'))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        with self.assertNumQueries(1):
+            rows = self.read_rows(response)
+        self.assertEqual(rows[0], ["Section", "Date", "Category", "Amount", "Comment"])
+        self.assertEqual(rows[1], ["Income", "2024-01-01", "Salary", "1000.00", ""])
+        self.assertEqual(rows[2], ["Expense", "2024-02-01", "Food", "1.00", "Meal 1"])
+        self.assertEqual(len(rows), 22)
+
+    def test_csv_report_filters(self):
+        """
+        Test filtering the report by date range and category.
+        """
+        response = self.client.get(reverse('generate_csv_report'), {'start-date': '2024-02-05',
+                                                                     'end-date': '2024-02-07',
+                                                                     'category': self.food.id})
+        rows = self.read_rows(response)
+        self.assertEqual([row[1] for row in rows[1:]], ['2024-02-05', '2024-02-06', '2024-02-07'])
+
+    def test_csv_report_gzip(self):
+        """
+        Test gzip-compressed report output.
+        """
+        response = self.client.get(reverse('generate_csv_report'), {'gzip': '1'})
+        content = gzip.decompress(b''.join(response.streaming_content)).decode('utf-8')
+        self.assertEqual(len(list(csv.reader(io.StringIO(content)))), 22)
+
+    def test_csv_report_invalid_filter(self):
+        """
+        Test that malformed filters are rejected.
+        """
+        response = self.client.get(reverse('generate_csv_report'), {'start-date': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PDF_REPORT_WORKERS=1, PDF_REPORT_ROWS_PER_PART=30)
+class PdfReportTestCase(TestCase):
+    """
+    Test case for the paginated PDF report engine.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and transactions over two years.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+        for month in range(1, 13):
+            Income.objects.create(user=self.user, category=self.salary, amount=1000, date=f'2023-{month:02d}-10')
+            for day in range(1, 6):
+                Expense.objects.create(user=self.user, category=self.food, amount=day,
+                                       date=f'2024-{month:02d}-{day:02d}', comment='Lunch')
+        self.client.login(username='testuser', password='12345')
+
+    def test_pdf_report(self):
+        """
+        Test that the report is split into parts, merged and timed.
+        """
+        response = self.client.get(reverse('generate_pdf_report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        reader = PdfReader(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertGreaterEqual(len(reader.pages), 3)
+        self.assertIn('summary;dur=', response['Server-Timing'])
+        self.assertEqual(response['Server-Timing'].count('expense-2024'), 2)
+        self.assertIn('income-2023-01', response['Server-Timing'])
+        text = reader.pages[0].extract_text()
+        self.assertIn('Food', text)
+        self.assertIn('180', text)
+
+    def test_pdf_report_inside_transaction(self):
+        """
+        Test that rendering a report keeps the caller's transaction and connection, and that the pool is shared.
+        """
+        with transaction.atomic():
+            output = io.BytesIO()
+            timings = render_pdf_report(self.user.id, {}, output)
+            self.assertTrue(connection.in_atomic_block)
+        self.assertEqual(len(timings), 4)
+        self.assertGreaterEqual(len(PdfReader(output).pages), 3)
+        self.assertIs(worker_pool(), worker_pool())
+
+    @override_settings(PDF_REPORT_WORKERS=1, PDF_REPORT_ROWS_PER_PART=100)
+    def test_pdf_report_memory_is_bounded(self):
+        """
+        Test that the peak memory of a report does not grow with the number of parts it is merged from.
+        """
+        def peak_memory(user):
+            with tempfile.TemporaryFile() as output:
+                tracemalloc.start()
+                try:
+                    timings = render_pdf_report(user.id, {}, output)
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+                output.seek(0)
+                pages = len(PdfReader(output).pages)
+            return peak, len(timings), pages
+
+        small, large = seed_data(1, 400, years=1), seed_data(1, 1600, years=4)
+        small_peak, small_parts, small_pages = peak_memory(small[0])
+        large_peak, large_parts, large_pages = peak_memory(large[0])
+        self.assertGreaterEqual(large_parts, 3 * small_parts)
+        self.assertGreaterEqual(large_pages, 3 * small_pages)
+        self.assertLess(large_peak, 1.5 * small_peak)
+
+    def test_pdf_report_filters(self):
+        """
+        Test that date filters skip parts outside the range.
+        """
+        response = self.client.get(reverse('generate_pdf_report'), {'start-date': '2024-06-15'})
+        self.assertNotIn('income', response['Server-Timing'])
+        self.assertIn('expense-2024-01', response['Server-Timing'])
+
+
+class QueryPlanTestCase(TestCase):
+    """
+    Test case checking that the main query of each view uses an index on a large dataset.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Seed many users, categories and transactions, then refresh planner statistics.
+        """
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(50)])
+        categories = Category.objects.bulk_create(
+            [Category(name=f'Category {i}', type='expense' if i % 2 else 'income') for i in range(2000)])
+        start = datetime.date(2015, 1, 1)
+        for model_class in (Expense, Income):
+            model_class.objects.bulk_create([
+                model_class(user=users[i % len(users)], category=categories[i % len(categories)], amount=i % 500,
+                            date=start + datetime.timedelta(days=i % 3000))
+                for i in range(20000)
+            ], batch_size=2000)
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        call_command('backfill_ledger', stdout=io.StringIO())
+        cls.user = users[0]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset):
+        """
+        Assert that the query plan of a queryset contains no full table scan.
+        """
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan)
+        else:
+            self.assertIsNone(re.search(r'\bSCAN \w+$', plan, re.MULTILINE), plan)
+
+    def test_list_queries(self):
+        """
+        Test the expenses_list, incomes_list and fetch_* queries.
+        """
+        for model_class in (Expense, Income):
+            self.assertUsesIndex(model_class.objects.filter(user=self.user).order_by('-date'))
+            self.assertUsesIndex(model_class.objects.filter(
+                user=self.user, date__range=[datetime.date(2016, 1, 1), datetime.date(2016, 1, 31)]).order_by('-date'))
+
+    def test_period_queries(self):
+        """
+        Test the raw ledger and rollup queries of the period and chart views.
+        """
+        self.assertUsesIndex(Expense.objects.filter(
+            user=self.user, date__range=[datetime.date(2016, 1, 1), datetime.date(2016, 1, 14)]
+        ).values('category__name').annotate(total=Sum('amount')).order_by())
+        self.assertUsesIndex(MonthlyRollup.objects.filter(user=self.user, year__range=[2016, 2016]).values(
+            'year', 'month', 'kind').annotate(total=Sum('total')).order_by())
+
+    def test_report_queries(self):
+        """
+        Test the CSV and PDF report queries.
+        """
+        self.assertUsesIndex(Transaction.objects.filter(user=self.user).values_list(
+            'type', 'date', 'category_id', 'amount', 'comment').order_by('-type', 'date', 'source_id'))
+        self.assertUsesIndex(Transaction.objects.filter(user=self.user, type='income').values(
+            'category_id').annotate(total=Sum('amount')).order_by())
+
+    def test_category_queries(self):
+        """
+        Test filtering categories by type.
+        """
+        self.assertUsesIndex(Category.objects.filter(type='expense'))
+
+
+class KeysetPaginationTestCase(TestCase):
+    """
+    Test case for cursor pagination of the expense and income lists.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, category and 45 expenses, several on the same day.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.category = Category.objects.create(name='Food', type='expense')
+        Expense.objects.bulk_create([
+            Expense(user=self.user, category=self.category, amount=i, date=datetime.date(2024, 1, 1 + i // 3))
+            for i in range(45)
+        ])
+        self.client.login(username='testuser', password='12345')
+
+    def test_first_page(self):
+        """
+        Test that the list page only renders the first page.
+        """
+        response = self.client.get(reverse('expenses_list'))
+        self.assertEqual(len(response.context['expenses']), 20)
+        self.assertEqual(response.context['expenses'][0].amount, 44)
+        self.assertIsNotNone(response.context['next_cursor'])
+        self.assertContains(response, 'load-more')
+
+    def test_walk_all_pages(self):
+        """
+        Test that following cursors returns every row exactly once.
+        """
+        amounts = []
+        cursor = ''
+        registry.snapshot()
+        while True:
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('fetch_expenses'), {'format': 'json', 'cursor': cursor})
+            payload = json.loads(response.content)
+            amounts.extend(int(float(row['amount'])) for row in payload['results'])
+            cursor = payload['next_cursor']
+            if not cursor:
+                break
+            self.assertEqual(response['X-Next-Cursor'], cursor)
+        self.assertEqual(amounts, list(range(44, -1, -1)))
+
+    def test_load_more_fragment(self):
+        """
+        Test that a cursor request returns only the list items.
+        """
+        first = self.client.get(reverse('fetch_expenses'))
+        response = self.client.get(reverse('fetch_expenses'), {'cursor': first.context['next_cursor']})
+        self.assertTemplateUsed(response, 'expense_items.html')
+        self.assertTemplateNotUsed(response, 'base.html')
+        self.assertEqual(response.content.decode().count('<li'), 20)
+
+    def test_invalid_cursor(self):
+        """
+        Test that a malformed cursor is rejected.
+        """
+        response = self.client.get(reverse('fetch_expenses'), {'cursor': 'nonsense'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CategoryBreakdownTestCase(TestCase):
+    """
+    Test case for the per-category totals endpoint used by the pie charts.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and transactions.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.rent = Category.objects.create(name='Rent', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+        Expense.objects.create(user=self.user, category=self.food, amount=10, date='2024-01-05')
+        Expense.objects.create(user=self.user, category=self.food, amount=15, date='2024-02-05')
+        Expense.objects.create(user=self.user, category=self.rent, amount=100, date='2024-02-01')
+        Income.objects.create(user=self.user, category=self.salary, amount=500, date='2024-02-01')
+        self.client.login(username='testuser', password='12345')
+
+    def test_all_time_breakdown(self):
+        """
+        Test all-time totals ordered by amount.
+        """
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('category_breakdown'), {'kind': 'expense'})
+        self.assertEqual(json.loads(response.content)['categories'],
+                         [{'name': 'Rent', 'total': 100.0}, {'name': 'Food', 'total': 25.0}])
+
+    def test_period_breakdown(self):
+        """
+        Test totals limited to a date range and kind.
+        """
+        response = self.client.get(reverse('category_breakdown'), {'kind': 'expense', 'start-date': '2024-02-02',
+                                                                   'end-date': '2024-02-29'})
+        self.assertEqual(json.loads(response.content)['categories'], [{'name': 'Food', 'total': 15.0}])
+        response = self.client.get(reverse('category_breakdown'), {'kind': 'income'})
+        self.assertEqual(json.loads(response.content)['categories'], [{'name': 'Salary', 'total': 500.0}])
+
+    def test_invalid_kind(self):
+        """
+        Test that an unknown kind is rejected.
+        """
+        response = self.client.get(reverse('category_breakdown'), {'kind': 'budget'})
+        self.assertEqual(response.status_code, 400)
+
+
+class PeriodComparisonTestCase(TestCase):
+    """
+    Test case for database-side period totals and multi-period comparison.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and expenses over several months.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.rent = Category.objects.create(name='Rent', type='expense')
+        for date, category, amount in (('2023-03-10', self.food, 7), ('2024-02-10', self.food, 20),
+                                       ('2024-02-01', self.rent, 500), ('2024-03-05', self.food, 30),
+                                       ('2024-03-20', self.food, 5), ('2024-03-01', self.rent, 550)):
+            Expense.objects.create(user=self.user, category=category, amount=amount, date=date)
+        self.client.login(username='testuser', password='12345')
+
+    def test_month_comparison_in_one_query(self):
+        """
+        Test a month compared with the previous month and the same month last year.
+        """
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('expenses_period'), {
+                'start-date': '2024-03-01', 'end-date': '2024-03-31', 'compare': ['previous', 'year'], 'format': 'json'})
+        payload = json.loads(response.content)
+        self.assertEqual([period['start_date'] for period in payload['periods']],
+                         ['2024-03-01', '2024-02-01', '2023-03-01'])
+        self.assertEqual(payload['periods'][1]['end_date'], '2024-02-29')
+        self.assertEqual(payload['categories'], [{'name': 'Food', 'totals': [35.0, 20.0, 7.0]},
+                                                 {'name': 'Rent', 'totals': [550.0, 500.0, 0.0]}])
+
+    def test_explicit_partial_periods(self):
+        """
+        Test several explicit ranges that do not align with months.
+        """
+        response = self.client.get(reverse('expenses_period'), {'start-date': ['2024-03-02', '2024-02-05'],
+                                                                 'end-date': ['2024-03-31', '2024-03-01']})
+        self.assertEqual(response.context['expense_categories'], {'Food': 35.0})
+        self.assertEqual(response.context['comparison'], [('Food', [35.0, 20.0]), ('Rent', [0.0, 550.0])])
+
+    def test_invalid_dates(self):
+        """
+        Test that malformed dates render an error instead of failing.
+        """
+        response = self.client.get(reverse('incomes_period'), {'start-date': '2024-13-01', 'end-date': '2024-03-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('error_message', response.context)
+
+
+class StatementImportTestCase(TestCase):
+    """
+    Test case for the CSV statement import pipeline.
+    """
+    def setUp(self):
+        """
+        Set up method creating user and a category.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.client.login(username='testuser', password='12345')
+
+    def test_import_report_format(self):
+        """
+        Test importing the format written by the CSV report, in small batches.
+        """
+        content = ("Section,Date,Category,Amount,Comment\n"
+                   "Income,2024-01-01,Salary,1000.00,\n"
+                   "Expense,2024-01-02,Food,12.50,Lunch\n"
+                   "Expense,2024-01-03,Food,7.00,Coffee\n"
+                   "Expense,2024-01-03,Food,oops,Broken\n")
+        report = StatementImporter(self.user, batch_size=1).import_file(io.StringIO(content))
+        self.assertEqual((report['rows'], report['created'], report['error_count']), (4, 3, 1))
+        self.assertEqual(report['errors'][0][0], 5)
+        self.assertEqual(Expense.objects.filter(user=self.user, category=self.food).count(), 2)
+        self.assertTrue(Category.objects.filter(name='Salary', type='income').exists())
+        self.assertEqual(MonthlyRollup.objects.get(user=self.user, category=self.food).total, Decimal('19.50'))
+
+    def test_import_mapped_format_and_duplicates(self):
+        """
+        Test a mapped statement with signed amounts, then re-importing it.
+        """
+        Expense.objects.create(user=self.user, category=self.food, amount=Decimal('1234.50'),
+                               date='2024-02-01', comment='Rent')
+        content = ("Data;Kwota;Opis\n"
+                   "01.02.2024;-1 234,50;Rent\n"
+                   "02.02.2024;-20,00;Shop\n"
+                   "03.02.2024;3000,00;Salary\n")
+        mapping = {'date': 'Data', 'amount': 'Kwota', 'comment': 'Opis'}
+        importer = StatementImporter(self.user, mapping=mapping, date_format='%d.%m.%Y', delimiter=';',
+                                     decimal_comma=True)
+        report = importer.import_file(io.StringIO(content))
+        self.assertEqual((report['created'], report['duplicates']), (2, 1))
+        self.assertEqual(Income.objects.get(user=self.user).amount, 3000)
+        self.assertEqual(Expense.objects.get(user=self.user, comment='Shop').category.name, 'Import')
+
+        report = importer.import_file(io.StringIO(content))
+        self.assertEqual((report['created'], report['duplicates']), (0, 3))
+
+    def test_missing_columns(self):
+        """
+        Test that a file without the mapped columns is rejected before importing.
+        """
+        with self.assertRaises(ValueError):
+            StatementImporter(self.user).import_file(io.StringIO("Date,Amount\n2024-01-01,5\n"))
+
+    def test_import_view(self):
+        """
+        Test uploading a statement through the import page.
+        """
+        upload = SimpleUploadedFile('statement.csv', b"Section,Date,Category,Amount,Comment\n"
+                                                     b"Expense,2024-01-02,Food,12.50,Lunch\n")
+        response = self.client.post(reverse('import_transactions'), {
+            'file': upload, 'file_format': 'report', 'date_format': '%Y-%m-%d', 'delimiter': ','})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['report']['created'], 1)
+
+
+class BatchApiTestCase(TestCase):
+    """
+    Test case for the JSON list and batch API.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, a category and a few expenses.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.rent = Category.objects.create(name='Rent', type='expense')
+        self.expenses = [Expense.objects.create(user=self.user, category=self.food, amount=Decimal(amount),
+                                                date=f'2024-01-{day:02d}', comment='Shop')
+                         for day, amount in ((1, '10.50'), (2, '20.00'), (3, '30.25'))]
+        self.client.login(username='testuser', password='12345')
+
+    def batch(self, resource, payload):
+        """
+        Helper posting a batch to the API.
+        """
+        return self.client.post(reverse('api_batch', args=[resource]), json.dumps(payload),
+                                content_type='application/json')
+
+    def test_requires_login(self):
+        """
+        Test that anonymous requests get a 401 JSON error instead of a redirect.
+        """
+        self.client.logout()
+        response = self.client.get(reverse('api_list', args=['expenses']))
+        self.assertEqual(response.status_code, 401)
+
+    def test_list_with_fields_cursor_and_cents(self):
+        """
+        Test paging through expenses with a field selection and integer amounts.
+        """
+        url = reverse('api_list', args=['expenses'])
+        data = self.client.get(url, {'fields': 'id,amount', 'amounts': 'cents', 'page_size': 2}).json()
+        self.assertEqual(data['results'], [{'id': self.expenses[2].id, 'amount': 3025},
+                                           {'id': self.expenses[1].id, 'amount': 2000}])
+        data = self.client.get(url, {'fields': 'amount,category_name', 'cursor': data['next_cursor']}).json()
+        self.assertEqual(data, {'results': [{'amount': '10.50', 'category_name': 'Food'}], 'next_cursor': None})
+        self.assertEqual(self.client.get(url, {'fields': 'password'}).status_code, 400)
+
+    def test_batch_create_update_delete(self):
+        """
+        Test applying all three operations at once, keeping rollups in sync.
+        """
+        response = self.batch('expenses', {
+            'create': [{'category': self.rent.id, 'amount': '500.00', 'date': '2024-01-05', 'comment': ''}],
+            'update': [{'id': self.expenses[0].id, 'category': self.rent.id}],
+            'delete': [self.expenses[1].id],
+        })
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual((len(result['created']), result['updated'], result['deleted']), (1, 1, 1))
+        self.assertEqual(Expense.objects.get(id=self.expenses[0].id).category, self.rent)
+        rollups = {row.category_id: row.total for row in MonthlyRollup.objects.filter(user=self.user)}
+        self.assertEqual(rollups, {self.food.id: Decimal('30.25'), self.rent.id: Decimal('510.50')})
+
+    def test_invalid_batch_is_rolled_back(self):
+        """
+        Test that one invalid item rejects the whole batch.
+        """
+        response = self.batch('expenses', {
+            'create': [{'category': self.food.id, 'amount': '1.00', 'date': '2024-01-06'}],
+            'update': [{'id': self.expenses[0].id, 'amount': 'abc'}],
+            'delete': [self.expenses[1].id],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'][0]['operation'], 'update')
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 3)
+
+    def test_duplicate_ids_are_rejected(self):
+        """
+        Test that updating a row twice in one batch is rejected and leaves the rollups alone.
+        """
+        before = {row.category_id: row.total for row in MonthlyRollup.objects.filter(user=self.user)}
+        response = self.batch('expenses', {'update': [{'id': self.expenses[0].id, 'amount': '1.00'},
+                                                      {'id': self.expenses[0].id, 'category': self.rent.id}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [{'operation': 'update', 'index': 1,
+                                                      'errors': {'id': ['Duplicate id.']}}])
+        self.assertEqual({row.category_id: row.total for row in MonthlyRollup.objects.filter(user=self.user)}, before)
+        response = self.batch('categories', {'update': [{'id': self.rent.id, 'name': 'A'},
+                                                        {'id': self.rent.id, 'name': 'B'}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_users_rows_are_not_found(self):
+        """
+        Test that a batch cannot touch another user's expenses.
+        """
+        other = User.objects.create_user(username='other', password='12345')
+        expense = Expense.objects.create(user=other, category=self.food, amount=1, date='2024-01-01')
+        response = self.batch('expenses', {'update': [{'id': expense.id, 'amount': '2.00'}]})
+        self.assertEqual(response.status_code, 400)
+        self.batch('expenses', {'delete': [expense.id]})
+        self.assertTrue(Expense.objects.filter(id=expense.id).exists())
+
+    def test_category_batch(self):
+        """
+        Test creating and renaming categories in one batch.
+        """
+        response = self.batch('categories', {'create': [{'name': 'Salary', 'type': 'income'}],
+                                             'update': [{'id': self.rent.id, 'name': 'Housing'}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Category.objects.get(id=self.rent.id).name, 'Housing')
+        names = [row['name'] for row in self.client.get(reverse('api_list', args=['categories']),
+                                                        {'type': 'income'}).json()['results']]
+        self.assertEqual(names, ['Salary'])
+
+
+class VersionedCacheTestCase(TestCase):
+    """
+    Test case for the per-user versioned cache of summary and chart data.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, a category and an expense.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.expense = Expense.objects.create(user=self.user, category=self.food, amount=100, date='2024-01-10')
+        self.client.login(username='testuser', password='12345')
+
+    def test_repeated_requests_hit_the_cache(self):
+        """
+        Test that an unchanged user's chart data is served without queries.
+        """
+        url = reverse('get_data') + '?year=2024'
+        first = self.client.get(url).json()
+        with self.assertNumQueries(2):  # session and user lookups only
+            second = self.client.get(url).json()
+        self.assertEqual(first, second)
+
+    def test_changes_bump_the_version(self):
+        """
+        Test that saving, deleting and renaming never serve stale totals.
+        """
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 100)
+        self.expense.amount = 150
+        self.expense.save()
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 150)
+        Expense.objects.create(user=self.user, category=self.food, amount=50, date='2024-01-11')
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 200)
+
+        url = reverse('category_breakdown') + '?kind=expense'
+        self.assertEqual(self.client.get(url).json()['categories'][0]['name'], 'Food')
+        self.food.name = 'Groceries'
+        self.food.save()
+        self.assertEqual(self.client.get(url).json()['categories'][0]['name'], 'Groceries')
+
+        self.expense.delete()
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 50)
+
+    def test_other_users_are_not_affected(self):
+        """
+        Test that each user's entries are kept apart.
+        """
+        other = User.objects.create_user(username='other', password='12345')
+        Expense.objects.create(user=other, category=self.food, amount=7, date='2024-01-10')
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 100)
+        self.client.login(username='other', password='12345')
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 7)
+
+    def test_cache_stats(self):
+        """
+        Test that hits and misses are counted and shown to staff only.
+        """
+        self.client.get(reverse('budget_summary'))
+        self.client.get(reverse('budget_summary'))
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        stats = self.client.get(reverse('cache_stats')).json()
+        self.assertGreaterEqual(stats['hits'], 1)
+        self.assertGreaterEqual(stats['misses'], 1)
+
+
+class CategoryRegistryTestCase(TestCase):
+    """
+    Test case for the in-process category registry.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and expenses.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+        for day in range(1, 11):
+            Expense.objects.create(user=self.user, category=self.food, amount=day, date=f'2024-01-{day:02d}')
+        self.client.login(username='testuser', password='12345')
+
+    def test_snapshot_is_reused_until_categories_change(self):
+        """
+        Test that lookups need no queries and a change reloads the registry.
+        """
+        registry.snapshot()
+        with self.assertNumQueries(0):
+            snapshot = registry.snapshot()
+            self.assertEqual(snapshot.name(self.food.id), 'Food')
+            self.assertEqual(snapshot.of_type('income'), [self.salary])
+        Category.objects.create(name='Bonus', type='income')
+        self.assertEqual([category.name for category in registry.snapshot().of_type('income')],
+                         ['Salary', 'Bonus'])
+        self.assertEqual(snapshot.of_type('income'), [self.salary])
+
+    def test_list_resolves_names_without_queries_per_row(self):
+        """
+        Test that a list page renders category names from the registry.
+        """
+        registry.snapshot()
+        with self.assertNumQueries(3):  # session, user and one page of expenses
+            response = self.client.get(reverse('fetch_expenses'), {'cursor': '2024-02-01.0'})
+        self.assertContains(response, 'Food', count=10)
+
+    def test_views_see_added_and_deleted_categories(self):
+        """
+        Test that category views reflect changes made through the category views.
+        """
+        self.client.post(reverse('add_category'), {'new_category': 'Rent', 'category_type': 'expense'})
+        response = self.client.get(reverse('categories_expense'))
+        self.assertContains(response, 'Rent')
+        rent = Category.objects.get(name='Rent')
+        self.client.post(reverse('delete_category', args=[rent.id]))
+        self.assertNotContains(self.client.get(reverse('categories_expense')), 'Rent')
+
+    def test_csv_report_uses_registry_names(self):
+        """
+        Test that renamed categories show up in exports.
+        """
+        self.food.name = 'Groceries'
+        self.food.save()
+        content = b''.join(self.client.get(reverse('generate_csv_report')).streaming_content).decode()
+        self.assertIn('Groceries', content)
+        self.assertNotIn('Food', content)
+
+
+class LedgerTestCase(TestCase):
+    """
+    Test case for the unified signed-amount ledger mirrored from expenses and incomes.
+    """
+    def setUp(self):
+        """
+        Set up method creating user and categories.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+
+    def test_saves_and_deletes_are_mirrored(self):
+        """
+        Test that the ledger follows creates, updates and deletes with signed amounts.
+        """
+        expense = Expense.objects.create(user=self.user, category=self.food, amount=12, date='2024-01-02')
+        Income.objects.create(user=self.user, category=self.salary, amount=100, date='2024-01-01')
+        self.assertEqual(Transaction.objects.filter(user=self.user).aggregate(balance=Sum('amount'))['balance'], 88)
+        expense.amount = 20
+        expense.save()
+        self.assertEqual(LedgerExpense.objects.get(source_id=expense.id).magnitude, 20)
+        self.assertEqual(LedgerIncome.objects.count(), 1)
+        expense.delete()
+        self.assertFalse(LedgerExpense.objects.exists())
+
+    def test_kind_views_are_read_only(self):
+        """
+        Test that the ledger cannot be written through LedgerExpense and LedgerIncome.
+        """
+        Expense.objects.create(user=self.user, category=self.food, amount=12, date='2024-01-02')
+        row = LedgerExpense.objects.get()
+        self.assertEqual(row.amount, -12)
+        with self.assertRaises(ReadOnlyLedgerError):
+            LedgerExpense.objects.create(user=self.user, category=self.food, amount=50, date='2024-01-03')
+        with self.assertRaises(ReadOnlyLedgerError):
+            row.delete()
+        with self.assertRaises(ReadOnlyLedgerError):
+            LedgerIncome.objects.update(amount=1)
+        with self.assertRaises(ReadOnlyLedgerError):
+            LedgerExpense.objects.filter(user=self.user).delete()
+        self.assertEqual(Transaction.objects.get().amount, -12)
+
+    def test_bulk_paths_are_mirrored(self):
+        """
+        Test that statement imports and batch API writes reach the ledger.
+        """
+        content = "Section,Date,Category,Amount,Comment\nExpense,2024-01-02,Food,12.50,Lunch\n"
+        StatementImporter(self.user).import_file(io.StringIO(content))
+        self.client.login(username='testuser', password='12345')
+        expense = Expense.objects.get()
+        self.client.post(reverse('api_batch', args=['expenses']),
+                         json.dumps({'update': [{'id': expense.id, 'amount': '15.00'}]}),
+                         content_type='application/json')
+        self.assertEqual(Transaction.objects.get(source_id=expense.id).amount, Decimal('-15.00'))
+
+    def test_backfill_command(self):
+        """
+        Test that the backfill command copies rows written without signals exactly once.
+        """
+        Expense.objects.bulk_create([
+            Expense(user=self.user, category=self.food, amount=day, date=datetime.date(2024, 3, day))
+            for day in range(1, 8)
+        ])
+        call_command('backfill_ledger', batch_size=3, stdout=io.StringIO())
+        call_command('backfill_ledger', stdout=io.StringIO())
+        self.assertEqual(LedgerExpense.objects.count(), 7)
+        self.assertEqual(LedgerExpense.objects.aggregate(total=Sum('amount'))['total'], -28)
+
+    def test_csv_report_sections(self):
+        """
+        Test that the CSV report lists incomes then expenses with unsigned amounts.
+        """
+        Expense.objects.create(user=self.user, category=self.food, amount=5, date='2024-01-01')
+        Income.objects.create(user=self.user, category=self.salary, amount=100, date='2024-02-01')
+        content = ''.join(csv_lines(self.user, {}))
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual([row[:2] for row in rows[1:]], [['Income', '2024-02-01'], ['Expense', '2024-01-01']])
+        self.assertEqual(rows[2][3], '5.00')
+
+
+@override_settings(ARCHIVE_ROOT=tempfile.mkdtemp())
+class ArchiveTestCase(TestCase):
+    """
+    Test case for archiving closed years into columnar files.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and transactions over two years.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.user_id = self.user.id
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+        Expense.objects.create(user=self.user, category=self.food, amount=Decimal('12.34'), date='2020-01-15',
+                               comment='Lunch')
+        Expense.objects.create(user=self.user, category=self.food, amount=Decimal('5.00'), date='2020-03-01')
+        Income.objects.create(user=self.user, category=self.salary, amount=1000, date='2020-02-01', comment='Pay')
+        Expense.objects.create(user=self.user, category=self.food, amount=7, date='2024-01-01', comment='Lunch')
+        self.client.login(username='testuser', password='12345')
+
+    def tearDown(self):
+        """
+        Remove the archive files written by a test.
+        """
+        shutil.rmtree(os.path.join(settings.ARCHIVE_ROOT, str(self.user_id)), ignore_errors=True)
+
+    def test_archive_moves_rows_and_keeps_rollups(self):
+        """
+        Test that archiving empties the hot tables but not the rollups.
+        """
+        call_command('archive_years', before=2024, stdout=io.StringIO())
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 1)
+        self.assertFalse(Income.objects.exists())
+        self.assertFalse(Transaction.objects.filter(date__year=2020).exists())
+        self.assertEqual(MonthlyRollup.objects.filter(year=2020).aggregate(total=Sum('total'))['total'],
+                         Decimal('1017.34'))
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertEqual(MonthlyRollup.objects.filter(year=2020).aggregate(total=Sum('total'))['total'],
+                         Decimal('1017.34'))
+
+    def test_reports_read_archived_rows(self):
+        """
+        Test that the CSV and PDF reports merge archived and hot rows in order.
+        """
+        call_command('archive_years', before=2024, stdout=io.StringIO())
+        response = self.client.get(reverse('generate_csv_report'))
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[1:], [
+            ['Income', '2020-02-01', 'Salary', '1000.00', 'Pay'],
+            ['Expense', '2020-01-15', 'Food', '12.34', 'Lunch'],
+            ['Expense', '2020-03-01', 'Food', '5.00', ''],
+            ['Expense', '2024-01-01', 'Food', '7.00', 'Lunch'],
+        ])
+        response = self.client.get(reverse('generate_csv_report'), {'start-date': '2020-02-01',
+                                                                     'end-date': '2020-12-31'})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 3)
+
+        response = self.client.get(reverse('generate_pdf_report'))
+        text = ''.join(page.extract_text() for page in PdfReader(io.BytesIO(b''.join(response.streaming_content))).pages)
+        self.assertIn('Pay', text)
+        self.assertIn('24.34', text)
+
+    def test_period_edges_read_archived_rows(self):
+        """
+        Test that partial months of archived years are summed from the archive.
+        """
+        call_command('archive_years', before=2024, stdout=io.StringIO())
+        response = self.client.get(reverse('expenses_period'), {'start-date': '2020-01-10',
+                                                                 'end-date': '2020-03-01'})
+        self.assertEqual(response.context['expense_categories'], {'Food': 17.34})
+
+    def test_archiving_again_keeps_archived_rows(self):
+        """
+        Test that back-dated rows can be added to an archived year.
+        """
+        archive_year(self.user.id, 2020)
+        Expense.objects.create(user=self.user, category=self.food, amount=1, date='2020-01-01')
+        self.assertEqual(archive_year(self.user.id, 2020), 1)
+        with ArchiveFile(archive_path(self.user.id, 2020)) as archive:
+            self.assertEqual([row[1].isoformat() for row in archive.rows('expense')],
+                             ['2020-01-01', '2020-01-15', '2020-03-01'])
+            self.assertEqual(archive.totals('expense')[self.food.id], [Decimal('18.34'), 3])
+
+    def test_deleting_user_deletes_archives(self):
+        """
+        Test that deleting an account deletes its archive files once the deletion commits.
+        """
+        archive_year(self.user_id, 2020)
+        directory = os.path.dirname(archive_path(self.user_id, 2020))
+        self.assertTrue(os.path.isdir(directory))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertFalse(os.path.exists(directory))
+        self.assertEqual(archived_years(self.user_id), [])
+
+
+class AnalyticsTestCase(TestCase):
+    """
+    Test case for the NumPy analytics engine and its endpoint.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and expenses over two months.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.rent = Category.objects.create(name='Rent', type='expense')
+        salary = Category.objects.create(name='Salary', type='income')
+        for day, category, amount in ((5, self.food, '10.00'), (20, self.food, '30.00'), (1, self.rent, '500.00')):
+            Expense.objects.create(user=self.user, category=category, amount=Decimal(amount),
+                                   date=datetime.date(2024, 2, day))
+        for day, category, amount in ((5, self.food, '70.00'), (1, self.rent, '450.00')):
+            Expense.objects.create(user=self.user, category=category, amount=Decimal(amount),
+                                   date=datetime.date(2024, 3, day))
+        Income.objects.create(user=self.user, category=salary, amount=5000, date='2024-03-01')
+        self.client.login(username='testuser', password='12345')
+
+    def test_load_columns(self):
+        """
+        Test that days and cents are loaded as integers with a single query.
+        """
+        with self.assertNumQueries(1):
+            columns = load_columns(self.user.id)
+        self.assertEqual(len(columns), 6)
+        march_first = (datetime.date(2024, 3, 1) - datetime.date(1970, 1, 1)).days
+        self.assertEqual(sorted(columns.cents[columns.days == march_first].tolist()), [-45000, 500000])
+
+    def test_insights(self):
+        """
+        Test rolling spend, month-over-month deltas, percentiles and top movers.
+        """
+        data = insights(self.user, datetime.date(2024, 3, 10))
+        self.assertEqual(data['rolling']['dates'][-1], '2024-03-10')
+        self.assertEqual(data['rolling']['spend_30'][-1], 550.0)  # 2024-02-10 .. 2024-03-10
+        self.assertEqual(data['rolling']['spend_90'][-1], 1060.0)
+        self.assertEqual(data['months'][-2:], ['2024-02', '2024-03'])
+        categories = {category['name']: category for category in data['categories']}
+        self.assertEqual(categories['Food']['deltas'][-1], 30.0)
+        self.assertEqual(categories['Food']['median'], 30.0)
+        self.assertEqual(categories['Rent']['count'], 2)
+        self.assertEqual([mover['name'] for mover in data['top_increases']], ['Food'])
+        self.assertEqual(data['top_decreases'][0], {'name': 'Rent', 'previous': 500.0, 'current': 450.0,
+                                                    'delta': -50.0})
+        self.assertEqual(data['percentiles']['50'], 70.0)
+
+    def test_analytics_data_endpoint(self):
+        """
+        Test the JSON endpoint, its validation and the page.
+        """
+        response = self.client.get(reverse('analytics_data'), {'as_of': '2024-03-31'})
+        self.assertEqual(response.json()['rows'], 6)
+        self.assertEqual(self.client.get(reverse('analytics_data'), {'as_of': 'March'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('analytics')).status_code, 200)
+
+    def test_no_transactions(self):
+        """
+        Test that a user without transactions gets empty insights.
+        """
+        other = User.objects.create_user(username='other', password='12345')
+        data = insights(other, datetime.date(2024, 3, 10))
+        self.assertEqual((data['rows'], data['categories'], data['percentiles']), (0, [], {}))
+        self.assertEqual(data['rolling']['spend_30'][-1], 0)
+
+
+class BudgetTestCase(TestCase):
+    """
+    Test case for budget-vs-actual tracking computed from the monthly rollups.
+    """
+    def setUp(self):
+        """
+        Set up method creating a user, categories, budgets and expenses.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.rent = Category.objects.create(name='Rent', type='expense')
+        self.today = datetime.date(2024, 4, 10)
+        self.food_budget = Budget.objects.create(user=self.user, category=self.food, amount=300)
+        self.rent_budget = Budget.objects.create(user=self.user, category=self.rent, amount=500)
+        self.total_budget = Budget.objects.create(user=self.user, category=None, amount=6000, period='year')
+        Expense.objects.create(user=self.user, category=self.food, amount=120, date='2024-04-02')
+        Expense.objects.create(user=self.user, category=self.food, amount=30, date='2024-03-31')
+        Expense.objects.create(user=self.user, category=self.rent, amount=550, date='2024-04-01')
+        Expense.objects.create(user=self.user, category=self.rent, amount=900, date='2023-12-01')
+
+    def test_status(self):
+        """
+        Test the spent, remaining and projected amounts and states of each period.
+        """
+        statuses = {status['budget']: status for status in budget_status(self.user, self.today)}
+        food = statuses[self.food_budget]
+        self.assertEqual((food['spent'], food['remaining'], food['projected']),
+                         (Decimal('120.00'), Decimal('180.00'), Decimal('360.00')))
+        self.assertEqual(food['state'], 'at_risk')
+        self.assertEqual(statuses[self.rent_budget]['state'], 'over')
+        total = statuses[self.total_budget]
+        self.assertEqual((total['name'], total['spent'], total['state']), ('Wszystkie wydatki', Decimal('700.00'), 'ok'))
+        self.assertEqual(total['end_date'], datetime.date(2024, 12, 31))
+        self.assertEqual([alert['budget'] for alert in overspend_alerts(statuses.values())],
+                         [self.rent_budget, self.food_budget])
+
+    def test_query_count_does_not_grow_with_expenses(self):
+        """
+        Test that the evaluation reads the rollups instead of the expenses.
+        """
+        registry.snapshot()
+        with self.assertNumQueries(2):
+            budget_status(self.user, self.today)
+        Expense.objects.bulk_create([Expense(user=self.user, category=self.food, amount=1, date='2024-04-03')
+                                     for _ in range(50)])
+        with self.assertNumQueries(2):
+            budget_status(self.user, self.today)
+
+    def test_budgets_view(self):
+        """
+        Test listing, adding and deleting budgets, and that other users' budgets are kept.
+        """
+        self.client.login(username='testuser', password='12345')
+        response = self.client.get(reverse('budgets'))
+        self.assertEqual(len(response.context['statuses']), 3)
+        response = self.client.post(reverse('budgets'), {'category': '', 'amount': '-5', 'period': 'month'})
+        self.assertTrue(response.context['form'].errors)
+        response = self.client.post(reverse('budgets'), {'category': self.food.id, 'amount': '50', 'period': 'year'})
+        self.assertRedirects(response, reverse('budgets'))
+        self.assertEqual(Budget.objects.filter(user=self.user).count(), 4)
+
+        other = User.objects.create_user(username='other', password='12345')
+        other_budget = Budget.objects.create(user=other, amount=10)
+        self.client.post(reverse('delete_budget', args=[other_budget.id]))
+        self.client.post(reverse('delete_budget', args=[self.food_budget.id]))
+        self.assertTrue(Budget.objects.filter(id=other_budget.id).exists())
+        self.assertFalse(Budget.objects.filter(id=self.food_budget.id).exists())
+        self.assertIn('budget_alerts', self.client.get(reverse('home')).context)
+
+
+class RecurringRuleTestCase(TestCase):
+    """
+    Test case for recurring rules and the materialization of their occurrences.
+    """
+    def setUp(self):
+        """
+        Set up method creating a user and categories.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.rent = Category.objects.create(name='Rent', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+
+    def create_rule(self, **fields):
+        """
+        Helper method to create a scheduled rule.
+        """
+        values = {'user': self.user, 'category': self.rent, 'kind': 'expense', 'amount': 100,
+                  'start_date': datetime.date(2024, 1, 31)}
+        values.update(fields)
+        rule = schedule(RecurringRule(**values))
+        rule.save()
+        return rule
+
+    def test_occurrences(self):
+        """
+        Test that monthly and yearly dates keep their day where the month allows it.
+        """
+        monthly = RecurringRule(frequency='monthly', interval=1, start_date=datetime.date(2024, 1, 31))
+        self.assertEqual([occurrence(monthly, number) for number in range(3)],
+                         [datetime.date(2024, 1, 31), datetime.date(2024, 2, 29), datetime.date(2024, 3, 31)])
+        yearly = RecurringRule(frequency='yearly', interval=1, start_date=datetime.date(2024, 2, 29))
+        self.assertEqual(occurrence(yearly, 1), datetime.date(2025, 2, 28))
+        weekly = RecurringRule(frequency='weekly', interval=2, start_date=datetime.date(2024, 1, 1))
+        self.assertEqual(occurrence(weekly, 2), datetime.date(2024, 1, 29))
+
+    def test_materialize_is_idempotent(self):
+        """
+        Test that due occurrences are created once, with their ledger rows and rollups.
+        """
+        rule = self.create_rule(end_date=datetime.date(2024, 5, 15))
+        self.create_rule(category=self.salary, kind='income', amount=1000, frequency='daily', interval=10,
+                         start_date=datetime.date(2024, 1, 1))
+        self.assertEqual(materialize_due(datetime.date(2024, 2, 1), batch_size=2), 5)
+        self.assertEqual(materialize_due(datetime.date(2024, 2, 1), batch_size=2), 0)
+        self.assertEqual(materialize_due(datetime.date(2024, 12, 31), batch_size=2), 3 + 33)
+
+        self.assertEqual(list(Expense.objects.order_by('date').values_list('date', flat=True)),
+                         [datetime.date(2024, 1, 31), datetime.date(2024, 2, 29), datetime.date(2024, 3, 31),
+                          datetime.date(2024, 4, 30)])
+        self.assertEqual(Income.objects.count(), 37)
+        self.assertEqual(Transaction.objects.count(), 41)
+        rollup = MonthlyRollup.objects.get(user=self.user, kind='income', year=2024, month=1)
+        self.assertEqual((rollup.total, rollup.count), (Decimal('4000.00'), 4))
+        rule.refresh_from_db()
+        self.assertEqual((rule.occurrences, rule.next_date), (4, None))
+
+    def test_scoped_to_users_and_command(self):
+        """
+        Test the user filter and the management command.
+        """
+        other = User.objects.create_user(username='other', password='12345')
+        self.create_rule()
+        self.create_rule(user=other)
+        self.assertEqual(materialize_due(datetime.date(2024, 3, 1), user_ids=[other.id]), 2)
+        out = io.StringIO()
+        call_command('materialize_recurring', '--until', '2024-03-01', stdout=out)
+        self.assertIn('Created 2 recurring transactions.', out.getvalue())
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 2)
+
+    def test_recurring_view(self):
+        """
+        Test adding a rule through the page, which creates its due occurrences, and deleting it.
+        """
+        self.client.login(username='testuser', password='12345')
+        start_date = datetime.date.today() - datetime.timedelta(days=14)
+        data = {'kind': 'expense', 'category': self.rent.id, 'amount': '25', 'frequency': 'weekly', 'interval': 1,
+                'start_date': start_date.isoformat()}
+        response = self.client.post(reverse('recurring'), dict(data, category=self.salary.id))
+        self.assertIn('category', response.context['form'].errors)
+        response = self.client.post(reverse('recurring'), data)
+        self.assertRedirects(response, reverse('recurring'))
+        self.assertEqual(Expense.objects.filter(user=self.user).count(), 3)
+        rule = RecurringRule.objects.get()
+        self.assertEqual(len(self.client.get(reverse('recurring')).context['rules']), 1)
+        self.client.post(reverse('delete_recurring', args=[rule.id]))
+        self.assertFalse(RecurringRule.objects.exists())
+        self.assertEqual(Expense.objects.count(), 3)
+
+    @override_settings(RECURRING_REQUEST_LIMIT=4)
+    def test_recurring_view_limits_occurrences(self):
+        """
+        Test that adding a rule creates a bounded number of occurrences and leaves the rest to materialize_due.
+        """
+        self.create_rule(start_date=datetime.date.today() - datetime.timedelta(days=5), frequency='daily')
+        self.client.login(username='testuser', password='12345')
+        data = {'kind': 'expense', 'category': self.rent.id, 'amount': '25', 'frequency': 'daily', 'interval': 1,
+                'start_date': (datetime.date.today() - datetime.timedelta(days=9)).isoformat()}
+        self.client.post(reverse('recurring'), data)
+        self.assertEqual(Expense.objects.filter(amount=25).count(), 4)
+        self.assertFalse(Expense.objects.filter(amount=100).exists())
+        self.assertEqual(materialize_due(), 6 + 6)
+        self.assertEqual(Expense.objects.filter(amount=25).count(), 10)
+        self.assertEqual(Transaction.objects.count(), 16)
+
+
+class SearchTestCase(TestCase):
+    """
+    Test case for the full-text search over comments and category names.
+    """
+    def setUp(self):
+        """
+        Set up method creating users, categories and transactions.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.other = User.objects.create_user(username='other', password='12345')
+        self.food = Category.objects.create(name='Jedzenie', type='expense')
+        self.salary = Category.objects.create(name='Pensja', type='income')
+        Expense.objects.create(user=self.user, category=self.food, amount=40, date='2024-01-02',
+                               comment='Pizza w Neapolu')
+        Expense.objects.create(user=self.user, category=self.food, amount=12, date='2024-01-05',
+                               comment='Pizza pizza z kolegami')
+        Expense.objects.create(user=self.other, category=self.food, amount=30, date='2024-01-03', comment='Pizza')
+        Income.objects.create(user=self.user, category=self.salary, amount=5000, date='2024-01-10',
+                              comment='Wypłata styczeń')
+
+    def test_comment_and_category_matches(self):
+        """
+        Test ranking, prefix matching, category names and that other users' rows are not found.
+        """
+        results, has_next = search_transactions(self.user, 'pizza')
+        self.assertEqual([result['comment'] for result in results], ['Pizza pizza z kolegami', 'Pizza w Neapolu'])
+        self.assertFalse(has_next)
+        self.assertEqual(results[1]['category_name'], 'Jedzenie')
+        self.assertEqual(results[1]['amount'], Decimal('40.00'))
+        self.assertEqual(len(search_transactions(self.user, 'Neap')[0]), 1)
+        self.assertEqual(len(search_transactions(self.user, 'pizza neapol')[0]), 1)
+        self.assertEqual([result['kind'] for result in search_transactions(self.user, 'pensja')[0]], ['income'])
+        self.assertEqual(len(search_transactions(self.user, 'jedzenie', kind='income')[0]), 0)
+        self.assertEqual(search_transactions(self.user, ' "*:() '), ([], False))
+
+    def test_index_follows_writes(self):
+        """
+        Test that updates, deletes and bulk writes are reflected in the results.
+        """
+        expense = Expense.objects.get(comment='Pizza w Neapolu')
+        expense.comment = 'Makaron'
+        expense.save()
+        self.assertEqual(len(search_transactions(self.user, 'pizza')[0]), 1)
+        self.assertEqual(len(search_transactions(self.user, 'makaron')[0]), 1)
+        expense.delete()
+        self.assertEqual(len(search_transactions(self.user, 'makaron')[0]), 0)
+        content = "Section,Date,Category,Amount,Comment\nExpense,2024-02-02,Jedzenie,8.50,Kebab\n"
+        StatementImporter(self.user).import_file(io.StringIO(content))
+        self.assertEqual(len(search_transactions(self.user, 'kebab')[0]), 1)
+
+    def test_pages_and_views(self):
+        """
+        Test paging through results in the JSON endpoint and the search page.
+        """
+        self.client.login(username='testuser', password='12345')
+        response = self.client.get(reverse('search_data'), {'q': 'pizza', 'page_size': 1})
+        self.assertEqual(response.json()['next_page'], 2)
+        response = self.client.get(reverse('search_data'), {'q': 'pizza', 'page_size': 1, 'page': 2})
+        self.assertEqual((response.json()['results'][0]['comment'], response.json()['next_page']),
+                         ('Pizza w Neapolu', None))
+        response = self.client.get(reverse('search'), {'q': 'wypłata'})
+        self.assertContains(response, 'Wypłata styczeń')
+
+
+class MetricsTestCase(TestCase):
+    """
+    Test case for the per-route request metrics and their Prometheus endpoint.
+    """
+    def setUp(self):
+        """
+        Set up method creating a user and clearing the recorded metrics.
+        """
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        metrics.reset()
+
+    def test_sql_shape(self):
+        """
+        Test that queries differing only in literals and parameter lists share a shape.
+        """
+        self.assertEqual(sql_shape("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+                         'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?')
+        self.assertEqual(sql_shape('SELECT * FROM t WHERE id = 1'), sql_shape('SELECT * FROM t WHERE id = 2'))
+
+    def test_requests_are_recorded_by_route(self):
+        """
+        Test that latency, status and query counts are exported under the URL pattern.
+        """
+        self.client.login(username='testuser', password='12345')
+        self.client.get(reverse('api_list', args=['expenses']))
+        self.client.get(reverse('api_list', args=['incomes']))
+        with self.settings(METRICS_TOKEN='scraper-secret'):
+            body = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scraper-secret').content.decode()
+        labels = 'route="api/<str:resource>/",method="GET"'
+        self.assertIn(f'budget_requests_total{{{labels},status="200"}} 2', body)
+        self.assertIn(f'budget_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn(f'budget_request_duration_seconds_count{{{labels}}} 2', body)
+        self.assertIn(f'budget_sql_duration_seconds_total{{{labels}}}', body)
+        self.assertIn('# TYPE budget_request_queries histogram', body)
+        self.assertIn('budget_cache_hits_total', body)
+
+    def test_n_plus_one_detection(self):
+        """
+        Test that a request repeating one query shape is counted and logged.
+        """
+        def chatty_view(request):
+            for category_id in range(12):
+                Category.objects.filter(id=category_id).first()
+            return HttpResponse('ok')
+
+        request = RequestFactory().get('/chatty/')
+        request.resolver_match = None
+        with self.assertLogs('budget_app.metrics', 'WARNING') as logs:
+            MetricsMiddleware(chatty_view)(request)
+        self.assertIn('12 x', logs.output[0])
+        self.assertIn('budget_n_plus_one_requests_total{route="<unmatched>",method="GET"} 1', metrics.render())
+
+    def test_endpoint_access(self):
+        """
+        Test that only staff users, the scraper's token and allowed addresses can read the metrics.
+        """
+        # Requests through a local reverse proxy all come from 127.0.0.1.
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+        with self.settings(METRICS_TOKEN='scraper-secret'):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'),
+                                             HTTP_AUTHORIZATION='Bearer scraper-secret').status_code, 200)
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.9']):
+            self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.9').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.login(username='testuser', password='12345')
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+
+class BenchmarkTestCase(TestCase):
+    """
+    Test case for the synthetic data generator and the view benchmark runner.
+    """
+    def test_seed_and_clear(self):
+        """
+        Test that seeded users get the requested rows, mirrored and rolled up, and are cleared again.
+        """
+        users = seed_data(2, 60, seed=1)
+        user = users[0]
+        self.assertEqual(Expense.objects.filter(user=user).count() + Income.objects.filter(user=user).count(), 60)
+        self.assertEqual(Transaction.objects.filter(user=user).count(), 60)
+        self.assertEqual(MonthlyRollup.objects.filter(user=user).aggregate(count=Sum('count'))['count'], 60)
+        self.assertTrue(Income.objects.filter(user=user, category__name='Pensja').exists())
+        self.assertFalse(any(seeded.is_staff for seeded in users))
+        self.assertEqual(clear_seeded(), 2)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_every_route_is_timed(self):
+        """
+        Test that every URL pattern is either benchmarked or deliberately skipped.
+        """
+        self.assertEqual(untimed_routes(), [])
+
+    def test_run_and_compare(self):
+        """
+        Test a small run and the regression check against a baseline.
+        """
+        user = seed_data(1, 30)[0]
+        cases = [case for case in benchmark_cases()
+                 if case[0] in ('charts', 'get_data', 'generate_csv_report', 'cache_stats')]
+        results = run_benchmarks(user, 30, repeat=2, cases=cases)
+        self.assertEqual([result['status'] for result in results], [200, 200, 200, 200])
+        self.assertTrue(all(result['queries'] >= 1 and result['peak_kb'] > 0 for result in results))
+        self.assertFalse(User.objects.get(id=user.id).is_staff)
+        self.assertEqual(User.objects.filter(is_staff=True).count(), 1)
+
+        baseline = {'results': [dict(result, warm_ms=1.0, queries=result['queries'] - 1) for result in results]}
+        slower = [dict(result, warm_ms=100.0) for result in results]
+        regressions = compare_results(baseline, slower)
+        self.assertEqual(len(regressions), 8)
+        self.assertEqual(compare_results({'results': results}, results), [])
+        clear_seeded()
+        self.assertFalse(User.objects.filter(is_staff=True).exists())
+
+
+@override_settings(ROOT_URLCONF='budget.urls_asgi')
+class AsyncViewsTestCase(TestCase):
+    """
+    Test case for the async data endpoints and exports of the ASGI profile.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and transactions and logging the async client in.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+        Income.objects.create(user=self.user, category=self.salary, amount=1000, date='2024-01-10')
+        for day in range(1, 6):
+            Expense.objects.create(user=self.user, category=self.food, amount=day * 10, date=f'2024-02-{day:02d}',
+                                   comment=f'Meal {day}')
+        self.async_client.force_login(self.user)
+        metrics.reset()
+
+    def test_async_routes(self):
+        """
+        Test that the profile serves the data endpoints with async views and keeps every other view.
+        """
+        self.assertIs(resolve(reverse('get_data')).func, async_views.get_data)
+        self.assertTrue(asyncio.iscoroutinefunction(resolve(reverse('generate_pdf_report')).func))
+        self.assertIs(resolve(reverse('home')).func, home)
+
+    async def test_login_required(self):
+        """
+        Test that anonymous requests are redirected to the login page.
+        """
+        await sync_to_async(self.async_client.logout)()
+        response = await self.async_client.get(reverse('budget_summary'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(settings.LOGIN_URL))
+
+    async def test_conditional_get(self):
+        """
+        Test that the async views answer a repeated request for unchanged data with 304.
+        """
+        response = await self.async_client.get(reverse('get_data'), {'year': 2024})
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(reverse('get_data'), {'year': 2024},
+                                               headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get(reverse('generate_csv_report'), headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join([chunk async for chunk in response.streaming_content])).decode()
+        self.assertEqual(len(body.splitlines()), 7)
+
+    async def test_export(self):
+        """
+        Test that the async export streams the user's transactions as NDJSON.
+        """
+        response = await self.async_client.get(reverse('export_data'))
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        body = gzip.decompress(b''.join([chunk async for chunk in response.streaming_content])).decode()
+        self.assertEqual([json.loads(line)['kind'] for line in body.splitlines()], ['income'] + ['expense'] * 5)
+
+    async def test_budget_summary_and_get_data(self):
+        """
+        Test the summary totals and the chart series, and that they share the cache with the sync views.
+        """
+        response = await self.async_client.get(reverse('budget_summary'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['balance'], 850)
+        self.assertEqual(await sync_to_async(kind_totals)(self.user), {'income': 1000, 'expense': 150})
+
+        response = await self.async_client.get(reverse('get_data'), {'year': 2024})
+        data = response.json()
+        self.assertEqual(len(data), 12)
+        self.assertEqual(float(data[1]['expense']), 150)
+        self.assertEqual(float(data[0]['balance']), 1000)
+        response = await self.async_client.get(reverse('get_data'), {'year': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+        hits = cache_stats()['hits']
+        series = await sync_to_async(cached_for_user)(self.user, 'monthly-series', monthly_series, 2024, 2024)
+        self.assertEqual(cache_stats()['hits'], hits + 1)
+        self.assertEqual(len(series), 12)
+
+    async def test_fetch_pages(self):
+        """
+        Test that the async list endpoint pages with cursors like the sync one.
+        """
+        response = await self.async_client.get(reverse('fetch_expenses'), {'format': 'json', 'page_size': 3})
+        first = response.json()
+        self.assertEqual([row['amount'] for row in first['results']], ['50.00', '40.00', '30.00'])
+        self.assertEqual(response['X-Next-Cursor'], first['next_cursor'])
+        response = await self.async_client.get(reverse('fetch_expenses'),
+                                               {'format': 'json', 'page_size': 3, 'cursor': first['next_cursor']})
+        second = response.json()
+        self.assertEqual([row['comment'] for row in second['results']], ['Meal 2', 'Meal 1'])
+        self.assertIsNone(second['next_cursor'])
+
+        response = await self.async_client.get(reverse('fetch_incomes'), {'cursor': 'x'})
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(reverse('fetch_incomes'))
+        self.assertContains(response, 'Salary')
+
+    async def test_csv_report_streams_asynchronously(self):
+        """
+        Test that the CSV report, plain and gzip-compressed, is an async stream of all rows.
+        """
+        response = await self.async_client.get(reverse('generate_csv_report'))
+        self.assertTrue(response.is_async)
+        content = b''.join([block async for block in response.streaming_content]).decode('utf-8')
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0], ['Section', 'Date', 'Category', 'Amount', 'Comment'])
+
+        response = await self.async_client.get(reverse('generate_csv_report'), {'gzip': '1'})
+        compressed = b''.join([block async for block in response.streaming_content])
+        self.assertEqual(gzip.decompress(compressed).decode('utf-8'), content)
+
+    async def test_queries_are_recorded(self):
+        """
+        Test that the metrics middleware counts the queries of async views.
+        """
+        await self.async_client.get(reverse('get_data'), {'year': 2024})
+        body = metrics.render()
+        self.assertRegex(body, r'budget_request_queries_count\{route="data",method="GET"\} 1')
+        self.assertNotIn('budget_request_queries_bucket{route="data",method="GET",le="1"} 1', body)
+
+
+class AsyncReportTestCase(TransactionTestCase):
+    """
+    Test case for exports rendered on other threads, which need committed data.
+    """
+    def setUp(self):
+        """
+        Set up method creating user, categories and transactions.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        for month in range(1, 13):
+            Expense.objects.create(user=self.user, category=self.food, amount=month, date=f'2024-{month:02d}-05',
+                                   comment='Lunch')
+
+    @override_settings(ROOT_URLCONF='budget.urls_asgi')
+    async def test_pdf_report_rendered_on_report_pool(self):
+        """
+        Test that the PDF report is rendered on the report pool and streamed back.
+        """
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(reverse('generate_pdf_report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('summary;dur=', response['Server-Timing'])
+        content = b''.join([block async for block in response.streaming_content])
+        self.assertEqual(len(content), int(response['Content-Length']))
+        text = PdfReader(io.BytesIO(content)).pages[0].extract_text()
+        self.assertIn('Food', text)
+
+    def test_concurrent_load(self):
+        """
+        Test that the WSGI and ASGI load runs serve every request of every client.
+        """
+        requests = concurrency_requests(('get_data', 'fetch_expenses', 'generate_csv_report'))
+        wsgi = run_wsgi_load(self.user, clients=6, rounds=2, threads=2, requests=requests)
+        asgi = run_asgi_load(self.user, clients=6, rounds=2, requests=requests)
+        for result in (wsgi, asgi):
+            self.assertEqual((result['requests'], result['errors']), (12, 0))
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+        self.assertEqual(asgi['mode'], 'asgi')
+
+
+class ReplicaRouterTestCase(TestCase):
+    """
+    Test case for routing reads of reports and charts to a read replica.
+    """
+    def setUp(self):
+        """
+        Set up method creating a user and a category and forgetting the measured replica lag.
+        """
+        cache.clear()
+        monitor.reset()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.addCleanup(monitor.reset)
+
+    def test_router(self):
+        """
+        Test that only reads inside a replica block go to the replica, and never those of categories.
+        """
+        router = ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Expense))
+        with replica_reads('replica'):
+            self.assertEqual(router.db_for_read(Expense), 'replica')
+            self.assertEqual(current_replica(), 'replica')
+            self.assertIsNone(router.db_for_read(Category))
+            self.assertEqual(router.db_for_write(Expense), 'default')
+        self.assertIsNone(current_replica())
+
+    @override_settings(REPLICA_DATABASE='default')
+    def test_writes_pin_reads_to_primary(self):
+        """
+        Test that a user's write pins their reads, and only theirs, to the primary.
+        """
+        other = User.objects.create_user(username='otheruser', password='12345')
+        cache.clear()
+        self.assertFalse(is_pinned(self.user.id))
+        Expense.objects.create(user=self.user, category=self.food, amount=10, date='2024-02-01')
+        self.assertTrue(is_pinned(self.user.id))
+        self.assertFalse(is_pinned(other.id))
+        # A mirror of the primary, as in tests, is never used as a replica.
+        self.assertIsNone(choose_database(other.id))
+
+    def test_streamed_response_keeps_replica(self):
+        """
+        Test that a stream produced after the view returned still reads from the chosen database.
+        """
+        def blocks():
+            yield str(current_replica())
+
+        response = keep_replica_reads(StreamingHttpResponse(blocks()), 'replica')
+        self.assertEqual(b''.join(response.streaming_content), b'replica')
+        response = keep_replica_reads(StreamingHttpResponse(blocks()), None)
+        self.assertEqual(b''.join(response.streaming_content), b'None')
+
+    def test_views_read_primary_without_replica(self):
+        """
+        Test that the marked views work unchanged when no replica is configured.
+        """
+        Expense.objects.create(user=self.user, category=self.food, amount=10, date='2024-02-01')
+        self.client.login(username='testuser', password='12345')
+        self.assertEqual(self.client.get(reverse('get_data'), {'year': 2024}).status_code, 200)
+        response = self.client.get(reverse('generate_csv_report'))
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 2)
+
+    def test_sqlite_stand_in_lag(self):
+        """
+        Test that a copied SQLite replica reports its age, and a replica never copied counts as behind.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        primary = os.path.join(directory, 'primary.sqlite3')
+        with closing(sqlite3.connect(primary)) as source:
+            source.execute('CREATE TABLE numbers (value INTEGER)')
+        handler = ConnectionHandler({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, 'replica.sqlite3')},
+            'empty': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(directory, 'empty.sqlite3')},
+        })
+        self.addCleanup(handler.close_all)
+
+        copy_sqlite_database(primary, handler['default'].settings_dict['NAME'])
+        self.assertLess(measure_lag(handler['default']), 5)
+        with handler['default'].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM numbers')
+            self.assertEqual(cursor.fetchone()[0], 0)
+        with self.assertRaises(DatabaseError):
+            measure_lag(handler['empty'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'Lag of the SQLite stand-in')
+    @override_settings(REPLICA_MAX_LAG_SECONDS=60)
+    def test_lagging_replica_is_unhealthy(self):
+        """
+        Test that the monitor falls back for an unreachable or lagging replica and caches its measurement.
+        """
+        self.assertFalse(monitor.healthy('default'))
+        with connection.cursor() as cursor:
+            for statement in SQLITE_STAMP:
+                cursor.execute(statement.replace('?', '%s'), [time.time() - 30] if '?' in statement else [])
+        self.assertFalse(monitor.healthy('default'))
+        monitor.reset()
+        self.assertTrue(monitor.healthy('default'))
+        with override_settings(REPLICA_MAX_LAG_SECONDS=10):
+            self.assertFalse(monitor.healthy('default'))
+
+
+@override_settings(SHARDS=['default'])
+class ShardRouterTestCase(TestCase):
+    """
+    Test case for sharding users' data, with the default database as the only shard.
+    """
+    def setUp(self):
+        """
+        Set up method creating a user and a category.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+
+    def test_new_user_is_placed(self):
+        """
+        Test that a new account is recorded on a shard.
+        """
+        self.assertEqual(UserShard.objects.get(user=self.user).database, 'default')
+        self.assertEqual(shard_for(self.user.id), 'default')
+
+    def test_sharded_queries_need_a_user(self):
+        """
+        Test that sharded tables are only queried for a known user, and other tables as before.
+        """
+        # A row saved by itself goes to its user's shard.
+        Expense(user=self.user, category=self.food, amount=10, date='2024-02-01').save()
+        with self.assertRaises(ShardError):
+            Expense.objects.count()
+        with using_shard_of(self.user.id):
+            self.assertEqual(Expense.objects.count(), 1)
+            self.assertEqual(MonthlyRollup.objects.get().total, 10)
+        self.assertEqual(self.user.expense_set.count(), 1)
+        self.assertEqual(Category.objects.count(), 1)
+
+    def test_views_use_user_shard(self):
+        """
+        Test that requests, streamed responses included, run on the logged-in user's shard.
+        """
+        self.client.login(username='testuser', password='12345')
+        response = self.client.post(reverse('add_expenses'),
+                                    {'amount': 100, 'category': self.food.id, 'date': '2024-02-28', 'comment': 'Obiad'})
+        self.assertRedirects(response, reverse('expenses_list'))
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 100)
+        response = self.client.get(reverse('generate_csv_report'))
+        self.assertIn('Obiad', b''.join(response.streaming_content).decode())
+
+    def test_moving_user_cannot_write(self):
+        """
+        Test that changes to the data of a user being moved are turned away, and reads are not.
+        """
+        self.client.login(username='testuser', password='12345')
+        assign_shard(self.user.id, 'default', moving=True)
+        response = self.client.post(reverse('add_expenses'),
+                                    {'amount': 100, 'category': self.food.id, 'date': '2024-02-28'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.client.get(reverse('budget_summary')).status_code, 200)
+        with using_shard_of(self.user.id):
+            self.assertFalse(Expense.objects.exists())
+
+    def test_commands(self):
+        """
+        Test that the export and rebuild commands work on the user's shard.
+        """
+        with using_shard_of(self.user.id):
+            Expense.objects.create(user=self.user, category=self.food, amount=10, date='2024-02-01', comment='Obiad')
+        output = io.StringIO()
+        call_command('export_report', 'testuser', '--start-date', '2024-01-01', stdout=output)
+        self.assertEqual(output.getvalue().splitlines()[1], 'Expense,2024-02-01,Food,10.00,Obiad')
+        output = io.StringIO()
+        call_command('rebuild_rollups', '--shard', 'default', stdout=output)
+        self.assertIn('Rebuilt 1 rollup rows for 1 users.', output.getvalue())
+
+
+@skipUnless(len(getattr(settings, 'SHARDS', [])) >= 2, 'Needs two shards, e.g. from budget.settings_shards')
+@override_settings(SHARD_MOVE_SETTLE_SECONDS=0, ARCHIVE_ROOT=tempfile.mkdtemp())
+class MultipleShardsTestCase(TransactionTestCase):
+    """
+    Test case for users' data spread across several shard databases.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        """
+        Set up method creating a category and two users, who land on different shards.
+        """
+        cache.clear()
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+        self.alice = User.objects.create_user(username='alice', password='12345')
+        self.bob = User.objects.create_user(username='bob', password='12345')
+        self.alice_shard, self.bob_shard = shard_for(self.alice.id), shard_for(self.bob.id)
+        self.assertNotEqual(self.alice_shard, self.bob_shard)
+
+    def add(self, model_class, user, **fields):
+        """
+        Create a row of a user on the user's shard.
+        """
+        with using_shard_of(user.id):
+            return model_class.objects.create(user=user, **fields)
+
+    def count(self, model_class, alias, user):
+        """
+        Return the number of rows of a user in a table of one database.
+        """
+        return model_class.objects.using(alias).filter(user=user).count()
+
+    def test_rows_live_on_owner_shard(self):
+        """
+        Test that rows, with their ledger and rollups, are written to their owner's shard.
+        """
+        self.add(Expense, self.alice, category=self.food, amount=10, date='2024-02-01')
+        self.add(Income, self.bob, category=self.salary, amount=100, date='2024-02-10')
+        for model_class in (Expense, Transaction, MonthlyRollup):
+            self.assertEqual(self.count(model_class, self.alice_shard, self.alice), 1)
+            self.assertEqual(self.count(model_class, self.bob_shard, self.alice), 0)
+        self.assertEqual(self.count(Income, self.bob_shard, self.bob), 1)
+        for alias in (self.alice_shard, self.bob_shard):
+            self.assertEqual(Category.objects.using(alias).count(), 2)
+
+    def test_requests_read_own_shard(self):
+        """
+        Test that every user's requests see their own data.
+        """
+        self.client.login(username='alice', password='12345')
+        self.client.post(reverse('add_expenses'), {'amount': 100, 'category': self.food.id, 'date': '2024-02-28'})
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 100)
+        self.assertEqual(len(self.client.get(reverse('fetch_expenses'), {'format': 'json'}).json()['results']), 1)
+        self.client.login(username='bob', password='12345')
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 0)
+
+    def test_move_user(self):
+        """
+        Test that moving a user copies all their rows to the target shard and deletes them from the source.
+        """
+        for day in range(1, 6):
+            self.add(Expense, self.alice, category=self.food, amount=day, date=f'2024-02-0{day}')
+        self.add(Income, self.alice, category=self.salary, amount=100, date='2024-02-10')
+        self.add(Budget, self.alice, category=self.food, amount=50)
+        with using_shard_of(self.alice.id):
+            before = kind_totals(self.alice)
+
+        self.assertEqual(move_user(self.alice.id, self.bob_shard, batch_size=2), 7)
+        self.assertEqual(shard_for(self.alice.id), self.bob_shard)
+        self.assertEqual(UserShard.objects.get(user=self.alice).database, self.bob_shard)
+        for model_class, rows in ((Expense, 5), (Income, 1), (Budget, 1), (Transaction, 6), (MonthlyRollup, 2)):
+            self.assertEqual(self.count(model_class, self.bob_shard, self.alice), rows)
+            self.assertEqual(self.count(model_class, self.alice_shard, self.alice), 0)
+        with using_shard_of(self.alice.id):
+            self.assertEqual(kind_totals(self.alice), before)
+        self.client.login(username='alice', password='12345')
+        self.assertEqual(self.client.get(reverse('budget_summary')).context['total_expense'], 15)
+
+    @override_settings(SHARD_MOVE_SETTLE_SECONDS=1)
+    def test_move_with_writes_in_flight(self):
+        """
+        Test that a write admitted before a move reaches the target shard and writes during the move are turned away.
+        """
+        self.add(Expense, self.alice, category=self.food, amount=10, date='2024-02-01')
+        client = Client()
+        client.force_login(self.alice)
+        admitted = threading.Event()
+
+        def write_during_move():
+            try:
+                # A slow request admitted just before the move started, writing a while after it has.
+                alias, moving = directory_entry(self.alice.id)
+                admitted.set()
+                self.assertFalse(moving)
+                while not is_moving(self.alice.id):
+                    time.sleep(0.01)
+                time.sleep(0.3)
+                with using_database(alias):
+                    Expense.objects.create(user=self.alice, category=self.food, amount=20, date='2024-02-02')
+                return client.post(reverse('add_expenses'),
+                                   {'amount': 30, 'category': self.food.id, 'date': '2024-02-03'}).status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            writer = executor.submit(write_during_move)
+            admitted.wait(5)
+            moved = move_user(self.alice.id, self.bob_shard)
+            self.assertEqual(writer.result(), 503)
+        self.assertEqual(moved, 2)
+        self.assertFalse(is_moving(self.alice.id))
+        self.assertEqual(self.count(Expense, self.bob_shard, self.alice), 2)
+        self.assertEqual(self.count(Expense, self.alice_shard, self.alice), 0)
+        response = client.post(reverse('add_expenses'), {'amount': 30, 'category': self.food.id, 'date': '2024-02-03'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.count(Expense, self.bob_shard, self.alice), 3)
+
+    def test_deletes_reach_shards(self):
+        """
+        Test that deleting a category or a user deletes their rows on every shard.
+        """
+        self.add(Expense, self.alice, category=self.food, amount=10, date='2024-02-01')
+        self.add(Expense, self.bob, category=self.food, amount=20, date='2024-02-01')
+        self.food.delete()
+        self.assertEqual(self.count(Expense, self.alice_shard, self.alice), 0)
+        self.assertEqual(self.count(Expense, self.bob_shard, self.bob), 0)
+        self.assertEqual(self.count(MonthlyRollup, self.bob_shard, self.bob), 0)
+
+        self.add(Income, self.bob, category=self.salary, amount=100, date='2024-02-10')
+        self.bob.delete()
+        self.assertEqual(self.count(Income, self.bob_shard, self.bob), 0)
+        self.assertEqual(self.count(Transaction, self.bob_shard, self.bob), 0)
+        self.assertFalse(User.objects.using(self.bob_shard).filter(id=self.bob.id).exists())
+
+    def test_user_copies_follow_changes(self):
+        """
+        Test that renames reach every copy of a user and that a deleted user's username can be registered again.
+        """
+        call_command('migrate_shards', stdout=io.StringIO())
+        self.bob.username = 'robert'
+        self.bob.save()
+        for alias in (self.alice_shard, self.bob_shard):
+            self.assertEqual(User.objects.using(alias).get(id=self.bob.id).username, 'robert')
+
+        self.alice.delete()
+        for alias in (self.alice_shard, self.bob_shard):
+            self.assertFalse(User.objects.using(alias).filter(username='alice').exists())
+        response = self.client.post(reverse('register'), {'username': 'alice', 'password1': 'Sekretne-haslo-1',
+                                                          'password2': 'Sekretne-haslo-1'})
+        self.assertEqual(response.status_code, 302)
+        alice = User.objects.get(username='alice')
+        self.assertEqual(User.objects.using(shard_for(alice.id)).get(username='alice').id, alice.id)
+
+    def test_category_batch_reaches_shards(self):
+        """
+        Test that categories created or renamed through the batch API are copied to every shard.
+        """
+        self.client.login(username='alice', password='12345')
+        response = self.client.post(reverse('api_batch', args=['categories']),
+                                    json.dumps({'create': [{'name': 'Rent', 'type': 'expense'}],
+                                                'update': [{'id': self.food.id, 'name': 'Groceries'}]}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        rent_id = response.json()['created'][0]
+        for alias in (self.alice_shard, self.bob_shard):
+            names = dict(Category.objects.using(alias).values_list('id', 'name'))
+            self.assertEqual((names[rent_id], names[self.food.id]), ('Rent', 'Groceries'))
+        self.add(Expense, self.bob, category_id=rent_id, amount=10, date='2024-02-01')
+
+    def test_commands(self):
+        """
+        Test that migrate_shards places users without a shard and rebalance_shards moves users.
+        """
+        self.add(Income, self.bob, category=self.salary, amount=100, date='2024-02-10')
+        UserShard.objects.filter(user=self.alice).delete()
+        call_command('migrate_shards', '--place-on', self.bob_shard, stdout=io.StringIO())
+        cache.clear()
+        self.assertEqual(shard_for(self.alice.id), self.bob_shard)
+
+        output = io.StringIO()
+        call_command('rebalance_shards', '--user', str(self.bob.id), '--to', self.alice_shard, stdout=output)
+        self.assertIn(f'Moved 1 rows of user {self.bob.id} from {self.bob_shard} to {self.alice_shard}.',
+                      output.getvalue())
+        self.assertEqual(self.count(Income, self.alice_shard, self.bob), 1)
+
+
+class ConditionalGetTestCase(TestCase):
+    """
+    Test case for answering repeated requests for unchanged data with 304 Not Modified.
+    """
+    def setUp(self):
+        """
+        Set up method creating a user with an expense and logging the client in.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        Expense.objects.create(user=self.user, category=self.food, amount=10, date='2024-02-01', comment='Obiad')
+        self.client.login(username='testuser', password='12345')
+
+    def test_not_modified_without_queries(self):
+        """
+        Test that a request with the current ETag gets 304 without the view querying the data.
+        """
+        response = self.client.get(reverse('get_data'), {'year': 2024})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('get_data'), {'year': 2024}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse([query for query in queries if 'budget_app_' in query['sql']])
+
+    def test_etag_changes(self):
+        """
+        Test that the ETag changes with the user's data, the query string and the view.
+        """
+        first = self.client.get(reverse('get_data'), {'year': 2024})['ETag']
+        self.assertNotEqual(self.client.get(reverse('get_data'), {'year': 2023})['ETag'], first)
+        self.assertNotEqual(self.client.get(reverse('fetch_expenses'))['ETag'], first)
+        Expense.objects.create(user=self.user, category=self.food, amount=5, date='2024-02-02')
+        response = self.client.get(reverse('get_data'), {'year': 2024}, HTTP_IF_NONE_MATCH=first)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.json()[1]['expense']), 15)
+        self.assertNotEqual(response['ETag'], first)
+
+    def test_reports(self):
+        """
+        Test that repeated report downloads are answered with 304 and failed requests get no ETag.
+        """
+        for name in ('generate_csv_report', 'generate_pdf_report'):
+            etag = self.client.get(reverse(name))['ETag']
+            self.assertEqual(self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get(reverse('generate_csv_report'), {'start-date': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_gzip(self):
+        """
+        Test that JSON, HTML and CSV responses are compressed for clients accepting gzip, and PDFs are not.
+        """
+        response = self.client.get(reverse('fetch_expenses'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Obiad', gzip.decompress(response.content).decode())
+        self.assertTrue(response['ETag'].startswith('W/'))
+        response = self.client.get(reverse('generate_csv_report'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertIn('Obiad', gzip.decompress(b''.join(response.streaming_content)).decode())
+        response = self.client.get(reverse('generate_pdf_report'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        response = self.client.get(reverse('get_data'), {'year': 2024})
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class ExportTestCase(TestCase):
+    """
+    Test case for the NDJSON and columnar ledger exports.
+    """
+    def setUp(self):
+        """
+        Set up method creating two users with transactions and logging the first in.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.other = User.objects.create_user(username='otheruser', password='12345')
+        self.food = Category.objects.create(name='Food', type='expense')
+        self.salary = Category.objects.create(name='Salary', type='income')
+        Income.objects.create(user=self.user, category=self.salary, amount=1000, date='2024-01-01')
+        for day in range(1, 8):
+            Expense.objects.create(user=self.user, category=self.food, amount=Decimal(f'{day}.25'),
+                                   date=f'2024-02-{day:02d}', comment=f'Obiad {day}' if day % 2 else None)
+        Expense.objects.create(user=self.other, category=self.food, amount=99, date='2024-02-01')
+        self.client.login(username='testuser', password='12345')
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        archive_root = override_settings(ARCHIVE_ROOT=os.path.join(self.directory, 'archive'))
+        archive_root.enable()
+        self.addCleanup(archive_root.disable)
+
+    def read_ndjson(self, content):
+        """
+        Helper method decoding a gzip-compressed NDJSON export.
+        """
+        return [json.loads(line) for line in gzip.decompress(content).decode('utf-8').splitlines()]
+
+    def test_ndjson_export(self):
+        """
+        Test that the export streams only the user's transactions, in id order, with a cursor on every line.
+        """
+        response = self.client.get(reverse('export_data'), {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.ndjson.gz', response['Content-Disposition'])
+        records = self.read_ndjson(b''.join(response.streaming_content))
+        self.assertEqual(len(records), 8)
+        self.assertEqual(records[0], {
+            'cursor': f"0.{records[0]['id']}", 'id': records[0]['id'], 'user_id': self.user.id, 'kind': 'income',
+            'date': '2024-01-01', 'category_id': self.salary.id, 'category': 'Salary', 'amount': '1000.00',
+            'comment': None,
+        })
+        self.assertEqual(records[1]['amount'], '1.25')
+        self.assertEqual(records[1]['comment'], 'Obiad 1')
+        self.assertEqual([record['id'] for record in records], sorted(record['id'] for record in records))
+
+    def test_resume_after_cursor(self):
+        """
+        Test that an export after a line's cursor continues with the next line.
+        """
+        records = self.read_ndjson(b''.join(self.client.get(reverse('export_data')).streaming_content))
+        response = self.client.get(reverse('export_data'), {'after': records[2]['cursor']})
+        self.assertEqual(self.read_ndjson(b''.join(response.streaming_content)), records[3:])
+        self.assertEqual(self.client.get(reverse('export_data'), {'after': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_data'), {'format': 'xml'}).status_code, 400)
+
+    def test_archived_years_come_first(self):
+        """
+        Test that the rows of archived years are exported before the ledger and can be resumed after.
+        """
+        Expense.objects.create(user=self.user, category=self.food, amount=3, date='2023-05-01', comment='Kino')
+        Income.objects.create(user=self.user, category=self.salary, amount=900, date='2023-06-01')
+        Expense.objects.create(user=self.other, category=self.food, amount=4, date='2023-07-01')
+        archive_year(self.user.id, 2023)
+        archive_year(self.other.id, 2023)
+
+        records = self.read_ndjson(b''.join(self.client.get(reverse('export_data')).streaming_content))
+        self.assertEqual(len(records), 10)
+        self.assertEqual(records[0], {
+            'cursor': f'a.{self.user.id}.2023.1', 'id': None, 'user_id': self.user.id, 'kind': 'income',
+            'date': '2023-06-01', 'category_id': self.salary.id, 'category': 'Salary', 'amount': '900.00',
+            'comment': None,
+        })
+        self.assertEqual((records[1]['cursor'], records[1]['comment']), (f'a.{self.user.id}.2023.2', 'Kino'))
+        self.assertEqual(records[2]['date'], '2024-01-01')
+        response = self.client.get(reverse('export_data'), {'after': records[0]['cursor']})
+        self.assertEqual(self.read_ndjson(b''.join(response.streaming_content)), records[1:])
+        response = self.client.get(reverse('export_data'), {'after': records[1]['cursor']})
+        self.assertEqual(self.read_ndjson(b''.join(response.streaming_content)), records[2:])
+
+        path = os.path.join(self.directory, 'ledger.bgex')
+        call_command('export_ledger', path, format='columnar', stdout=io.StringIO())
+        with open(path, 'rb') as source:
+            blocks = list(read_columnar(source))
+        self.assertEqual([cursor for cursor, columns in blocks][:2],
+                         [f'a.{self.user.id}.2023.2', f'a.{self.other.id}.2023.1'])
+        self.assertEqual(blocks[0][1]['id'].tolist(), [0, 0])
+        self.assertEqual(blocks[0][1]['amount'].tolist(), [90000, 300])
+        self.assertEqual(sum(len(columns['id']) for cursor, columns in blocks), 12)
+
+    def test_bulk_updates_keep_ledger_ids(self):
+        """
+        Test that rows updated in bulk keep their ledger ids, so a resumed export does not repeat them.
+        """
+        records = self.read_ndjson(b''.join(self.client.get(reverse('export_data')).streaming_content))
+        expense = Expense.objects.filter(user=self.user).order_by('id').first()
+        response = self.client.post(reverse('api_batch', args=['expenses']),
+                                    json.dumps({'update': [{'id': expense.id, 'amount': '2.50'}]}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Transaction.objects.get(type='expense', source_id=expense.id).id, records[1]['id'])
+        response = self.client.get(reverse('export_data'), {'after': records[-1]['cursor']})
+        self.assertEqual(self.read_ndjson(b''.join(response.streaming_content)), [])
+        records = self.read_ndjson(b''.join(self.client.get(reverse('export_data')).streaming_content))
+        self.assertEqual(records[1]['amount'], '2.50')
+
+    def test_batches_without_model_instances(self):
+        """
+        Test that batches hold plain tuples of one database, at most chunk_size rows each.
+        """
+        batches = list(export_batches(chunk_size=3))
+        self.assertEqual([len(rows) for index, rows in batches], [3, 3, 3])
+        self.assertEqual({index for index, rows in batches}, {0})
+        self.assertIsInstance(batches[0][1][0], tuple)
+
+    def test_columnar_export(self):
+        """
+        Test that the columnar export decodes to the user's rows, block by block.
+        """
+        response = self.client.get(reverse('export_data'), {'format': 'columnar'})
+        blocks = list(read_columnar(io.BytesIO(b''.join(response.streaming_content))))
+        self.assertEqual(len(blocks), 1)
+        cursor, columns = blocks[0]
+        ids = list(Transaction.objects.filter(user=self.user).order_by('id').values_list('id', flat=True))
+        self.assertEqual(cursor, f'0.{ids[-1]}')
+        self.assertEqual(columns['id'].tolist(), ids)
+        self.assertEqual(columns['kind'].tolist(), [1] + [0] * 7)
+        self.assertEqual(columns['amount'].tolist(), [100000] + [day * 100 + 25 for day in range(1, 8)])
+        self.assertEqual(columns['day'][0], (datetime.date(2024, 1, 1) - datetime.date(1970, 1, 1)).days)
+        self.assertEqual(columns['category_id'].tolist(), [self.salary.id] + [self.food.id] * 7)
+        self.assertEqual([columns['comments'][ref] if ref >= 0 else None for ref in columns['comment']],
+                         [None, 'Obiad 1', None, 'Obiad 3', None, 'Obiad 5', None, 'Obiad 7'])
+        content = b''.join(self.client.get(reverse('export_data'), {'format': 'columnar'}).streaming_content)
+        with self.assertRaises(ExportError):
+            list(read_columnar(io.BytesIO(content[:-1])))
+        with self.assertRaises(ExportError):
+            list(read_columnar(io.BytesIO(b'BGAR' + content[4:])))
+
+    def test_export_command_resume(self):
+        """
+        Test that the command exports all users and that a cut-off export resumes to the same file.
+        """
+        path = os.path.join(self.directory, 'ledger.bgex')
+        call_command('export_ledger', path, format='columnar', chunk_size=4, stdout=io.StringIO())
+        with open(path, 'rb') as source:
+            complete = source.read()
+        blocks = list(read_columnar(io.BytesIO(complete)))
+        self.assertEqual([len(columns['id']) for cursor, columns in blocks], [4, 4, 1])
+
+        # An interrupted run: the first block and part of the second are in the file.
+        rows, payload_size, cursor_size = BLOCK_HEADER.unpack_from(complete, FILE_HEADER.size)
+        first_block_end = FILE_HEADER.size + BLOCK_HEADER.size + cursor_size + payload_size
+        with open(path, 'wb') as output:
+            output.write(complete[:first_block_end + 20])
+        with open(f'{path}.checkpoint', 'w') as output:
+            json.dump({'format': 'columnar', 'user_id': None, 'cursor': blocks[0][0], 'offset': first_block_end},
+                      output)
+        call_command('export_ledger', path, format='columnar', chunk_size=4, resume=True, stdout=io.StringIO())
+        with open(path, 'rb') as source:
+            self.assertEqual(source.read(), complete)
+
+        # Resuming a finished export adds the rows written since.
+        expense = Expense.objects.create(user=self.other, category=self.food, amount=5, date='2024-03-01')
+        call_command('export_ledger', path, format='columnar', chunk_size=4, resume=True, stdout=io.StringIO())
+        with open(path, 'rb') as source:
+            blocks = list(read_columnar(source))
+        self.assertEqual(blocks[-1][1]['amount'].tolist(), [500])
+        self.assertEqual(blocks[-1][1]['user_id'].tolist(), [expense.user_id])
+
+    def test_export_command_user(self):
+        """
+        Test exporting one user's transactions as NDJSON and the command's errors.
+        """
+        path = os.path.join(self.directory, 'ledger.ndjson.gz')
+        call_command('export_ledger', path, user='otheruser', stdout=io.StringIO())
+        with open(path, 'rb') as source:
+            records = self.read_ndjson(source.read())
+        self.assertEqual([(record['user_id'], record['amount']) for record in records], [(self.other.id, '99.00')])
+        with self.assertRaises(CommandError):
+            call_command('export_ledger', path, user='nobody')
+        with self.assertRaises(CommandError):
+            call_command('export_ledger', path, format='columnar', user='otheruser', resume=True)
+        with self.assertRaises(CommandError):
+            call_command('export_ledger', os.path.join(self.directory, 'new.ndjson.gz'), resume=True)
@@ -1,24 +1,37 @@
-import csv
+import hmac
+import io
 import json
+import tempfile
 
 from datetime import datetime, timedelta
 
+from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth import login, logout
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
-from django.db.models import Sum
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, \
+    StreamingHttpResponse
 from django.shortcuts import render, redirect
 
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Table, \
-    TableStyle
-
-from .forms import CategoryForm, ExpenseForm, IncomeForm
-from .models import Budget, Category, Expense, Income
+from .aggregates import available_years, category_matrix, category_totals, comparison_period, kind_totals, \
+    monthly_series, parse_year_range
+from .analytics import insights
+from .budgets import budget_status, overspend_alerts
+from .caching import cache_stats, cached_for_user
+from .conditional import conditional_on_data
+from .exports import EXPORT_FORMATS, export_stream, parse_export_params
+from .forms import BudgetForm, CategoryForm, ExpenseForm, ImportForm, IncomeForm, RecurringRuleForm
+from .importers import StatementImporter
+from .metrics import metrics
+from .models import Budget, Category, Expense, Income, RecurringRule
+from .pagination import keyset_page, page_size_from
+from .pdf_reports import render_pdf_report
+from .recurring import REQUEST_LIMIT, materialize_rule, schedule
+from .registry import registry
+from .reports import csv_lines, gzip_stream, parse_report_filters
+from .routers import read_from_replica
+from .search import search_transactions
 
 
 def home(request):
@@ -31,6 +44,7 @@ def home(request):
         incomes = Income.objects.filter(user=request.user)
         context = {
             'budget': budget,
+            'budget_alerts': overspend_alerts(budget_status(request.user)),
             'expenses': expenses,
             'incomes': incomes
         }
@@ -75,17 +89,83 @@ def user_logout(request):
     return redirect('home')
 
 
+def summary_context(totals):
+    '''
+    Return the template context of the budget summary from the user's totals per kind.
+    '''
+    total_income = totals.get('income') or 0
+    total_expense = totals.get('expense') or 0
+    return {'total_income': total_income, 'total_expense': total_expense, 'balance': total_income - total_expense}
+
+
 @login_required
 def budget_summary(request):
     '''
     Display budget summary.
     '''
-    total_income = Income.objects.filter(user=request.user).aggregate(total_income=Sum('amount'))['total_income'] or 0
-    total_expense = Expense.objects.filter(user=request.user).aggregate(total_expense=Sum('amount'))[
-                        'total_expense'] or 0
-    balance = total_income - total_expense
-    return render(request, 'budget_summary.html',
-                  {'total_income': total_income, 'total_expense': total_expense, 'balance': balance})
+    totals = cached_for_user(request.user, 'kind-totals', kind_totals)
+    return render(request, 'budget_summary.html', summary_context(totals))
+
+
+@login_required
+def budgets_view(request):
+    '''
+    Display the user's budgets with their spend so far and add new ones.
+    '''
+    if request.method == 'POST':
+        form = BudgetForm(request.POST)
+        if form.is_valid():
+            budget = form.save(commit=False)
+            budget.user = request.user
+            budget.save()
+            return redirect('budgets')
+    else:
+        form = BudgetForm()
+    statuses = budget_status(request.user)
+    return render(request, 'budgets.html',
+                  {'form': form, 'statuses': statuses, 'alerts': overspend_alerts(statuses)})
+
+
+@login_required
+def delete_budget(request, budget_id):
+    '''
+    Delete one of the user's budgets.
+    '''
+    if request.method == 'POST':
+        Budget.objects.filter(id=budget_id, user=request.user).delete()
+    return redirect('budgets')
+
+
+@login_required
+def recurring_view(request):
+    '''
+    Display the user's recurring expenses and incomes and add new ones.
+
+    Up to RECURRING_REQUEST_LIMIT occurrences of a new rule that are already due are
+    created right away; the materialize_recurring command creates the rest.
+    '''
+    if request.method == 'POST':
+        form = RecurringRuleForm(request.POST)
+        if form.is_valid():
+            rule = form.save(commit=False)
+            rule.user = request.user
+            schedule(rule).save()
+            materialize_rule(rule, getattr(settings, 'RECURRING_REQUEST_LIMIT', REQUEST_LIMIT))
+            return redirect('recurring')
+    else:
+        form = RecurringRuleForm()
+    rules = RecurringRule.objects.filter(user=request.user).order_by('kind', 'next_date', 'id')
+    return render(request, 'recurring.html', {'form': form, 'rules': registry.snapshot().attach(list(rules))})
+
+
+@login_required
+def delete_recurring(request, rule_id):
+    '''
+    Delete one of the user's recurring rules, keeping the transactions it created.
+    '''
+    if request.method == 'POST':
+        RecurringRule.objects.filter(id=rule_id, user=request.user).delete()
+    return redirect('recurring')
 
 
 @login_required
@@ -93,8 +173,9 @@ def expenses_list(request):
     '''
     Display list of expenses.
     '''
-    expenses = Expense.objects.filter(user=request.user).order_by('-date')
-    return render(request, 'expenses_list.html', {'expenses': expenses})
+    expenses, next_cursor = keyset_page(Expense.objects.filter(user=request.user))
+    registry.snapshot().attach(expenses)
+    return render(request, 'expenses_list.html', {'expenses': expenses, 'next_cursor': next_cursor})
 
 
 @login_required
@@ -102,7 +183,7 @@ def add_expenses(request):
     '''
     Add expenses.
     '''
-    expense_categories = Category.objects.filter(type='expense')
+    expense_categories = registry.snapshot().of_type('expense')
     if request.method == 'POST':
         form = ExpenseForm(request.POST)
         if form.is_valid():
@@ -118,39 +199,73 @@ def add_expenses(request):
     return render(request, 'add_expenses.html', {'form': form, 'expense_categories': expense_categories})
 
 
-@login_required
-def fetch_data(request, model_class, template_name):
+def filter_date_range(filter):
     '''
-    Fetch data based on filter.
+    Return the (start, end) dates of a day/week/month/year filter, or None for no filter.
     '''
-    filter = request.GET.get('filter')
-    user = request.user
+    today = datetime.now().date()
     if filter == 'day':
-        today = datetime.now().date()
-        data = model_class.objects.filter(user=user, date=today).order_by('-date')
+        return today, today
     elif filter == 'week':
-        today = datetime.now().date()
         start_of_week = today - timedelta(days=today.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-        data = model_class.objects.filter(user=user, date__range=[start_of_week, end_of_week]).order_by('-date')
+        return start_of_week, start_of_week + timedelta(days=6)
     elif filter == 'month':
-        today = datetime.now().date()
         start_of_month = today.replace(day=1)
-        end_of_month = start_of_month + timedelta(days=32)
-        end_of_month = end_of_month.replace(day=1) - timedelta(days=1)
-        data = model_class.objects.filter(user=user, date__range=[start_of_month, end_of_month]).order_by('-date')
+        end_of_month = (start_of_month + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        return start_of_month, end_of_month
     elif filter == 'year':
-        today = datetime.now().date()
-        start_of_year = today.replace(month=1, day=1)
-        end_of_year = today.replace(month=12, day=31)
-        data = model_class.objects.filter(user=user, date__range=[start_of_year, end_of_year]).order_by('-date')
+        return today.replace(month=1, day=1), today.replace(month=12, day=31)
+    return None
+
+
+@login_required
+def fetch_data(request, model_class, template_name):
+    '''
+    Fetch one page of data based on filter.
+
+    Requests with a cursor return the next page as a list fragment (or as JSON with
+    format=json), with the following cursor in the X-Next-Cursor header.
+    '''
+    try:
+        data, next_cursor = keyset_page(*page_params(request, model_class))
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor.')
+    registry.snapshot().attach(data)
+    return page_response(request, model_class, template_name, data, next_cursor)
+
+
+def page_params(request, model_class):
+    '''
+    Return the (queryset, cursor, page size) of a fetch_data request, its day/week/month/year filter applied.
+    '''
+    data = model_class.objects.filter(user=request.user)
+    date_range = filter_date_range(request.GET.get('filter', ''))
+    if date_range:
+        data = data.filter(date__range=date_range)
+    return data, request.GET.get('cursor'), page_size_from(request.GET)
+
+
+def page_response(request, model_class, template_name, data, next_cursor):
+    '''
+    Return the response to a fetch_data request for a page of rows with their categories attached.
+    '''
+    name = model_class.__name__.lower()
+    if request.GET.get('format') == 'json':
+        results = [{'id': row.id, 'date': row.date, 'category': row.category.name, 'amount': row.amount,
+                    'comment': row.comment} for row in data]
+        response = JsonResponse({'results': results, 'next_cursor': next_cursor})
     else:
-        data = model_class.objects.filter(user=user)
-    context = {model_class.__name__.lower() + 's': data}
-    return render(request, template_name, context)
+        if request.GET.get('cursor'):
+            template_name = f'{name}_items.html'
+        context = {name + 's': data, 'next_cursor': next_cursor, 'filter': request.GET.get('filter', '')}
+        response = render(request, template_name, context)
+    if next_cursor:
+        response['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @login_required
+@conditional_on_data
 def fetch_expenses(request):
     '''
     Fetch expenses data.
@@ -159,38 +274,53 @@ def fetch_expenses(request):
 
 
 @login_required
+def period_data(request, kind, template_name):
+    '''
+    Display per-category totals within one or more periods.
+
+    Several start-date/end-date pairs may be given, and compare=previous and/or
+    compare=year add the preceding period and the same period a year earlier. All
+    periods are computed together and returned as a category x period matrix.
+    '''
+    if request.method != 'GET':
+        return render(request, template_name, {'error_message': 'HTTP method not supported.'})
+    start_date_strs = request.GET.getlist('start-date')
+    end_date_strs = request.GET.getlist('end-date')
+    if not start_date_strs or len(start_date_strs) != len(end_date_strs) or not all(start_date_strs + end_date_strs):
+        return render(request, template_name, {'error_message': 'Please provide both start and end dates.'})
+    try:
+        periods = [(datetime.strptime(start_date_str, '%Y-%m-%d').date(),
+                    datetime.strptime(end_date_str, '%Y-%m-%d').date())
+                   for start_date_str, end_date_str in zip(start_date_strs, end_date_strs)]
+        periods += [comparison_period(*periods[0], compare) for compare in request.GET.getlist('compare')]
+    except ValueError:
+        return render(request, template_name, {'error_message': 'Please provide valid dates.'})
+
+    matrix = category_matrix(request.user, kind, periods)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'periods': [{'start_date': start_date, 'end_date': end_date} for start_date, end_date in periods],
+            'categories': [{'name': name, 'totals': [float(total) for total in totals]}
+                           for name, totals in sorted(matrix.items())],
+        })
+
+    start_date, end_date = periods[0]
+    categories_float = {name: float(totals[0]) for name, totals in matrix.items() if totals[0]}
+    comparison = [(name, [float(total) for total in totals]) for name, totals in sorted(matrix.items())]
+    return render(request, template_name, {f'{kind}_categories': categories_float,
+                                           'start_date': start_date,
+                                           'end_date': end_date,
+                                           'periods': periods if len(periods) > 1 else [],
+                                           'comparison': comparison if len(periods) > 1 else []})
+
+
+@login_required
+@read_from_replica
 def expenses_period(request):
     '''
     Display expenses within a period.
     '''
-    if request.method == 'GET':
-        start_date_str = request.GET.get('start-date')
-        end_date_str = request.GET.get('end-date')
-
-        if start_date_str and end_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            expenses = Expense.objects.filter(user=request.user, date__range=[start_date, end_date])
-
-            expense_categories = {}
-            for expense in expenses:
-                category_name = expense.category.name
-                amount = expense.amount
-                if category_name in expense_categories:
-                    expense_categories[category_name] += amount
-                else:
-                    expense_categories[category_name] = amount
-
-            expense_categories_float = {category: float(amount) for category, amount in expense_categories.items()}
-
-            return render(request, 'expenses_period.html', {'expense_categories': expense_categories_float,
-                                                            'start_date': start_date,
-                                                            'end_date': end_date})
-        else:
-            return render(request, 'expenses_period.html',
-                          {'error_message': 'Please provide both start and end dates.'})
-    else:
-        return render(request, 'expenses_period.html', {'error_message': 'HTTP method not supported.'})
+    return period_data(request, 'expense', 'expenses_period.html')
 
 
 @login_required
@@ -198,8 +328,9 @@ def incomes_list(request):
     '''
     Display list of incomes.
     '''
-    incomes = Income.objects.filter(user=request.user).order_by('-date')
-    return render(request, 'incomes_list.html', {'incomes': incomes})
+    incomes, next_cursor = keyset_page(Income.objects.filter(user=request.user))
+    registry.snapshot().attach(incomes)
+    return render(request, 'incomes_list.html', {'incomes': incomes, 'next_cursor': next_cursor})
 
 
 @login_required
@@ -218,12 +349,13 @@ def add_income(request):
                                            comment=comment)
             return redirect('incomes_list')
     else:
-        categories = Category.objects.filter(type='income').distinct()
+        categories = registry.snapshot().of_type('income')
         form = IncomeForm()
     return render(request, 'add_incomes.html', {'form': form, 'income_categories': categories})
 
 
 @login_required
+@conditional_on_data
 def fetch_incomes(request):
     '''
     Fetch incomes data.
@@ -232,90 +364,196 @@ def fetch_incomes(request):
 
 
 @login_required
+@read_from_replica
 def incomes_period(request):
     '''
     Display incomes within a period.
     '''
-    if request.method == 'GET':
-        start_date_str = request.GET.get('start-date')
-        end_date_str = request.GET.get('end-date')
-
-        if start_date_str and end_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            incomes = Income.objects.filter(user=request.user, date__range=[start_date, end_date])
-
-            income_categories = {}
-            for income in incomes:
-                category_name = income.category.name
-                amount = income.amount
-                if category_name in income_categories:
-                    income_categories[category_name] += amount
-                else:
-                    income_categories[category_name] = amount
-
-            income_categories_float = {category: float(amount) for category, amount in income_categories.items()}
-
-            return render(request, 'incomes_period.html', {'income_categories': income_categories_float,
-                                                           'start_date': start_date,
-                                                           'end_date': end_date})
-        else:
-            return render(request, 'incomes_period.html', {'error_message': 'Please provide both start and end dates.'})
+    return period_data(request, 'income', 'incomes_period.html')
+
+
+@login_required
+def import_transactions(request):
+    '''
+    Import expenses and incomes from an uploaded CSV statement.
+    '''
+    context = {}
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            importer = StatementImporter(request.user, mapping=form.mapping(),
+                                         date_format=form.cleaned_data['date_format'],
+                                         delimiter=form.cleaned_data['delimiter'],
+                                         decimal_comma=form.cleaned_data['decimal_comma'])
+            text_stream = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+            try:
+                context['report'] = importer.import_file(text_stream)
+            except ValueError as error:
+                context['error_message'] = str(error)
+            except UnicodeDecodeError:
+                context['error_message'] = 'The file must be UTF-8 encoded.'
     else:
-        return render(request, 'incomes_period.html', {'error_message': 'HTTP method not supported.'})
+        form = ImportForm()
+    context['form'] = form
+    return render(request, 'import.html', context)
 
 
 @login_required
+@read_from_replica
 def charts_view(request):
     '''
     Display charts.
     '''
-    available_years = Expense.objects.filter(user=request.user).dates('date', 'year')
-    years = [year.year for year in available_years]
-
-    monthly_data = []
-
-    for month in range(1, 13):
-        monthly_income = \
-            Income.objects.filter(user=request.user, date__month=month).aggregate(total_income=Sum('amount'))[
-                'total_income'] or 0
-        monthly_expense = \
-            Expense.objects.filter(user=request.user, date__month=month).aggregate(total_expense=Sum('amount'))[
-                'total_expense'] or 0
-        monthly_balance = monthly_income - monthly_expense
-        monthly_data.append({'income': monthly_income, 'expense': monthly_expense, 'balance': monthly_balance})
+    years = cached_for_user(request.user, 'available-years', available_years)
+    selected_year = years[-1] if years else datetime.now().year
 
+    monthly_data = cached_for_user(request.user, 'monthly-series', monthly_series, selected_year, selected_year)
     data_json = json.dumps(monthly_data, cls=DjangoJSONEncoder)
 
-    return render(request, 'charts.html', {'monthly_data': data_json, 'years': years})
+    return render(request, 'charts.html', {'monthly_data': data_json, 'years': years,
+                                           'selected_year': selected_year})
 
 
 @login_required
+@conditional_on_data
+@read_from_replica
 def get_data(request):
     '''
     Get data for charts.
     '''
-    year = request.GET.get('year')
-    monthly_data = []
-
-    for month in range(1, 13):
-        monthly_income = Income.objects.filter(user=request.user, date__year=year, date__month=month).aggregate(
-            total_income=Sum('amount'))['total_income'] or 0
-        monthly_expense = Expense.objects.filter(user=request.user, date__year=year, date__month=month).aggregate(
-            total_expense=Sum('amount'))['total_expense'] or 0
-        monthly_balance = monthly_income - monthly_expense
-        monthly_data.append({'income': monthly_income, 'expense': monthly_expense, 'balance': monthly_balance})
+    try:
+        year, end_year = parse_year_range(request.GET)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
 
+    monthly_data = cached_for_user(request.user, 'monthly-series', monthly_series, year, end_year)
     return JsonResponse(monthly_data, safe=False)
 
 
+@login_required
+def analytics_view(request):
+    '''
+    Display spending insights.
+    '''
+    return render(request, 'analytics.html')
+
+
+@login_required
+def analytics_data(request):
+    '''
+    Get spending insights (rolling spend, month-over-month changes, percentiles) as JSON.
+    '''
+    try:
+        as_of = datetime.strptime(request.GET['as_of'], '%Y-%m-%d').date() if request.GET.get('as_of') \
+            else datetime.now().date()
+    except ValueError:
+        return JsonResponse({'error': 'as_of must be in YYYY-MM-DD format.'}, status=400)
+    return JsonResponse(cached_for_user(request.user, 'insights', insights, as_of))
+
+
+def run_search(request):
+    '''
+    Run the search described by the q, kind, page and page_size parameters.
+
+    Returns (query, kind, page, results, has_next).
+    '''
+    query = request.GET.get('q', '').strip()
+    kind = request.GET.get('kind') if request.GET.get('kind') in ('expense', 'income') else None
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    results, has_next = search_transactions(request.user, query, page, page_size_from(request.GET), kind)
+    return query, kind, page, results, has_next
+
+
+@login_required
+def search_view(request):
+    '''
+    Search the user's expenses and incomes by comment and category name.
+    '''
+    query, kind, page, results, has_next = run_search(request)
+    return render(request, 'search.html', {'query': query, 'kind': kind or '', 'page': page, 'results': results,
+                                           'previous_page': page - 1 if page > 1 else None,
+                                           'next_page': page + 1 if has_next else None})
+
+
+@login_required
+def search_data(request):
+    '''
+    Get one page of search results as JSON.
+    '''
+    query, kind, page, results, has_next = run_search(request)
+    return JsonResponse({'query': query, 'page': page, 'next_page': page + 1 if has_next else None,
+                         'results': results}, encoder=DjangoJSONEncoder)
+
+
+@login_required
+def category_breakdown(request):
+    '''
+    Get per-category totals of expenses or incomes for charts, optionally within a period.
+    '''
+    kind = request.GET.get('kind')
+    if kind not in ('expense', 'income'):
+        return JsonResponse({'error': 'kind must be expense or income.'}, status=400)
+    date_range = filter_date_range(request.GET.get('filter'))
+    start_date_str = request.GET.get('start-date')
+    end_date_str = request.GET.get('end-date')
+    if start_date_str and end_date_str:
+        try:
+            date_range = (datetime.strptime(start_date_str, '%Y-%m-%d').date(),
+                          datetime.strptime(end_date_str, '%Y-%m-%d').date())
+        except ValueError:
+            return JsonResponse({'error': 'Dates must be in YYYY-MM-DD format.'}, status=400)
+
+    totals = cached_for_user(request.user, 'category-totals', category_totals, kind, *(date_range or ()))
+    categories = [{'name': name, 'total': float(total)}
+                  for name, total in sorted(totals.items(), key=lambda item: item[1], reverse=True)]
+    return JsonResponse({'kind': kind, 'categories': categories})
+
+
+@user_passes_test(lambda user: user.is_staff)
+def cache_stats_view(request):
+    '''
+    Get the hit and miss counts of the summary cache in this process.
+    '''
+    return JsonResponse(cache_stats())
+
+
+def metrics_allowed(request):
+    '''
+    Return True if a request may read the metrics.
+
+    Staff users may, as may a scraper sending METRICS_TOKEN as its bearer token or
+    connecting from one of METRICS_ALLOWED_IPS. The list is empty by default, as
+    behind a reverse proxy every request comes from the proxy's address.
+    '''
+    if request.user.is_staff:
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if token and scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode()):
+        return True
+    return request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ())
+
+
+def metrics_view(request):
+    '''
+    Get the request, SQL and cache metrics of this process in the Prometheus text format.
+    '''
+    if not metrics_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @login_required
 def categories_view(request):
     '''
     Display categories.
     '''
-    expense_categories = Category.objects.filter(type='expense')
-    income_categories = Category.objects.filter(type='income')
+    categories = registry.snapshot()
+    expense_categories = categories.of_type('expense')
+    income_categories = categories.of_type('income')
     return render(request, 'categories.html',
                   {'expense_categories': expense_categories, 'income_categories': income_categories})
 
@@ -345,7 +583,7 @@ def categories_expense(request):
     '''
     Display expense categories.
     '''
-    expense_categories = Category.objects.filter(type='expense')
+    expense_categories = registry.snapshot().of_type('expense')
     return render(request, 'categories_expense.html', {'expense_categories': expense_categories})
 
 
@@ -354,7 +592,7 @@ def categories_income(request):
     '''
     Display income categories.
     '''
-    income_categories = Category.objects.filter(type='income')
+    income_categories = registry.snapshot().of_type('income')
     return render(request, 'categories_income.html', {'income_categories': income_categories})
 
 
@@ -377,61 +615,84 @@ def report_view(request):
 
 
 @login_required
+@conditional_on_data
+@read_from_replica
 def generate_csv_report(request):
     '''
-    Generate CSV report.
+    Generate CSV report, optionally filtered by date range and category and gzip-compressed.
+    '''
+    return csv_report_response(request)
+
+
+def csv_report_response(request, stream=iter):
     '''
-    incomes = Income.objects.filter(user=request.user)
-    expenses = Expense.objects.filter(user=request.user)
+    Return the streamed CSV report response of a request; stream wraps the blocking content iterator.
+    '''
+    try:
+        filters = parse_report_filters(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid report filters.')
     filename = f"Report_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
-    response = HttpResponse(content_type='text/csv')
+    lines = csv_lines(request.user, filters)
+    if request.GET.get('gzip'):
+        response = StreamingHttpResponse(stream(gzip_stream(lines)), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(stream(lines), content_type='text/csv')
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    writer = csv.writer(response)
-    writer.writerow(["Section", "Date", "Category", "Amount", "Comment"])
-    for income in incomes:
-        writer.writerow(
-            ["Income", income.date.strftime("%Y-%m-%d"), income.category.name, income.amount, income.comment])
-    for expense in expenses:
-        writer.writerow(
-            ["Expense", expense.date.strftime("%Y-%m-%d"), expense.category.name, expense.amount, expense.comment])
     return response
 
 
 @login_required
+@conditional_on_data
+@read_from_replica
 def generate_pdf_report(request):
     '''
-    Generate PDF report.
-    '''
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="Report.pdf"'
-    doc = SimpleDocTemplate(response, pagesize=letter)
-    styles = getSampleStyleSheet()
-    data = []
-
-    incomes = Income.objects.filter(user=request.user)
-    expenses = Expense.objects.filter(user=request.user)
-
-    data.append([styles['Heading1']('Income')])
-    data.append([styles['Normal']("Date"), styles['Normal']("Category"), styles['Normal']("Amount"),
-                 styles['Normal']("Comment")])
-    for income in incomes:
-        data.append([income.date.strftime("%Y-%m-%d"), income.category.name, income.amount, income.comment])
-
-    data.append([styles['Heading1']('Expenses')])
-    data.append([styles['Normal']("Date"), styles['Normal']("Category"), styles['Normal']("Amount"),
-                 styles['Normal']("Comment")])
-    for expense in expenses:
-        data.append([expense.date.strftime("%Y-%m-%d"), expense.category.name, expense.amount, expense.comment])
-
-    table = Table(data)
-    table.setStyle(TableStyle([('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                               ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                               ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                               ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                               ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                               ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                               ('GRID', (0, 0), (-1, -1), 1, colors.black)]))
-    doc.build([table])
+    Generate PDF report, optionally filtered by date range and category.
+    '''
+    try:
+        filters = parse_report_filters(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid report filters.')
+    output = tempfile.TemporaryFile()
+    timings = render_pdf_report(request.user.id, filters, output)
+    return pdf_report_response(output, timings)
+
+
+def pdf_report_response(output, timings):
+    '''
+    Return the response sending a rendered PDF report file, with its section timings in Server-Timing.
+    '''
+    output.seek(0)
+    response = FileResponse(output, as_attachment=True, filename='Report.pdf', content_type='application/pdf')
+    response['Server-Timing'] = ', '.join(f'{name};dur={elapsed * 1000:.1f}' for name, elapsed in timings)
+    return response
+
+
+@login_required
+@conditional_on_data
+@read_from_replica
+def export_data(request):
+    '''
+    Stream all of the user's transactions as gzip-compressed NDJSON or in the columnar format,
+    optionally after a cursor.
+    '''
+    return export_response(request)
+
+
+def export_response(request, stream=iter):
+    '''
+    Return the streamed export response of a request; stream wraps the blocking content iterator.
+    '''
+    try:
+        export_format, after = parse_export_params(request.GET)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid export parameters.')
+    content_type, extension = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(stream(export_stream(export_format, request.user.id, after)),
+                                     content_type=content_type)
+    filename = f"Export_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.{extension}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
     return response
 
 